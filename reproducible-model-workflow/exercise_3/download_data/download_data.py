@@ -1,11 +1,13 @@
 #!/usr/bin/env python
 import argparse
 import logging
+import os
 import pathlib
 import wandb
-import requests
 import tempfile
 
+from pipeline_utils import downloader
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -16,35 +18,39 @@ def go(args):
     # Derive the base name of the file from the URL
     basename = pathlib.Path(args.file_url).name.split("?")[0].split("#")[0]
 
-    # Download file, streaming so we can download files larger than
-    # the available memory. We use a named temporary file that gets
-    # destroyed at the end of the context, so we don't leave anything
-    # behind and the file gets removed even in case of errors
+    # Download the file with range requests over several connections, checking its
+    # checksum as the chunks arrive. The partial file is kept in download_dir when the
+    # download is interrupted, so the next run resumes it instead of starting over
     logger.info(f"Downloading {args.file_url} ...")
-    with tempfile.NamedTemporaryFile(mode='wb+') as fp:
+    os.makedirs(args.download_dir, exist_ok=True)
+    local_path = os.path.join(args.download_dir, basename)
+
+    logger.info("Creating run")
+    with wandb.init(job_type="download_data") as run:
+        stats = downloader.download(
+            args.file_url,
+            local_path,
+            chunk_size=args.chunk_size_mb * 1024 * 1024,
+            n_workers=args.n_workers,
+            sha256=args.sha256 or None,
+        )
 
-        logger.info("Creating run")
-        with wandb.init(job_type="download_data") as run:
-            # Download the file streaming and write to open temp file
-            with requests.get(args.file_url, stream=True) as r:
-                for chunk in r.iter_content(chunk_size=8192):
-                    fp.write(chunk)
+        logger.info("Creating artifact")
+        artifact = wandb.Artifact(
+            name=args.artifact_name,
+            type=args.artifact_type,
+            description=args.artifact_description,
+            metadata={'original_url': args.file_url, 'sha256': stats['sha256']}
+        )
+        artifact.add_file(local_path, name=basename)
 
-            # Make sure the file has been written to disk before uploading
-            # to W&B
-            fp.flush()
+        logger.info("Logging artifact")
+        run.log_artifact(artifact)
 
-            logger.info("Creating artifact")
-            artifact = wandb.Artifact(
-                name=args.artifact_name,
-                type=args.artifact_type,
-                description=args.artifact_description,
-                metadata={'original_url': args.file_url}
-            )
-            artifact.add_file(fp.name, name=basename)
+        # Wait for the upload before removing the local copy
+        artifact.wait()
 
-            logger.info("Logging artifact")
-            run.log_artifact(artifact)
+    os.remove(local_path)
 
 
 if __name__ == "__main__":
@@ -71,6 +77,26 @@ if __name__ == "__main__":
         required=True,
     )
 
+    parser.add_argument(
+        "--chunk_size_mb", type=int, help="Size of each range request in MB", default=8
+    )
+
+    parser.add_argument(
+        "--n_workers", type=int, help="Number of parallel connections", default=4
+    )
+
+    parser.add_argument(
+        "--sha256", type=str, help="Expected sha256 of the file, empty to skip the check",
+        default=""
+    )
+
+    parser.add_argument(
+        "--download_dir",
+        type=str,
+        help="Folder of the downloads, where interrupted downloads are resumed from",
+        default=os.path.join(tempfile.gettempdir(), "download_data"),
+    )
+
     args = parser.parse_args()
 
     go(args)
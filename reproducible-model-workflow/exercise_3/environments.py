@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Environments of the pipeline steps. The steps whose conda.yml describe the same
+packages share one conda environment, created once under a folder keyed by the hash of
+the spec, and the steps can also run in the current process through their script.
+"""
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import runpy
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import yaml
+
+
+logger = logging.getLogger(__name__)
+
+ENV_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pipeline_envs")
+
+
+def _conda():
+    # same lookup as mlflow
+    conda_home = os.environ.get("MLFLOW_CONDA_HOME")
+    return os.path.join(conda_home, "bin", "conda") if conda_home else "conda"
+
+
+def _pip_requirement(requirement, base_dir):
+    """
+    Return the pip requirement with its local path (e.g. "-e ../pipeline_utils") made
+    absolute, relative paths are resolved from base_dir
+    """
+    match = re.match(r"^(-e\s+|--editable[=\s]+)?(\.{1,2}/\S*|\.{1,2})$", requirement.strip())
+    if match is None:
+        return requirement
+    path = os.path.normpath(os.path.join(base_dir, match.group(2)))
+    return f"-e {path}" if match.group(1) else path
+
+
+def normalized_spec(conda_file):
+    """
+    Return the conda spec without its name, with the packages sorted, so the specs
+    listing the same packages are equal. The order of the channels is kept, it sets
+    their priority. The local pip paths are made absolute, the spec is installed from
+    another folder
+    """
+    with open(conda_file) as fp:
+        spec = yaml.safe_load(fp)
+    base_dir = os.path.dirname(os.path.abspath(conda_file))
+    packages, pip_packages = [], []
+    for dependency in spec.get("dependencies", []):
+        if isinstance(dependency, dict):
+            pip_packages.extend(_pip_requirement(requirement, base_dir)
+                                for requirement in dependency.get("pip", []))
+        else:
+            packages.append(str(dependency))
+    dependencies = sorted(packages)
+    if pip_packages:
+        dependencies.append({"pip": sorted(pip_packages)})
+    return {"channels": spec.get("channels", []), "dependencies": dependencies}
+
+
+def spec_digest(conda_file):
+    """
+    Return the sha256 of the normalized spec of conda_file
+    """
+    payload = json.dumps(normalized_spec(conda_file), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def ensure_env(conda_file, env_dir=None):
+    """
+    Return the prefix of the environment of conda_file, created on first use, and the
+    seconds spent waiting for or creating it. A lock makes concurrent steps with the
+    same spec wait for a single creation
+    """
+    env_dir = env_dir or ENV_DIR
+    os.makedirs(env_dir, exist_ok=True)
+    digest = spec_digest(conda_file)
+    prefix = os.path.join(env_dir, digest[:16])
+    # written once the creation succeeded, conda-meta already exists when the pip
+    # packages fail to install
+    ready_path = os.path.join(prefix, ".ready")
+    start = time.perf_counter()
+    with open(os.path.join(env_dir, f"{digest[:16]}.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            try:
+                with open(ready_path) as fp:
+                    ready = fp.read().strip() == digest
+            except FileNotFoundError:
+                ready = False
+            if not ready:
+                logger.info(f"Creating the environment {prefix} for {conda_file}")
+                with tempfile.NamedTemporaryFile("w", suffix=".yml", delete=False) as fp:
+                    yaml.safe_dump(normalized_spec(conda_file), fp)
+                try:
+                    subprocess.run([_conda(), "env", "create", "--prefix", prefix,
+                                    "--file", fp.name, "--force"], check=True)
+                finally:
+                    os.remove(fp.name)
+                with open(ready_path, "w") as fp:
+                    fp.write(digest)
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+    return prefix, time.perf_counter() - start
+
+
+def env_variables(prefix):
+    """
+    Return the environment variables of a process running in the environment prefix
+    """
+    env = dict(os.environ)
+    env["PATH"] = os.pathsep.join([os.path.join(prefix, "bin"), env.get("PATH", "")])
+    env["CONDA_PREFIX"] = prefix
+    env["CONDA_DEFAULT_ENV"] = prefix
+    return env
+
+
+def entry_point_argv(step_path, parameters, entry_point="main"):
+    """
+    Return the command of the MLproject entry point of step_path with the parameters
+    (and the defaults of the missing ones) substituted, as an argv list
+    """
+    with open(os.path.join(step_path, "MLproject")) as fp:
+        project = yaml.safe_load(fp)
+    spec = project["entry_points"][entry_point]
+    values = {key: param.get("default") for key, param in spec.get("parameters", {}).items()}
+    values.update(parameters)
+    missing = [key for key, value in values.items() if value is None]
+    if missing:
+        raise ValueError(f"Missing parameters {missing} for {step_path}")
+    # the commands are folded yaml with shell line continuations
+    command = re.sub(r"\\\s", " ", spec["command"])
+    return shlex.split(command.format(**{key: shlex.quote(str(value))
+                                         for key, value in values.items()}))
+
+
+def mlflow_run_argv(step_path, parameters, entry_point="main", no_conda=False):
+    """
+    Return the "mlflow run" command of the entry point of step_path, with the mlflow
+    executable found on the PATH. no_conda runs the step in the current environment
+    """
+    mlflow = shutil.which("mlflow")
+    if mlflow is None:
+        raise RuntimeError("mlflow is not installed in the environment of the pipeline")
+    argv = [mlflow, "run", step_path, "-e", entry_point]
+    for key, value in parameters.items():
+        argv += ["-P", f"{key}={value}"]
+    if no_conda:
+        argv.append("--no-conda")
+    return argv
+
+
+@contextlib.contextmanager
+def _in_step(step_path):
+    """
+    Run from step_path with its modules importable, as mlflow run would. The modules of
+    the step are unloaded afterwards, another step may have modules of the same name
+    """
+    cwd, path, modules = os.getcwd(), list(sys.path), set(sys.modules)
+    os.chdir(step_path)
+    sys.path.insert(0, step_path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+        sys.path[:] = path
+        for name in set(sys.modules) - modules:
+            if (getattr(sys.modules[name], "__file__", None) or "").startswith(step_path):
+                del sys.modules[name]
+
+
+def run_local(step_path, parameters, entry_point="main"):
+    """
+    Run the python script of the entry point in the current process and environment:
+    its command line is parsed by the script and passed to its go(args) function. The
+    current directory is changed for the duration of the step, so the local steps must
+    run one at a time
+    """
+    argv = entry_point_argv(step_path, parameters, entry_point)
+    if os.path.basename(argv[0]).startswith("python") and argv[1].endswith(".py"):
+        script, args = argv[1], argv[2:]
+    else:
+        raise ValueError(f"The command {' '.join(argv)} of {step_path} is not a python script")
+    step_path = os.path.abspath(step_path)
+    argv_saved = sys.argv
+    with _in_step(step_path):
+        sys.argv = [script] + args
+        try:
+            runpy.run_path(os.path.join(step_path, script), run_name="__main__")
+        finally:
+            sys.argv = argv_saved
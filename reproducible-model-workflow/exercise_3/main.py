@@ -1,9 +1,12 @@
-import mlflow
 import os
 import wandb
 import hydra
 from omegaconf import DictConfig
 
+import environments
+import scheduler
+import step_cache
+
 
 # This automatically reads in the configuration
 @hydra.main(config_name='config')
@@ -16,28 +19,109 @@ def go(config: DictConfig):
     # You can get the path at the root of the MLflow project with this:
     root_path = hydra.utils.get_original_cwd()
 
-    _ = mlflow.run(
-        os.path.join(root_path, "download_data"),
-        "main",
-        parameters={
-            "file_url": config["data"]["file_url"],
-            "artifact_name": "iris.csv",
-            "artifact_type": "raw_data",
-            "artifact_description": "Input data"
+    steps = {
+        "download_data": {
+            "parameters": {
+                "file_url": config["data"]["file_url"],
+                "artifact_name": "iris.csv",
+                "artifact_type": "raw_data",
+                "artifact_description": "Input data"
+            },
+            "inputs": [],
+            "output": "iris.csv",
+            # download_data imports the downloader of pipeline_utils
+            "code": [os.path.join(root_path, "download_data"),
+                     os.path.join(root_path, "..", "pipeline_utils", "pipeline_utils",
+                                  "downloader.py")],
         },
-    )
-
-    _ = mlflow.run(
-        os.path.join(root_path, "process_data"),
-        "main",
-        parameters={
-            "input_artifact": "iris.csv:latest",
-            "artifact_name": "clean_data.csv",
-            "artifact_type": "processed_data",
-            "artifact_description": "Cleaned data"
+        "process_data": {
+            "parameters": {
+                "input_artifact": "iris.csv:latest",
+                "artifact_name": "clean_data.csv",
+                "artifact_type": "processed_data",
+                "artifact_description": "Cleaned data"
+            },
+            "inputs": ["iris.csv:latest"],
+            "output": "clean_data.csv",
+            # process_data imports the artifact cache of pipeline_utils
+            "code": [os.path.join(root_path, "process_data"),
+                     os.path.join(root_path, "..", "pipeline_utils", "pipeline_utils",
+                                  "artifact_cache.py")],
         },
-    )
+    }
+
+    # Steps to run, e.g. main.steps=process_data or main.steps=[download_data,process_data]
+    if config["main"]["steps"] == "all":
+        active_steps = list(steps)
+    else:
+        active_steps = config["main"]["steps"]
+        if isinstance(active_steps, str):
+            active_steps = [step.strip() for step in active_steps.split(",")]
+        unknown = set(active_steps) - set(steps)
+        if unknown:
+            raise ValueError(f"Unknown steps {sorted(unknown)}, choose among {list(steps)}")
+
+    api = wandb.Api()
+
+    def artifact_digest(name):
+        try:
+            return api.artifact(f"{config['main']['project_name']}/{name}").digest
+        except Exception:
+            # the artifact was never logged (or W&B cannot be reached)
+            return None
+
+    # A step depends on the steps producing its inputs. The outputs of the steps left
+    # out of main.steps are taken from W&B as they are
+    dependencies = scheduler.step_dependencies(steps)
+    dependencies = {name: dependencies[name] & set(active_steps) for name in active_steps}
+
+    # shared: the steps with the same conda.yml packages share one environment
+    # conda: mlflow creates the environment of each step
+    # local: the steps run in this process and environment
+    env_mode = config["main"]["env_mode"]
+    if env_mode not in ("shared", "conda", "local"):
+        raise ValueError(f"main.env_mode must be shared, conda or local, got {env_mode}")
+    # local steps change the current directory, they run one at a time
+    max_workers = 1 if env_mode == "local" else config["main"]["max_workers"]
+    setup_seconds = {}
+
+    def execute(name):
+        step_path = os.path.join(root_path, name)
+        parameters = steps[name]["parameters"]
+        if env_mode == "local":
+            environments.run_local(step_path, parameters)
+            # the next step starts its own W&B run
+            if wandb.run is not None:
+                wandb.finish()
+            return
+
+        # each step runs in its own mlflow process, its output prefixed with its name
+        env = None
+        if env_mode == "shared":
+            prefix, setup_seconds[name] = environments.ensure_env(
+                os.path.join(step_path, "conda.yml"), config["main"]["env_dir"])
+            # mlflow runs the step command with the python of the shared environment
+            env = environments.env_variables(prefix)
+        command = environments.mlflow_run_argv(step_path, parameters,
+                                               no_conda=env_mode == "shared")
+        scheduler.run_command(name, command, env=env)
+
+    def run_step(name):
+        step = steps[name]
+        return step_cache.run_step(
+            name,
+            lambda: execute(name),
+            step["code"],
+            step["parameters"],
+            step["inputs"],
+            step["output"],
+            artifact_digest,
+            os.path.join(root_path, ".step_cache", config["main"]["project_name"]),
+            force=not config["main"]["use_cache"],
+        )
 
+    timings = scheduler.run_graph(dependencies, run_step, max_workers)
+    print(scheduler.timing_summary(dependencies, timings, setup_seconds))
 
 
 if __name__ == "__main__":
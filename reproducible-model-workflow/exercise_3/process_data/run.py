@@ -5,6 +5,8 @@ import seaborn as sns
 import pandas as pd
 import wandb
 
+from pipeline_utils import artifact_cache
+
 from sklearn.manifold import TSNE
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
@@ -16,7 +18,7 @@ def go(args):
     run = wandb.init(job_type="process_data")
 
     logger.info("Downloading artifact")
-    artifact = run.use_artifact(args.input_artifact)
+    artifact = artifact_cache.use_artifact(run, args.input_artifact)
     artifact_path = artifact.file()
 
     iris = pd.read_csv(
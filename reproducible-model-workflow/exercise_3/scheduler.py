@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+"""
+Run the steps of a pipeline as a graph: a step depends on the steps producing its input
+artifacts, and the steps whose dependencies are done run concurrently, each one in its
+own process, with its output prefixed by the step name. The timings of the run and
+its critical path are summarized at the end.
+"""
+import logging
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+logger = logging.getLogger(__name__)
+
+_print_lock = threading.Lock()
+
+
+def step_dependencies(steps):
+    """
+    Return {step: set of steps producing its inputs}, from the "inputs" (artifact names
+    with an optional version) and "output" of each step. Inputs produced by no step of
+    the graph are artifacts that already exist. Raises ValueError on a cycle
+    """
+    producers = {}
+    for name, step in steps.items():
+        if step["output"] in producers:
+            raise ValueError(f"Steps {producers[step['output']]} and {name} both produce "
+                             f"{step['output']}")
+        producers[step["output"]] = name
+    dependencies = {
+        name: {producers[artifact.split(":")[0]] for artifact in step["inputs"]
+               if artifact.split(":")[0] in producers}
+        for name, step in steps.items()
+    }
+    topological_order(dependencies)
+    return dependencies
+
+
+def topological_order(dependencies):
+    """
+    Return the steps ordered so that each step comes after its dependencies
+    """
+    order, done, visiting = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"The pipeline has a cycle through step {name}")
+        visiting.add(name)
+        for dependency in sorted(dependencies[name]):
+            visit(dependency)
+        visiting.discard(name)
+        done.add(name)
+        order.append(name)
+
+    for name in dependencies:
+        visit(name)
+    return order
+
+
+def run_command(name, command, cwd=None, env=None, stream=None):
+    """
+    Run command, writing each line of its output to stream (stdout by default) with
+    the "[name] " prefix. Raises subprocess.CalledProcessError when the command fails
+    """
+    stream = stream or sys.stdout
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True, bufsize=1)
+    for line in process.stdout:
+        with _print_lock:
+            stream.write(f"[{name}] {line}")
+            stream.flush()
+    if process.wait() != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+
+def run_graph(dependencies, run, max_workers=2):
+    """
+    Call run(step) for each step once all its dependencies have completed, with at most
+    max_workers steps at a time. After a failure no new step starts, and the error is
+    raised once the running steps are done. Returns {step: timing} with the start and
+    end in seconds since the start of the pipeline and the value returned by run
+    """
+    pending = {name: set(deps) for name, deps in dependencies.items()}
+    timings, running, failed = {}, {}, None
+    start = time.perf_counter()
+
+    def timed(name):
+        step_start = time.perf_counter() - start
+        result = run(name)
+        return {"start": step_start, "end": time.perf_counter() - start, "result": result}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            if failed is None:
+                for name in [name for name, deps in pending.items() if not deps]:
+                    logger.info(f"Starting step {name}")
+                    running[executor.submit(timed, name)] = name
+                    del pending[name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    timings[name] = future.result()
+                except Exception as err:
+                    logger.error(f"Step {name} failed: {err}")
+                    failed = failed or err
+                    continue
+                for deps in pending.values():
+                    deps.discard(name)
+
+    if failed is not None:
+        raise failed
+    return timings
+
+
+def critical_path(dependencies, timings):
+    """
+    Return the chain of dependent steps with the longest total duration, and its length
+    in seconds
+    """
+    finish, previous = {}, {}
+    for name in topological_order(dependencies):
+        duration = timings[name]["end"] - timings[name]["start"]
+        before = max(dependencies[name], key=lambda dep: finish[dep], default=None)
+        previous[name] = before
+        finish[name] = duration + (finish[before] if before is not None else 0.0)
+    name = max(finish, key=finish.get, default=None)
+    length = finish.get(name, 0.0)
+    path = []
+    while name is not None:
+        path.append(name)
+        name = previous[name]
+    return path[::-1], length
+
+
+def timing_summary(dependencies, timings, setup=None):
+    """
+    Return a table of the step timings followed by the critical path. setup gives the
+    seconds of environment setup included in the time of some steps, reported apart
+    """
+    setup = setup or {}
+    lines = [f"{'step':<20}{'start':>9}{'end':>9}{'setup':>9}{'run':>9}{'':>8}  depends on"]
+    for name in sorted(timings, key=lambda name: timings[name]["start"]):
+        timing = timings[name]
+        seconds = timing["end"] - timing["start"]
+        lines.append(
+            f"{name:<20}{timing['start']:>9.1f}{timing['end']:>9.1f}"
+            f"{setup.get(name, 0.0):>9.1f}{seconds - setup.get(name, 0.0):>9.1f}"
+            # step_cache.run_step returns False for the steps it skipped
+            f"{'cached' if timing['result'] is False else '':>8}"
+            f"  {', '.join(sorted(dependencies[name]))}".rstrip()
+        )
+    path, length = critical_path(dependencies, timings)
+    total = max((timing["end"] for timing in timings.values()), default=0.0)
+    busy = sum(timing["end"] - timing["start"] for timing in timings.values())
+    lines.append(f"Wall time {total:.1f}s for {busy:.1f}s of steps, "
+                 f"{sum(setup.values()):.1f}s of environment setup")
+    lines.append(f"Critical path ({length:.1f}s): {' -> '.join(path)}")
+    return "\n".join(lines)
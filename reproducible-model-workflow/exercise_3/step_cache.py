@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Result cache of the pipeline steps. The key of a step hashes its code, its parameters
+and the digests of its input artifacts; a step is skipped when its last successful run
+had the same key and the artifact it produced still has the digest recorded then.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+# folders the runs of a step write to
+OUTPUT_DIRS = {"__pycache__", "artifacts", "mlruns", "wandb"}
+
+
+def _code_files(path):
+    """
+    Files of a step folder (or a single file) that make up its code: its MLproject,
+    conda.yml and python files, tests excluded. The files written by the runs of the
+    step (downloads, W&B and mlflow folders) must not change its key
+    """
+    if os.path.isfile(path):
+        yield path
+        return
+    for folder, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in OUTPUT_DIRS)
+        for name in sorted(names):
+            if name in ("MLproject", "conda.yml") or \
+                    (name.endswith(".py") and not name.startswith("test_")):
+                yield os.path.join(folder, name)
+
+
+def code_digest(paths):
+    """
+    Return the sha256 of the names and contents of the code files under paths
+    """
+    hasher = hashlib.sha256()
+    for path in paths:
+        for file_path in _code_files(path):
+            hasher.update(os.path.relpath(file_path, os.path.dirname(path)).encode())
+            with open(file_path, "rb") as fp:
+                hasher.update(fp.read())
+    return hasher.hexdigest()
+
+
+def step_key(code_paths, parameters, input_digests):
+    """
+    Return the cache key of a step run
+    """
+    payload = json.dumps(
+        {"code": code_digest(code_paths), "parameters": parameters, "inputs": input_digests},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def run_step(name, run, code_paths, parameters, input_artifacts, output_artifact,
+             artifact_digest, cache_dir, force=False):
+    """
+    Call run() unless the step already ran with the same key and its output artifact is
+    unchanged. artifact_digest(name) returns the digest of an artifact, None when it
+    does not exist. Returns True when the step ran
+    """
+    input_digests = {artifact: artifact_digest(artifact) for artifact in input_artifacts}
+    key = step_key(code_paths, parameters, input_digests)
+    record_path = os.path.join(cache_dir, f"{name}.json")
+
+    try:
+        with open(record_path) as fp:
+            record = json.load(fp)
+    except (FileNotFoundError, ValueError):
+        record = {}
+
+    missing_inputs = [artifact for artifact, digest in input_digests.items() if digest is None]
+    if not force and not missing_inputs and record.get("key") == key:
+        output_digest = artifact_digest(f"{output_artifact}:latest")
+        if output_digest is not None and output_digest == record.get("output_digest"):
+            logger.info(f"Skipping step {name}: cached result {output_artifact} ({key[:12]})")
+            return False
+
+    logger.info(f"Running step {name} ({key[:12]})")
+    start = time.perf_counter()
+    run()
+    os.makedirs(cache_dir, exist_ok=True)
+    record = {
+        "key": key,
+        "output_artifact": output_artifact,
+        "output_digest": artifact_digest(f"{output_artifact}:latest"),
+        "seconds": time.perf_counter() - start,
+    }
+    tmp_path = record_path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump(record, fp, indent=2)
+    os.replace(tmp_path, record_path)
+    return True
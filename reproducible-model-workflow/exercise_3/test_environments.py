@@ -0,0 +1,164 @@
+import os
+import stat
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import environments
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def fake_conda(tmp_path, monkeypatch):
+    """
+    conda stand-in creating the prefix of "conda env create", and logging its calls
+    """
+    conda_home = tmp_path / "conda"
+    (conda_home / "bin").mkdir(parents=True)
+    script = conda_home / "bin" / "conda"
+    script.write_text(
+        "#!/bin/sh\n"
+        f"echo \"$@\" >> {tmp_path / 'calls.log'}\n"
+        "sleep 0.2\n"
+        "mkdir -p \"$4/conda-meta\" \"$4/bin\"\n"
+        # fails once the environment is half created when FAIL_CONDA is set
+        "test -z \"$FAIL_CONDA\"\n"
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("MLFLOW_CONDA_HOME", str(conda_home))
+    return tmp_path / "calls.log"
+
+
+def test_spec_digest(tmp_path):
+
+    # same packages in another order and under another name, in another folder
+    pipeline_utils = os.path.join(os.path.dirname(ROOT), "pipeline_utils")
+    (tmp_path / "conda.yml").write_text(
+        "name: other_step\nchannels:\n  - conda-forge\n  - defaults\n"
+        "dependencies:\n  - pip=20.3.3\n  - requests=2.24.0\n  - pip:\n"
+        f"      - -e {pipeline_utils}\n      - wandb==0.10.21\n"
+    )
+
+    download_data = os.path.join(ROOT, "download_data", "conda.yml")
+    process_data = os.path.join(ROOT, "process_data", "conda.yml")
+
+    # the environment is created from a copy of the spec in a temporary folder
+    assert f"-e {pipeline_utils}" in environments.normalized_spec(download_data)[
+        "dependencies"][-1]["pip"]
+
+    assert environments.spec_digest(download_data) == \
+        environments.spec_digest(str(tmp_path / "conda.yml"))
+    assert environments.spec_digest(download_data) != environments.spec_digest(process_data)
+
+
+def test_shared_env_is_created_once(fake_conda, tmp_path):
+
+    conda_file = os.path.join(ROOT, "download_data", "conda.yml")
+    results = []
+
+    def ensure():
+        results.append(environments.ensure_env(conda_file, str(tmp_path / "envs")))
+
+    threads = [threading.Thread(target=ensure) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({prefix for prefix, _ in results}) == 1
+    assert len(fake_conda.read_text().splitlines()) == 1
+
+    prefix, seconds = environments.ensure_env(conda_file, str(tmp_path / "envs"))
+    assert prefix == results[0][0] and seconds < 0.2
+    assert environments.env_variables(prefix)["PATH"].startswith(os.path.join(prefix, "bin"))
+
+
+def test_failed_env_is_created_again(fake_conda, tmp_path, monkeypatch):
+
+    conda_file = os.path.join(ROOT, "download_data", "conda.yml")
+
+    monkeypatch.setenv("FAIL_CONDA", "1")
+    with pytest.raises(subprocess.CalledProcessError):
+        environments.ensure_env(conda_file, str(tmp_path / "envs"))
+
+    monkeypatch.delenv("FAIL_CONDA")
+    prefix, _ = environments.ensure_env(conda_file, str(tmp_path / "envs"))
+
+    assert len(fake_conda.read_text().splitlines()) == 2
+    with open(os.path.join(prefix, ".ready")) as fp:
+        assert fp.read() == environments.spec_digest(conda_file)
+
+
+def test_entry_point_argv():
+
+    argv = environments.entry_point_argv(
+        os.path.join(ROOT, "download_data"),
+        {"file_url": "http://example.com/iris.csv", "artifact_name": "iris.csv",
+         "artifact_description": "Input data"},
+    )
+
+    assert argv[:2] == ["python", "download_data.py"]
+    assert argv[argv.index("--artifact_description") + 1] == "Input data"
+    # defaults of the MLproject
+    assert argv[argv.index("--artifact_type") + 1] == "raw_data"
+    assert argv[argv.index("--sha256") + 1] == ""
+
+    with pytest.raises(ValueError):
+        environments.entry_point_argv(os.path.join(ROOT, "download_data"), {})
+
+
+def test_mlflow_run_argv(tmp_path, monkeypatch):
+
+    mlflow = tmp_path / "bin" / "mlflow"
+    mlflow.parent.mkdir()
+    mlflow.write_text("#!/bin/sh\n")
+    mlflow.chmod(mlflow.stat().st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("PATH", str(mlflow.parent))
+
+    argv = environments.mlflow_run_argv(
+        "process_data", {"input_artifact": "iris.csv:latest", "artifact_name": "clean data"},
+        no_conda=True)
+
+    assert argv == [str(mlflow), "run", "process_data", "-e", "main",
+                    "-P", "input_artifact=iris.csv:latest", "-P", "artifact_name=clean data",
+                    "--no-conda"]
+    assert "--no-conda" not in environments.mlflow_run_argv("process_data", {})
+
+    monkeypatch.setenv("PATH", str(tmp_path))
+    with pytest.raises(RuntimeError):
+        environments.mlflow_run_argv("process_data", {})
+
+
+def test_run_local(tmp_path):
+
+    step = tmp_path / "step"
+    step.mkdir()
+    (step / "MLproject").write_text(
+        "name: step\nentry_points:\n  main:\n    parameters:\n"
+        "      message:\n        type: str\n"
+        "    command: >-\n      python run.py --message {message} \\\n"
+        "                    --output out.txt\n"
+    )
+    (step / "helper.py").write_text("def shout(text):\n    return text.upper()\n")
+    (step / "run.py").write_text(
+        "import argparse\nimport helper\n\n\n"
+        "def go(args):\n"
+        "    with open(args.output, 'w') as fp:\n"
+        "        fp.write(helper.shout(args.message))\n\n\n"
+        "if __name__ == '__main__':\n"
+        "    parser = argparse.ArgumentParser()\n"
+        "    parser.add_argument('--message')\n"
+        "    parser.add_argument('--output')\n"
+        "    go(parser.parse_args())\n"
+    )
+    cwd = os.getcwd()
+
+    environments.run_local(str(step), {"message": "hello world"})
+
+    assert (step / "out.txt").read_text() == "HELLO WORLD"
+    assert os.getcwd() == cwd
+    assert "helper" not in sys.modules
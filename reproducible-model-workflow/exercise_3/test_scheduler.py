@@ -0,0 +1,95 @@
+import io
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+
+STEPS = {
+    "download_data": {"inputs": [], "output": "raw.csv"},
+    "check_data": {"inputs": ["raw.csv:latest"], "output": "check_report"},
+    "process_data": {"inputs": ["raw.csv:latest"], "output": "clean.csv"},
+    "train": {"inputs": ["clean.csv:latest", "config.json:v0"], "output": "model"},
+}
+
+
+def test_step_dependencies():
+
+    dependencies = scheduler.step_dependencies(STEPS)
+
+    assert dependencies == {
+        "download_data": set(),
+        "check_data": {"download_data"},
+        "process_data": {"download_data"},
+        # config.json is not produced by the pipeline
+        "train": {"process_data"},
+    }
+    order = scheduler.topological_order(dependencies)
+    assert order.index("download_data") < order.index("process_data") < order.index("train")
+
+    with pytest.raises(ValueError):
+        scheduler.step_dependencies({
+            "a": {"inputs": ["b_out"], "output": "a_out"},
+            "b": {"inputs": ["a_out"], "output": "b_out"},
+        })
+
+
+def test_independent_steps_run_concurrently():
+
+    dependencies = scheduler.step_dependencies(STEPS)
+    durations = {"download_data": 0.1, "check_data": 0.3, "process_data": 0.2, "train": 0.2}
+    active, peak, lock = set(), [0], threading.Lock()
+
+    def run(name):
+        with lock:
+            active.add(name)
+            peak[0] = max(peak[0], len(active))
+        time.sleep(durations[name])
+        with lock:
+            active.discard(name)
+        return True
+
+    timings = scheduler.run_graph(dependencies, run, max_workers=2)
+
+    assert peak[0] == 2
+    for name, deps in dependencies.items():
+        assert all(timings[dep]["end"] <= timings[name]["start"] for dep in deps)
+    path, length = scheduler.critical_path(dependencies, timings)
+    assert path == ["download_data", "process_data", "train"]
+    assert length == pytest.approx(0.5, abs=0.1)
+    summary = scheduler.timing_summary(dependencies, timings, {"train": 0.1})
+    assert "Critical path" in summary and "0.1s of environment setup" in summary
+
+
+def test_failure_stops_the_dependent_steps():
+
+    dependencies = scheduler.step_dependencies(STEPS)
+    ran = []
+
+    def run(name):
+        ran.append(name)
+        if name == "process_data":
+            raise RuntimeError("process_data failed")
+
+    with pytest.raises(RuntimeError):
+        scheduler.run_graph(dependencies, run, max_workers=2)
+
+    assert "train" not in ran
+
+
+def test_run_command_prefixes_the_output():
+
+    stream = io.StringIO()
+    scheduler.run_command(
+        "step", [sys.executable, "-c", "import sys; print('out'); print('err', file=sys.stderr)"],
+        stream=stream)
+
+    assert sorted(stream.getvalue().splitlines()) == ["[step] err", "[step] out"]
+
+    with pytest.raises(subprocess.CalledProcessError):
+        scheduler.run_command("step", [sys.executable, "-c", "raise SystemExit(1)"],
+                              stream=io.StringIO())
@@ -0,0 +1,92 @@
+import pytest
+
+import step_cache
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    """
+    Two fake steps whose runs log their output artifact in a dict of digests, and write
+    in their folder as the real steps do
+    """
+    for step in ("download_data", "process_data"):
+        (tmp_path / step).mkdir()
+        (tmp_path / step / "run.py").write_text(f"# {step}\n")
+
+    artifacts, calls = {}, []
+
+    def make_run(step, output, content):
+        def run():
+            calls.append(step)
+            artifacts[f"{output}:latest"] = content()
+            for folder in (f"wandb/run-{len(calls)}", "artifacts", f"mlruns/{len(calls)}"):
+                (tmp_path / step / folder).mkdir(parents=True, exist_ok=True)
+                (tmp_path / step / folder / "output.log").write_text(artifacts[f"{output}:latest"])
+            (tmp_path / step / output).write_text(artifacts[f"{output}:latest"])
+        return run
+
+    def run_pipeline(parameters=None, force=False):
+        parameters = parameters or {"file_url": "http://example.com/iris.csv"}
+        ran = []
+        for step, inputs, output, content in [
+            ("download_data", [], "iris.csv", lambda: f"raw-{parameters['file_url']}"),
+            ("process_data", ["iris.csv:latest"], "clean_data.csv",
+             lambda: f"clean-{artifacts['iris.csv:latest']}"),
+        ]:
+            ran.append(step_cache.run_step(
+                step, make_run(step, output, content), [str(tmp_path / step)],
+                parameters if step == "download_data" else {"input_artifact": inputs[0]},
+                inputs, output, artifacts.get, str(tmp_path / ".step_cache"), force=force))
+        return ran
+
+    return tmp_path, artifacts, calls, run_pipeline
+
+
+def test_unchanged_pipeline_is_skipped(pipeline):
+
+    tmp_path, artifacts, calls, run_pipeline = pipeline
+
+    assert run_pipeline() == [True, True]
+    assert run_pipeline() == [False, False]
+    assert run_pipeline(force=True) == [True, True]
+    assert calls == ["download_data", "process_data"] * 2
+
+
+def test_changes_invalidate_the_steps(pipeline):
+
+    tmp_path, artifacts, calls, run_pipeline = pipeline
+    run_pipeline()
+
+    # code change of the second step only
+    (tmp_path / "process_data" / "run.py").write_text("# process_data v2\n")
+    assert run_pipeline() == [False, True]
+
+    # new parameters change the output of the first step, so the input of the second
+    assert run_pipeline({"file_url": "http://example.com/iris_v2.csv"}) == [True, True]
+
+    # a deleted output is produced again
+    del artifacts["clean_data.csv:latest"]
+    assert run_pipeline({"file_url": "http://example.com/iris_v2.csv"}) == [False, True]
+
+
+def test_tests_are_not_part_of_the_key(pipeline):
+
+    tmp_path, artifacts, calls, run_pipeline = pipeline
+    run_pipeline()
+
+    (tmp_path / "download_data" / "test_run.py").write_text("def test(): pass\n")
+    (tmp_path / "download_data" / "__pycache__").mkdir()
+    (tmp_path / "download_data" / "__pycache__" / "run.cpython-38.pyc").write_bytes(b"\0")
+
+    assert run_pipeline() == [False, False]
+
+
+def test_step_outputs_are_not_part_of_the_key(pipeline):
+
+    tmp_path, artifacts, calls, run_pipeline = pipeline
+
+    assert run_pipeline() == [True, True]
+    assert (tmp_path / "download_data" / "wandb" / "run-1" / "output.log").exists()
+    assert (tmp_path / "download_data" / "iris.csv").exists()
+
+    assert run_pipeline() == [False, False]
@@ -6,6 +6,8 @@ import os
 import pandas as pd
 import wandb
 
+from pipeline_utils import artifact_cache
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -16,7 +18,7 @@ def go(args):
     run = wandb.init(project="exercise_5", job_type="process_data")
 
     logger.info("Downloading artifact")
-    artifact = run.use_artifact(args.input_artifact)
+    artifact = artifact_cache.use_artifact(run, args.input_artifact)
     artifact_path = artifact.file()
 
     df = pd.read_parquet(artifact_path)
@@ -6,6 +6,8 @@ import tempfile
 
 import pandas as pd
 import wandb
+
+from pipeline_utils import artifact_cache
 from sklearn.model_selection import train_test_split
 
 
@@ -18,7 +20,7 @@ def go(args):
     run = wandb.init(project="exercise_6", job_type="split_data")
 
     logger.info("Downloading and reading artifact")
-    artifact = run.use_artifact(args.input_artifact)
+    artifact = artifact_cache.use_artifact(run, args.input_artifact)
     artifact_path = artifact.file()
 
     df = pd.read_csv(artifact_path, low_memory=False)
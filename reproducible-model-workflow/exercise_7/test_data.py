@@ -2,6 +2,8 @@ import pytest
 import wandb
 import pandas as pd
 
+from pipeline_utils import artifact_cache
+
 # This is global so all tests are collected under the same
 # run
 run = wandb.init(project="exercise_7", job_type="data_tests")
@@ -10,7 +12,8 @@ run = wandb.init(project="exercise_7", job_type="data_tests")
 @pytest.fixture(scope="session")
 def data():
 
-    local_path = run.use_artifact("exercise_5/preprocessed_data.csv:latest").file()
+    artifact = artifact_cache.use_artifact(run, "exercise_5/preprocessed_data.csv:latest")
+    local_path = artifact.file()
     df = pd.read_csv(local_path, low_memory=False)
 
     return df
@@ -3,6 +3,8 @@ import wandb
 import pandas as pd
 import scipy.stats
 
+from pipeline_utils import artifact_cache
+
 # This is global so all tests are collected under the same
 # run
 run = wandb.init(project="exercise_8", job_type="data_tests")
@@ -11,10 +13,10 @@ run = wandb.init(project="exercise_8", job_type="data_tests")
 @pytest.fixture(scope="session")
 def data():
 
-    local_path = run.use_artifact("exercise_6/data_train.csv:latest").file()
+    local_path = artifact_cache.use_artifact(run, "exercise_6/data_train.csv:latest").file()
     sample1 = pd.read_csv(local_path)
 
-    local_path = run.use_artifact("exercise_6/data_test.csv:latest").file()
+    local_path = artifact_cache.use_artifact(run, "exercise_6/data_test.csv:latest").file()
     sample2 = pd.read_csv(local_path)
 
     return sample1, sample2
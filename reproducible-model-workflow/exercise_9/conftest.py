@@ -2,6 +2,8 @@ import pytest
 import pandas as pd
 import wandb
 
+from pipeline_utils import artifact_cache
+
 
 run = wandb.init(project="exercise_9", job_type="data_tests")
 
@@ -25,10 +27,10 @@ def data(request):
     if sample_artifact is None:
         pytest.fail("--sample_artifact missing on command line")
 
-    local_path = run.use_artifact(reference_artifact).file()
+    local_path = artifact_cache.use_artifact(run, reference_artifact).file()
     sample1 = pd.read_csv(local_path)
 
-    local_path = run.use_artifact(sample_artifact).file()
+    local_path = artifact_cache.use_artifact(run, sample_artifact).file()
     sample2 = pd.read_csv(local_path)
 
     return sample1, sample2
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+"""
+Local cache of the artifacts used by the steps, keyed by artifact digest, so the steps
+running on the same machine download each version of an artifact once.
+
+    artifact = artifact_cache.use_artifact(run, "exercise_5/preprocessed_data.csv:latest")
+    local_path = artifact.file()
+
+The files are materialized under the cache root (or in a folder given to file() and
+download()) as hard links (or reflinks, or copies as a last resort) of the cached
+files, the least recently used artifacts are evicted when the cache grows over its
+size limit, and a lock per digest makes concurrent steps wait for the first download
+instead of downloading it again. The OfflineBackend stores artifacts in a local
+folder, to use the cache without a tracking server.
+
+The steps depend on the pipeline_utils package in their conda.yml, the scripts run
+outside of mlflow need it installed with "pip install -e pipeline_utils".
+"""
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get(
+    "ARTIFACT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "artifact_cache")
+)
+MAX_BYTES = int(os.environ.get("ARTIFACT_CACHE_MAX_BYTES", 10 * 1024 ** 3))
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+
+@contextlib.contextmanager
+def _locked(lock_path, blocking=True):
+    """
+    Hold an exclusive lock on lock_path, shared by the processes of the machine. When
+    blocking is False, yield False instead of waiting for a lock held elsewhere
+    """
+    with open(lock_path, "a") as fp:
+        try:
+            fcntl.flock(fp, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+
+def _tree_size(path):
+    return sum(
+        os.path.getsize(os.path.join(folder, name))
+        for folder, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def _link_or_copy(src, dst):
+    """
+    Materialize src at dst as a hard link, a reflink or a copy, in this order
+    """
+    try:
+        os.link(src, dst)
+        return "hardlink"
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+            raise
+    try:
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except OSError:
+        shutil.copy2(src, dst)
+        return "copy"
+
+
+class WandbBackend:
+    """
+    Artifacts of a W&B run. Resolving an artifact calls run.use_artifact, so the
+    lineage of the run is recorded even when the files come from the cache
+    """
+
+    def __init__(self, run):
+        self.run = run
+
+    def resolve(self, name):
+        artifact = self.run.use_artifact(name)
+        return artifact.digest, artifact
+
+    def fetch(self, handle, dest_dir):
+        handle.download(root=dest_dir)
+
+
+class OfflineBackend:
+    """
+    Artifacts stored in a local folder as <root>/<name>/<version>/ with a manifest of
+    their digest, and a 'latest' alias file per artifact
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _artifact_dir(self, name):
+        # the project prefix of "project/name:version" is not part of the local store
+        return os.path.join(self.root, name.split("/")[-1])
+
+    def log_artifact(self, name, paths):
+        """
+        Store the files as a new version of the artifact name and return its version
+        """
+        artifact_dir = self._artifact_dir(name)
+        os.makedirs(artifact_dir, exist_ok=True)
+        with _locked(os.path.join(artifact_dir, ".lock")):
+            versions = [int(v[1:]) for v in os.listdir(artifact_dir) if re.match(r"v\d+$", v)]
+            version = f"v{max(versions, default=-1) + 1}"
+            version_dir = os.path.join(artifact_dir, version)
+            os.makedirs(version_dir)
+            digest = hashlib.sha256()
+            for path in sorted(paths, key=os.path.basename):
+                shutil.copy2(path, os.path.join(version_dir, os.path.basename(path)))
+                digest.update(os.path.basename(path).encode())
+                with open(path, "rb") as fp:
+                    for block in iter(lambda: fp.read(1024 * 1024), b""):
+                        digest.update(block)
+            with open(os.path.join(version_dir, ".manifest.json"), "w") as fp:
+                json.dump({"digest": digest.hexdigest()}, fp)
+            with open(os.path.join(artifact_dir, "latest"), "w") as fp:
+                fp.write(version)
+        return version
+
+    def resolve(self, name):
+        name, _, version = name.partition(":")
+        artifact_dir = self._artifact_dir(name)
+        if version in ("", "latest"):
+            with open(os.path.join(artifact_dir, "latest")) as fp:
+                version = fp.read().strip()
+        version_dir = os.path.join(artifact_dir, version)
+        with open(os.path.join(version_dir, ".manifest.json")) as fp:
+            return json.load(fp)["digest"], version_dir
+
+    def fetch(self, handle, dest_dir):
+        for name in os.listdir(handle):
+            if name != ".manifest.json":
+                shutil.copy2(os.path.join(handle, name), os.path.join(dest_dir, name))
+
+
+class CachedArtifact:
+    """
+    Artifact whose files are in the cache, with the file() and download() methods of
+    a W&B artifact
+    """
+
+    def __init__(self, name, digest, path, checkout_dir, lock_path):
+        self.name = name
+        self.digest = digest
+        self.path = path
+        self.checkout_dir = checkout_dir
+        self.lock_path = lock_path
+
+    def _materialize(self, root):
+        """
+        Link the files of the artifact in root and return their relative paths
+        """
+        if not os.path.isdir(self.path):
+            raise FileNotFoundError(f"Artifact {self.name} was evicted from the cache")
+        paths = []
+        for folder, _, names in os.walk(self.path):
+            target_dir = os.path.join(root, os.path.relpath(folder, self.path))
+            os.makedirs(target_dir, exist_ok=True)
+            for name in names:
+                src, dst = os.path.join(folder, name), os.path.join(target_dir, name)
+                paths.append(os.path.relpath(src, self.path))
+                if os.path.exists(dst) and os.path.samefile(src, dst):
+                    continue
+                # linked under a temporary name and renamed, steps sharing root may
+                # materialize the same file at the same time
+                tmp_dst = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+                try:
+                    _link_or_copy(src, tmp_dst)
+                    os.replace(tmp_dst, dst)
+                finally:
+                    if os.path.lexists(tmp_dst):
+                        os.remove(tmp_dst)
+        return paths
+
+    def _download(self, root):
+        if root:
+            return root, self._materialize(root)
+        with _locked(self.lock_path):
+            return self.checkout_dir, self._materialize(self.checkout_dir)
+
+    def download(self, root=None):
+        """
+        Materialize the files of the artifact in root and return root. By default root
+        is a folder of the cache, filled under the lock of the artifact and removed
+        with the artifact when it is evicted: pass a root outside of the cache to keep
+        the files of an artifact that may be evicted while the step uses it
+        """
+        return self._download(root)[0]
+
+    def file(self, root=None):
+        """
+        Materialize the only file of the artifact and return its path
+        """
+        root, names = self._download(root)
+        if len(names) != 1:
+            raise ValueError(f"Artifact {self.name} has {len(names)} files, use download()")
+        return os.path.join(root, names[0])
+
+
+class ArtifactCache:
+    """
+    Content addressed store of artifact files under root/objects/<digest>, with an
+    index of their size and last use for the LRU eviction
+    """
+
+    def __init__(self, root=None, max_bytes=None):
+        self.root = root or CACHE_DIR
+        self.max_bytes = MAX_BYTES if max_bytes is None else max_bytes
+        for folder in ("objects", "checkouts", "locks", "tmp"):
+            os.makedirs(os.path.join(self.root, folder), exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _object_path(self, digest):
+        return os.path.join(self.root, "objects", digest)
+
+    def _checkout_path(self, digest):
+        return os.path.join(self.root, "checkouts", digest)
+
+    def _update_index(self, digest, size=None):
+        """
+        Record the use of an artifact and evict the least recently used ones while the
+        cache is over max_bytes, never the artifact just used
+        """
+        index_path = os.path.join(self.root, "index.json")
+        with _locked(os.path.join(self.root, "locks", "index.lock")):
+            try:
+                with open(index_path) as fp:
+                    index = json.load(fp)
+            except (FileNotFoundError, ValueError):
+                index = {}
+            entry = index.setdefault(digest, {})
+            if size is not None or "size" not in entry:
+                entry["size"] = size if size is not None else _tree_size(self._object_path(digest))
+            entry["last_used"] = time.time()
+
+            total = sum(item["size"] for item in index.values())
+            for old in sorted(index, key=lambda key: index[key]["last_used"]):
+                if total <= self.max_bytes:
+                    break
+                if old == digest:
+                    continue
+                # an artifact being downloaded or materialized by another step is
+                # skipped. Nothing tracks the steps still reading a checkout, the
+                # artifact just used is the only one never evicted
+                with _locked(os.path.join(self.root, "locks", f"{old}.lock"), False) as free:
+                    if not free:
+                        continue
+                    shutil.rmtree(self._object_path(old), ignore_errors=True)
+                    shutil.rmtree(self._checkout_path(old), ignore_errors=True)
+                logger.info(f"Evicted artifact {old} from the cache")
+                total -= index.pop(old)["size"]
+
+            tmp_path = index_path + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w") as fp:
+                json.dump(index, fp)
+            os.replace(tmp_path, index_path)
+
+    def get(self, backend, name):
+        """
+        Return the CachedArtifact of name, fetching it from the backend if its digest
+        is not in the cache yet
+        """
+        digest, handle = backend.resolve(name)
+        path = self._object_path(digest)
+        with _locked(os.path.join(self.root, "locks", f"{digest}.lock")):
+            if os.path.isdir(path):
+                self.hits += 1
+                size = None
+            else:
+                self.misses += 1
+                logger.info(f"Downloading artifact {name} ({digest}) to the cache")
+                tmp_dir = tempfile.mkdtemp(dir=os.path.join(self.root, "tmp"))
+                try:
+                    backend.fetch(handle, tmp_dir)
+                    # cached files are shared by hard links, make them read only
+                    for folder, _, names in os.walk(tmp_dir):
+                        for file_name in names:
+                            os.chmod(os.path.join(folder, file_name), 0o444)
+                    size = _tree_size(tmp_dir)
+                    os.rename(tmp_dir, path)
+                except BaseException:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+                    raise
+            self._update_index(digest, size)
+        return CachedArtifact(name, digest, path, self._checkout_path(digest),
+                              os.path.join(self.root, "locks", f"{digest}.lock"))
+
+
+def use_artifact(run, name, cache=None):
+    """
+    Cached equivalent of run.use_artifact(name): run is a W&B run or a backend such as
+    OfflineBackend, cache defaults to an ArtifactCache in ARTIFACT_CACHE_DIR
+    """
+    backend = run if hasattr(run, "resolve") else WandbBackend(run)
+    return (cache or ArtifactCache()).get(backend, name)
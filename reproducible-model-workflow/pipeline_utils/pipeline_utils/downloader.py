@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+"""
+Download a file with HTTP range requests spread over a thread pool. The chunks
+already downloaded are recorded next to the partial file, so an interrupted download
+resumes where it stopped, and the checksum is computed while the chunks arrive.
+Servers without range support are downloaded on a single stream.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# errors after which a chunk is requested again
+RETRIED_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+
+class IncompleteRangeError(IOError):
+    """
+    The server answered a range request with fewer bytes than requested
+    """
+
+
+def _probe(session, url, timeout):
+    """
+    Return the size and validator (ETag or Last-Modified) of the file when the server
+    answers range requests, None otherwise
+    """
+    with session.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout) as r:
+        # an empty file has no byte 0, it is downloaded with a plain request
+        if r.status_code == 416:
+            return None
+        r.raise_for_status()
+        match = re.match(r"bytes 0-0/(\d+)$", r.headers.get("Content-Range", ""))
+        if r.status_code != 206 or match is None:
+            return None
+        return {
+            "size": int(match.group(1)),
+            "validator": r.headers.get("ETag") or r.headers.get("Last-Modified"),
+        }
+
+
+def _load_state(state_path, expected):
+    """
+    Return the chunks already downloaded for the same file, url and chunk size
+    """
+    try:
+        with open(state_path) as fp:
+            state = json.load(fp)
+    except (FileNotFoundError, ValueError):
+        return set()
+    if {key: state.get(key) for key in expected} != expected:
+        return set()
+    return set(state["done"])
+
+
+def _save_state(state_path, expected, done):
+    """
+    Record the chunks downloaded so far, atomically
+    """
+    tmp_path = state_path + ".tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump({**expected, "done": sorted(done)}, fp)
+    os.replace(tmp_path, state_path)
+
+
+def _fetch_range(session, url, start, end, validator, timeout, retries):
+    """
+    Download the bytes start..end (inclusive), retrying on connection errors and
+    truncated answers. A full answer (200) means the file changed, it is not retried
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    if validator:
+        headers["If-Range"] = validator
+    for attempt in range(retries + 1):
+        try:
+            with session.get(url, headers=headers, timeout=timeout) as r:
+                r.raise_for_status()
+                if r.status_code != 206:
+                    raise IOError(f"Server did not return the range {start}-{end} of {url}")
+                if len(r.content) != end - start + 1:
+                    raise IncompleteRangeError(
+                        f"Got {len(r.content)} bytes of the range {start}-{end} of {url}")
+                return r.content
+        except RETRIED_ERRORS + (IncompleteRangeError,):
+            if attempt == retries:
+                raise
+            time.sleep(2 ** attempt)
+
+
+def _download_single(session, url, output_path, chunk_size, hasher, timeout):
+    """
+    Download the whole file on one connection, when ranges are not supported
+    """
+    size = 0
+    part_path = output_path + ".part"
+    with session.get(url, stream=True, timeout=timeout) as r, open(part_path, "wb") as fp:
+        r.raise_for_status()
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            fp.write(chunk)
+            hasher.update(chunk)
+            size += len(chunk)
+    return size
+
+
+def _download_ranges(session, url, output_path, info, chunk_size, n_workers, hasher,
+                     timeout, retries):
+    """
+    Download the chunks missing from the partial file across a thread pool. The chunks
+    are hashed in order as they complete, the ones downloaded by a previous run are
+    read back from the partial file
+    """
+    part_path = output_path + ".part"
+    state_path = part_path + ".json"
+    expected = {"url": url, "size": info["size"], "validator": info["validator"],
+                "chunk_size": chunk_size}
+    done = _load_state(state_path, expected) if os.path.exists(part_path) else set()
+    if not done:
+        with open(part_path, "wb") as fp:
+            fp.truncate(info["size"])
+    n_chunks = (info["size"] + chunk_size - 1) // chunk_size
+
+    def bounds(index):
+        start = index * chunk_size
+        return start, min(start + chunk_size, info["size"]) - 1
+
+    resumed = sum(bounds(index)[1] - bounds(index)[0] + 1 for index in done)
+    if done:
+        logger.info(f"Resuming {url}: {len(done)} of {n_chunks} chunks already downloaded")
+
+    fd = os.open(part_path, os.O_RDWR)
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            # at most 2 * n_workers chunks are in flight or waiting to be hashed
+            pending, next_submit = {}, 0
+            for index in range(n_chunks):
+                while next_submit < n_chunks and next_submit < index + 2 * n_workers:
+                    if next_submit not in done:
+                        pending[next_submit] = executor.submit(
+                            _fetch_range, session, url, *bounds(next_submit),
+                            info["validator"], timeout, retries)
+                    next_submit += 1
+                start, end = bounds(index)
+                if index in done:
+                    data = os.pread(fd, end - start + 1, start)
+                else:
+                    data = pending.pop(index).result()
+                    os.pwrite(fd, data, start)
+                    done.add(index)
+                    _save_state(state_path, expected, done)
+                hasher.update(data)
+    finally:
+        os.close(fd)
+    os.remove(state_path)
+    return info["size"], resumed
+
+
+def download(url, output_path, chunk_size=CHUNK_SIZE, n_workers=4, sha256=None,
+             timeout=60, retries=3, session=None):
+    """
+    Download url to output_path and return the size, the time taken, whether range
+    requests were used, the bytes reused from an interrupted download and the sha256
+    of the file. Raises ValueError when sha256 is given and does not match
+    """
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=n_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    hasher = hashlib.sha256()
+    start = time.perf_counter()
+    info = _probe(session, url, timeout)
+    if info is None:
+        logger.info(f"{url} does not support range requests, downloading on one stream")
+        size, resumed = _download_single(session, url, output_path, chunk_size, hasher,
+                                         timeout), 0
+    else:
+        size, resumed = _download_ranges(session, url, output_path, info, chunk_size,
+                                         n_workers, hasher, timeout, retries)
+
+    digest = hasher.hexdigest()
+    if sha256 and digest != sha256.lower():
+        os.remove(output_path + ".part")
+        raise ValueError(f"Checksum mismatch for {url}: expected {sha256}, got {digest}")
+    os.replace(output_path + ".part", output_path)
+    stats = {
+        "bytes": size,
+        "seconds": time.perf_counter() - start,
+        "ranged": info is not None,
+        "resumed_bytes": resumed,
+        "sha256": digest,
+    }
+    logger.info(f"Downloaded {size} bytes in {stats['seconds']:.2f}s (sha256 {digest})")
+    return stats
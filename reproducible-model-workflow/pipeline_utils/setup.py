@@ -0,0 +1,12 @@
+from setuptools import setup
+
+
+# Helpers shared by the steps of the exercises. Each step installs them in its conda
+# environment with "-e <path to this folder>" among its pip dependencies
+setup(
+    name="pipeline_utils",
+    version="0.1.0",
+    description="Download and artifact helpers shared by the pipeline steps",
+    packages=["pipeline_utils"],
+    install_requires=["requests"],
+)
@@ -0,0 +1,154 @@
+import os
+import threading
+import time
+
+import pytest
+
+from pipeline_utils import artifact_cache
+
+
+class CountingBackend(artifact_cache.OfflineBackend):
+    """
+    Offline backend counting (and slowing down) the downloads
+    """
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.fetches = 0
+
+    def fetch(self, handle, dest_dir):
+        self.fetches += 1
+        time.sleep(0.2)
+        super().fetch(handle, dest_dir)
+
+
+@pytest.fixture
+def backend(tmp_path):
+
+    backend = CountingBackend(str(tmp_path / "store"))
+    for name, size in [("data_a.csv", 1000), ("data_b.csv", 2000), ("data_c.csv", 3000)]:
+        path = tmp_path / name
+        path.write_bytes(os.urandom(size))
+        backend.log_artifact(f"exercise_5/{name}", [str(path)])
+
+    return backend
+
+
+def test_hit_and_miss(backend, tmp_path):
+
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+
+    first = artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:latest", cache)
+    second = artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:v0", cache)
+
+    assert first.digest == second.digest
+    assert (cache.misses, cache.hits, backend.fetches) == (1, 1, 1)
+
+    # a new version of the artifact has a new digest and is downloaded
+    path = tmp_path / "data_a.csv"
+    path.write_bytes(b"new content")
+    backend.log_artifact("exercise_5/data_a.csv", [str(path)])
+    third = artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:latest", cache)
+
+    assert third.digest != first.digest and backend.fetches == 2
+    assert open(third.file(str(tmp_path / "out")), "rb").read() == b"new content"
+
+
+def test_hardlink_materialization(backend, tmp_path):
+
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    artifact = artifact_cache.use_artifact(backend, "exercise_5/data_b.csv:latest", cache)
+
+    local_path = artifact.file(str(tmp_path / "work"))
+    cached_path = os.path.join(artifact.path, "data_b.csv")
+
+    assert os.path.samefile(local_path, cached_path)
+    assert os.stat(cached_path).st_nlink == 2
+    # materializing again keeps the same link
+    assert artifact.file(str(tmp_path / "work")) == local_path
+
+
+def test_default_materialization(backend, tmp_path, monkeypatch):
+
+    monkeypatch.chdir(tmp_path)
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_bytes=4000)
+    b = artifact_cache.use_artifact(backend, "exercise_5/data_b.csv:latest", cache)
+
+    local_path = b.file()
+
+    # the files are linked under the cache root, not in the working directory
+    assert local_path.startswith(str(tmp_path / "cache"))
+    assert os.path.samefile(local_path, os.path.join(b.path, "data_b.csv"))
+    assert not (tmp_path / "artifacts").exists()
+
+    # and removed with the artifact when it is evicted
+    artifact_cache.use_artifact(backend, "exercise_5/data_c.csv:latest", cache)
+    assert not os.path.exists(local_path)
+
+
+def test_lru_eviction(backend, tmp_path):
+
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_bytes=5000)
+
+    a = artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:latest", cache)
+    b = artifact_cache.use_artifact(backend, "exercise_5/data_b.csv:latest", cache)
+    local_path = b.file(str(tmp_path / "work"))
+    # using a again makes b the least recently used artifact
+    artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:latest", cache)
+    c = artifact_cache.use_artifact(backend, "exercise_5/data_c.csv:latest", cache)
+
+    assert os.path.isdir(a.path) and os.path.isdir(c.path)
+    assert not os.path.exists(b.path)
+    # the materialized link survives the eviction
+    assert os.path.getsize(local_path) == 2000
+
+
+def test_concurrent_materialization(backend, tmp_path):
+
+    cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+    artifact = artifact_cache.use_artifact(backend, "exercise_5/data_a.csv:latest", cache)
+    results, errors = [], []
+
+    def materialize(root):
+        try:
+            results.append(artifact.file(root))
+        except Exception as err:
+            errors.append(err)
+
+    # steps sharing the checkout of the cache, then a folder of their own
+    for root in (None, str(tmp_path / "work")):
+        threads = [threading.Thread(target=materialize, args=(root,)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    assert len(set(results)) == 2
+    assert sorted(os.listdir(tmp_path / "work")) == ["data_a.csv"]
+
+    # the files of an evicted artifact cannot be materialized again
+    artifact_cache.ArtifactCache(str(tmp_path / "cache"), max_bytes=0).get(
+        backend, "exercise_5/data_b.csv:latest")
+    with pytest.raises(FileNotFoundError):
+        artifact.file()
+
+
+def test_concurrent_download(backend, tmp_path):
+
+    results = []
+
+    def use():
+        # each step opens its own cache, as separate processes would
+        cache = artifact_cache.ArtifactCache(str(tmp_path / "cache"))
+        artifact = artifact_cache.use_artifact(backend, "exercise_5/data_c.csv:latest", cache)
+        results.append(artifact.path)
+
+    threads = [threading.Thread(target=use) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 4 and len(set(results)) == 1
+    assert backend.fetches == 1
@@ -0,0 +1,182 @@
+import hashlib
+import os
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from pipeline_utils import downloader
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Stand-in for a file server answering range requests. Requests for the ranges
+    listed in server.fail_ranges are dropped, to simulate an interrupted download, and
+    the first answer for the ranges in server.truncate_ranges stops halfway
+    """
+
+    def send_head(self):
+        match = re.match(r"bytes=(\d+)-(\d+)$", self.headers.get("Range", ""))
+        if not self.server.ranges or match is None:
+            return super().send_head()
+        start, end = int(match.group(1)), int(match.group(2))
+        if start in self.server.fail_ranges:
+            self.close_connection = True
+            return None
+        self.server.requested.append((start, end))
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        if start >= size:
+            self.send_error(416)
+            return None
+        end = min(end, size - 1)
+        f = open(path, "rb")
+        f.seek(start)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", '"%d"' % os.stat(path).st_mtime_ns)
+        self.end_headers()
+        self.range_length = end - start + 1
+        if start in self.server.truncate_ranges:
+            self.server.truncate_ranges.discard(start)
+            self.range_length //= 2
+            self.close_connection = True
+        return f
+
+    def copyfile(self, source, outputfile):
+        length = getattr(self, "range_length", None)
+        if length is None:
+            return super().copyfile(source, outputfile)
+        outputfile.write(source.read(length))
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+
+    content = os.urandom(1_000_000 + 123)
+    (tmp_path / "served").mkdir()
+    (tmp_path / "served" / "data.bin").write_bytes(content)
+
+    handler = lambda *args: RangeRequestHandler(*args, directory=str(tmp_path / "served"))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    httpd.ranges, httpd.fail_ranges, httpd.requested = True, set(), []
+    httpd.truncate_ranges = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, f"http://127.0.0.1:{httpd.server_address[1]}/data.bin", content
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_ranged_download(server, tmp_path):
+
+    httpd, url, content = server
+    output_path = str(tmp_path / "data.bin")
+
+    stats = downloader.download(url, output_path, chunk_size=100_000, n_workers=4,
+                                sha256=hashlib.sha256(content).hexdigest())
+
+    assert stats["ranged"] and stats["resumed_bytes"] == 0
+    assert open(output_path, "rb").read() == content
+    assert not os.path.exists(output_path + ".part")
+
+
+def test_resume_download(server, tmp_path):
+
+    httpd, url, content = server
+    output_path = str(tmp_path / "data.bin")
+
+    # the chunk starting at 500000 fails, the run stops with the others recorded
+    httpd.fail_ranges = {500_000}
+    with pytest.raises(requests.ConnectionError):
+        downloader.download(url, output_path, chunk_size=100_000, n_workers=2, retries=0)
+    assert os.path.exists(output_path + ".part.json")
+
+    httpd.fail_ranges, httpd.requested = set(), []
+    stats = downloader.download(url, output_path, chunk_size=100_000, n_workers=2,
+                                sha256=hashlib.sha256(content).hexdigest())
+
+    assert stats["resumed_bytes"] >= 500_000
+    # the probe asks for the first byte, the first chunk is not downloaded again
+    assert (500_000, 599_999) in httpd.requested and (0, 99_999) not in httpd.requested
+    assert open(output_path, "rb").read() == content
+
+
+def test_single_stream_fallback(server, tmp_path):
+
+    httpd, url, content = server
+    httpd.ranges = False
+    output_path = str(tmp_path / "data.bin")
+
+    stats = downloader.download(url, output_path, chunk_size=100_000)
+
+    assert not stats["ranged"]
+    assert stats["sha256"] == hashlib.sha256(content).hexdigest()
+    assert open(output_path, "rb").read() == content
+
+
+def test_checksum_mismatch(server, tmp_path):
+
+    httpd, url, content = server
+    output_path = str(tmp_path / "data.bin")
+
+    with pytest.raises(ValueError):
+        downloader.download(url, output_path, chunk_size=100_000, sha256="0" * 64)
+
+    assert not os.path.exists(output_path)
+    assert not os.path.exists(output_path + ".part")
+
+
+def test_truncated_range_is_retried(server, tmp_path):
+
+    httpd, url, content = server
+    output_path = str(tmp_path / "data.bin")
+
+    # the answer stops halfway through its Content-Length, then the connection closes
+    httpd.truncate_ranges = {300_000}
+    stats = downloader.download(url, output_path, chunk_size=100_000, n_workers=2,
+                                sha256=hashlib.sha256(content).hexdigest())
+
+    assert httpd.requested.count((300_000, 399_999)) == 2
+    assert stats["sha256"] == hashlib.sha256(content).hexdigest()
+
+
+def test_short_range_body_is_retried(server, tmp_path, monkeypatch):
+
+    httpd, url, content = server
+    output_path = str(tmp_path / "data.bin")
+    fetch = downloader.requests.Session.get
+    short = {"count": 0}
+
+    def get(session, url, **kwargs):
+        response = fetch(session, url, **kwargs)
+        # a proxy answering the first range request of the chunk with a short body
+        headers = kwargs.get("headers", {})
+        if headers.get("Range") == "bytes=200000-299999" and not short["count"]:
+            short["count"] += 1
+            response._content = response.content[:10]
+        return response
+
+    monkeypatch.setattr(downloader.requests.Session, "get", get)
+    downloader.download(url, output_path, chunk_size=100_000, n_workers=2)
+
+    assert short["count"] == 1
+    assert open(output_path, "rb").read() == content
+
+
+def test_empty_file(server, tmp_path):
+
+    httpd, url, content = server
+    (tmp_path / "served" / "empty.bin").write_bytes(b"")
+    output_path = str(tmp_path / "empty.bin")
+
+    stats = downloader.download(url.replace("data.bin", "empty.bin"), output_path)
+
+    assert not stats["ranged"] and stats["bytes"] == 0
+    assert os.path.getsize(output_path) == 0
@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 import argparse
 import logging
-import pathlib
 import wandb
 
+from pipeline_utils import artifact_cache
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)-15s %(message)s")
 logger = logging.getLogger()
@@ -15,7 +16,7 @@ def go(args):
     run = wandb.init(project="exercise_1", job_type="use_file")
 
     logger.info("Getting artifact")
-    artifact = run.use_artifact(args.artifact_name)
+    artifact = artifact_cache.use_artifact(run, args.artifact_name)
 
     logger.info("Artifact content:")
     filepath = artifact.file()
@@ -0,0 +1,735 @@
+"""
+Benchmarks for the churn_library pipeline steps
+File: churn_benchmarks.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+import urllib.request
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import classification_report, roc_curve
+
+import churn_forest
+import churn_instrument
+import churn_library as cls
+import churn_metrics
+import churn_online
+import churn_scoring
+
+
+CATEGORY_LIST = ["Gender",
+                 "Education_Level",
+                 "Marital_Status",
+                 "Income_Category",
+                 "Card_Category"]
+
+SCALES = {'10k': 10_000, '1m': 1_000_000, '10m': 10_000_000}
+
+# above this number of rows the suite runs the approximate eda
+EXACT_EDA_MAX_ROWS = 100_000
+
+# single candidate search of the suite, so train_models times one fit per fold
+SUITE_PARAM_GRID = {'n_estimators': [100], 'max_depth': [5]}
+
+
+def legacy_encoder_helper(df, category_lst):
+    """
+    row by row encoder that was used before fit_encoder/transform_encoder,
+    kept only as a baseline for the benchmarks
+
+    input:
+            df: pandas dataframe
+            category_lst: list of columns that contain categorical features
+
+    output:
+            df: pandas dataframe with new columns for
+    """
+    for category in category_lst:
+        category_serie = []
+        category_groups = df.groupby(category).mean(numeric_only=True)['Churn']
+        for row in df[category]:
+            category_serie.append(category_groups.loc[row])
+        df[f'{category}_Churn'] = category_serie
+    return df
+
+
+def time_call(func, *args, repeat=3, **kwargs):
+    """
+    returns the best wall time in seconds of repeat calls to func
+
+    input:
+            func: callable to time
+            repeat: number of calls
+    output:
+            seconds: best wall time
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark_encoder(df, category_lst=None, repeat=3):
+    """
+    compares the legacy row by row encoder with the vectorized fit/transform encoder
+
+    input:
+            df: pandas dataframe with the Churn column
+            category_lst: list of columns that contain categorical features
+            repeat: number of timed calls per implementation
+    output:
+            results: dict with the best time of each implementation and the speedup
+    """
+    category_lst = category_lst or CATEGORY_LIST
+    legacy = time_call(legacy_encoder_helper, df.copy(), category_lst, repeat=repeat)
+    vectorized = time_call(cls.encoder_helper, df.copy(), category_lst, repeat=repeat)
+    encoder = cls.fit_encoder(df, category_lst)
+    transform = time_call(cls.transform_encoder, df.copy(), encoder, repeat=repeat)
+
+    expected = legacy_encoder_helper(df.copy(), category_lst)
+    encoded = cls.encoder_helper(df.copy(), category_lst)
+    for category in category_lst:
+        pd.testing.assert_series_equal(encoded[f'{category}_Churn'],
+                                       expected[f'{category}_Churn'],
+                                       check_dtype=False)
+
+    return {'rows': len(df),
+            'legacy_s': legacy,
+            'vectorized_s': vectorized,
+            'transform_only_s': transform,
+            'speedup': legacy / vectorized}
+
+
+def benchmark_import_cache(file_path, repeat=3):
+    """
+    compares parsing the csv with cold (csv parsed and cached) and warm (memory-mapped
+    feather) loads through the columnar cache
+
+    input:
+            file_path: path to the bank data csv
+            repeat: number of timed calls of the csv and warm loads
+    output:
+            results: dict with the time of each kind of load
+    """
+    csv = time_call(cls.import_data, file_path, repeat=repeat)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        start = time.perf_counter()
+        cls.import_data(file_path, cache_dir=cache_dir)
+        cold = time.perf_counter() - start
+        warm = time_call(cls.import_data, file_path, cache_dir=cache_dir, repeat=repeat)
+        # forget the recorded digest so the warm load has to hash the file again
+        os.remove(os.path.join(cache_dir, 'digests.json'))
+        rehash = time_call(cls.import_data, file_path, cache_dir=cache_dir, repeat=1)
+    return {'csv_s': csv, 'cold_s': cold, 'warm_s': warm, 'warm_rehash_s': rehash,
+            'speedup': csv / warm}
+
+
+def benchmark_eda(df, n_jobs=-1):
+    """
+    times every eda figure on its own, then perform_eda sequentially and with a
+    process pool
+
+    input:
+            df: pandas dataframe
+            n_jobs: number of processes of the parallel run
+    output:
+            results: dict with the time of each figure and of both perform_eda runs
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        for name, (column, plot_func) in cls.EDA_PLOTS.items():
+            data = df.select_dtypes('number') if column is None else df[column]
+            results['%s_s' % name] = time_call(
+                cls.render_figure, plot_func, data, os.path.join(output_dir, 'plot.jpg'),
+                repeat=1)
+        results['sequential_s'] = time_call(cls.perform_eda, df, output_dir, 1, repeat=1)
+        results['parallel_s'] = time_call(cls.perform_eda, df, output_dir, n_jobs, repeat=1)
+    return results
+
+
+def _sklearn_reports(y_true, y_pred, proba):
+    """
+    report and roc curve of one model with sklearn, as classification_report_image
+    computed them before churn_metrics
+    """
+    return classification_report(y_true, y_pred), roc_curve(y_true, proba)
+
+
+def _engine_reports(y_true, y_pred, proba):
+    """
+    report and roc curve of one model with churn_metrics
+    """
+    return (churn_metrics.format_report(churn_metrics.classification_metrics(
+        churn_metrics.score_counts(y_true, y_pred))),
+            churn_metrics.curves(churn_metrics.score_counts(y_true, proba)))
+
+
+def benchmark_metrics(n_rows=1_000_000, repeat=3, random_state=42):
+    """
+    compares the report and roc curve of sklearn with the churn_metrics engine on
+    random responses and probabilities
+
+    input:
+            n_rows: number of rows
+            repeat: number of timed calls per implementation
+            random_state: seed of the random data
+    output:
+            results: dict with the best time of each implementation and the speedup
+    """
+    rng = np.random.RandomState(random_state)
+    y_true = rng.randint(0, 2, n_rows)
+    proba = np.clip(rng.rand(n_rows) * 0.6 + y_true * 0.3, 0, 1)
+    y_pred = (proba > 0.5).astype(int)
+    sklearn_s = time_call(_sklearn_reports, y_true, y_pred, proba, repeat=repeat)
+    engine_s = time_call(_engine_reports, y_true, y_pred, proba, repeat=repeat)
+    return {'rows': n_rows, 'sklearn_s': sklearn_s, 'engine_s': engine_s,
+            'speedup': sklearn_s / engine_s}
+
+
+def benchmark_search(X_train, X_test, y_train, y_test, n_jobs=-1, searches=('grid', 'halving')):
+    """
+    times each random forest search strategy and reports the quality of the model it
+    selects
+
+    input:
+            X_train, X_test, y_train, y_test: output of perform_feature_engineering
+            n_jobs: number of processes of each search
+            searches: strategies to compare
+    output:
+            results: dict with the time, best parameters and test accuracy of each strategy
+    """
+    results = {}
+    for search in searches:
+        cv_rfc = cls.build_search(search, n_jobs=n_jobs)
+        start = time.perf_counter()
+        cv_rfc.fit(X_train, y_train)
+        results['%s_s' % search] = time.perf_counter() - start
+        results['%s_candidates_fit' % search] = len(cv_rfc.cv_results_['params'])
+        results['%s_best_params' % search] = cv_rfc.best_params_
+        results['%s_test_accuracy' % search] = cv_rfc.best_estimator_.score(X_test, y_test)
+    return results
+
+
+def benchmark_warm_start(X_train, y_train, n_jobs=-1, param_grid=None):
+    """
+    compares a grid search with the warm start search, which grows one forest per fold
+    through the n_estimators values, and a second warm start fit reusing cached forests
+
+    input:
+            X_train, y_train: training data
+            n_jobs: number of processes of each search
+            param_grid: dict of parameters to search, defaults to RF_PARAM_GRID
+    output:
+            results: dict with times, trees fitted and whether both searches agree
+    """
+    param_grid = cls.RF_PARAM_GRID if param_grid is None else param_grid
+    grid = cls.build_search('grid', n_jobs=n_jobs, param_grid=param_grid)
+    start = time.perf_counter()
+    grid.fit(X_train, y_train)
+    grid_s = time.perf_counter() - start
+
+    warm = cls.build_search('warm_start', n_jobs=n_jobs, param_grid=param_grid,
+                            cache_forests=True)
+    start = time.perf_counter()
+    warm.fit(X_train, y_train)
+    warm_s = time.perf_counter() - start
+    trees_fit = warm.trees_fit_
+    start = time.perf_counter()
+    warm.fit(X_train, y_train)
+    cached_s = time.perf_counter() - start
+
+    return {'grid_s': grid_s,
+            'warm_start_s': warm_s,
+            'warm_start_cached_s': cached_s,
+            'grid_trees_fit': grid.n_splits_ * int(np.sum(grid.cv_results_['param_n_estimators']))
+            + grid.best_params_['n_estimators'],
+            'warm_start_trees_fit': trees_fit,
+            'warm_start_cached_trees_fit': warm.trees_fit_,
+            'same_best_params': grid.best_params_ == warm.best_params_,
+            'same_cv_scores': bool(np.array_equal(grid.cv_results_['mean_test_score'],
+                                                  warm.cv_results_['mean_test_score']))}
+
+
+def benchmark_online(X_train, X_test, y_train, y_test, n_batches=12):
+    """
+    compares refitting the logistic regression on all the history after each new batch
+    with updating the incremental models with each new batch
+
+    input:
+            X_train, y_train: training data, split in n_batches consecutive batches
+            X_test, y_test: data the final models are scored on
+            n_batches: number of batches, e.g. months of history
+    output:
+            results: dict with the time of the last refit and the mean time of an update,
+                     and the test roc auc of each final model
+    """
+    batches = np.array_split(np.arange(len(X_train)), n_batches)
+    refit = LogisticRegression(solver='lbfgs', max_iter=3000)
+    refit_s = time_call(refit.fit, X_train, y_train, repeat=1)
+    results = {'rows': len(X_train),
+               'refit_s': refit_s,
+               'refit_auc': churn_metrics.curves(churn_metrics.score_counts(
+                   y_test, refit.predict_proba(X_test)[:, 1]))['roc_auc']}
+    for method in churn_online.ONLINE_METHODS:
+        state = churn_online.make_online_state(method, X_train.columns)
+        updates = [churn_online.update_online_state(state, X_train.iloc[rows],
+                                                    y_train.iloc[rows])
+                   for rows in batches]
+        results['%s_update_s' % method] = float(np.mean([update['seconds']
+                                                         for update in updates]))
+        results['%s_auc' % method] = churn_metrics.curves(churn_metrics.score_counts(
+            y_test, churn_online.predict_proba(state, X_test)))['roc_auc']
+    return results
+
+
+def benchmark_packed_forest(forest, X, n_rows=200):
+    """
+    compares the latency of single row predictions, and the time of a batch, of the
+    sklearn forest and of its packed export
+
+    input:
+            forest: fitted RandomForestClassifier
+            X: features to score
+            n_rows: number of rows scored one at a time
+    output:
+            results: dict with the latencies, batch times and whether both agree bit for bit
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    start = time.perf_counter()
+    packed = churn_forest.export_forest(forest)
+    results = {'export_s': time.perf_counter() - start}
+    for name, predict_proba in [('sklearn', forest.predict_proba),
+                                ('packed', lambda rows: churn_forest.predict_proba(packed, rows))]:
+        latencies = []
+        for row in range(min(n_rows, len(X))):
+            start = time.perf_counter()
+            predict_proba(X[row:row + 1])
+            latencies.append((time.perf_counter() - start) * 1000)
+        results['%s_single_p50_ms' % name] = float(np.percentile(latencies, 50))
+        results['%s_single_p99_ms' % name] = float(np.percentile(latencies, 99))
+        results['%s_batch_s' % name] = time_call(predict_proba, X, repeat=1)
+    results['bit_for_bit'] = bool(np.array_equal(forest.predict_proba(X),
+                                                 churn_forest.predict_proba(packed, X)))
+    return results
+
+
+def _private_memory_mb():
+    """
+    returns the memory of this process that is not shared with other processes (the
+    anonymous resident memory on linux, the peak resident memory elsewhere)
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('RssAnon:'):
+                    return int(line.split()[1]) / 1024
+    except FileNotFoundError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _load_in_process(model_pth, mmap_mode):
+    """
+    load a model in a fresh worker process and return the load time and the private
+    memory it added
+    """
+    before = _private_memory_mb()
+    start = time.perf_counter()
+    model = joblib.load(model_pth, mmap_mode=mmap_mode)
+    seconds = time.perf_counter() - start
+    private_mb = _private_memory_mb() - before
+    del model
+    return seconds, private_mb
+
+
+def benchmark_persistence(models, n_processes=4):
+    """
+    saves each model in every persistence layout and loads it from n_processes fresh
+    worker processes, as a scoring fleet would
+
+    input:
+            models: dict name -> model to save
+            n_processes: number of processes loading each file
+    output:
+            results: dict with the file size, mean load time and private memory per
+                     process of each model and layout
+    """
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as model_dir:
+        for persistence in cls.MODEL_PERSISTENCE:
+            for name, model in models.items():
+                model_pth = os.path.join(model_dir, '%s_%s.pkl' % (name, persistence))
+                cls.save_model(model, model_pth, persistence)
+                with context.Pool(n_processes) as pool:
+                    loads = pool.starmap(
+                        _load_in_process,
+                        [(model_pth, 'r' if persistence == 'mmap' else None)] * n_processes)
+                key = '%s_%s' % (name, persistence)
+                results['%s_file_mb' % key] = os.path.getsize(model_pth) / 2 ** 20
+                results['%s_load_s' % key] = float(np.mean([load[0] for load in loads]))
+                results['%s_private_mb' % key] = float(np.mean([load[1] for load in loads]))
+    return results
+
+
+def _request_latencies(url, records, n_clients):
+    """
+    post every record to url as a single customer request from n_clients threads
+    and return the latency of each request in milliseconds
+    """
+    latencies = []
+    lock = threading.Lock()
+
+    def client(client_records):
+        for record in client_records:
+            request = urllib.request.Request(url, data=json.dumps(record).encode(),
+                                             headers={'Content-Type': 'application/json'})
+            start = time.perf_counter()
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            with lock:
+                latencies.append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=client, args=(records[i::n_clients],))
+               for i in range(n_clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies)
+
+
+def benchmark_scoring(df, models, batch_size=100_000, n_requests=500, n_clients=16):
+    """
+    measures the batch scoring throughput of a csv, and the p50/p99 latency of
+    concurrent single customer requests to the http endpoint with and without
+    micro-batching
+
+    input:
+            df: pandas dataframe of customers
+            models: dict returned by churn_scoring.load_models
+            batch_size: number of rows scored at a time
+            n_requests: number of single customer requests
+            n_clients: number of concurrent clients
+    output:
+            results: dict with rows per second, latencies and mean batch sizes
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, 'customers.csv')
+        df.to_csv(input_path, index=False)
+        stats = churn_scoring.score_file(input_path, os.path.join(tmp_dir, 'scores.csv'),
+                                         models, batch_size)
+    results['batch_rows_per_s'] = stats['rows_per_s']
+
+    columns = churn_scoring.input_columns(models)
+    records = json.loads(df[columns].head(n_requests).to_json(orient='records'))
+    for name, max_batch_size in [('single', 1), ('micro_batch', 64)]:
+        server = churn_scoring.make_server(models, port=0, max_batch_size=max_batch_size)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        url = 'http://127.0.0.1:%d/predict' % server.server_address[1]
+        try:
+            start = time.perf_counter()
+            latencies = _request_latencies(url, records, n_clients)
+            seconds = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.batcher.close()
+        results['%s_p50_ms' % name] = float(np.percentile(latencies, 50))
+        results['%s_p99_ms' % name] = float(np.percentile(latencies, 99))
+        results['%s_requests_per_s' % name] = len(latencies) / seconds
+        results['%s_mean_batch_size' % name] = float(np.mean(server.batcher.batch_sizes_))
+    return results
+
+
+def synthetic_bank_data(n_rows, reference, random_state=42, start=0):
+    """
+    returns a frame shaped like bank_data: same columns and dtypes, same categorical
+    levels and about the same Attrition_Flag ratio. The flag of each row is drawn
+    first, then every other column is drawn from its values in the reference rows of
+    the same flag, so the columns keep their relation with churn
+
+    input:
+            n_rows: number of rows
+            reference: frame returned by import_data on the real data
+            random_state: seed of the generator
+            start: first row number, for the 'Unnamed: 0' and CLIENTNUM columns
+    output:
+            df: pandas dataframe without the Churn column
+    """
+    rng = np.random.default_rng(random_state)
+    reference = reference.drop(columns='Churn', errors='ignore')
+    flags = reference['Attrition_Flag']
+    flag_codes = rng.choice(len(flags.cat.categories), size=n_rows,
+                            p=flags.value_counts(normalize=True, sort=False).to_numpy())
+
+    columns = {}
+    for column, dtype in reference.dtypes.items():
+        if column in ('Unnamed: 0', 'CLIENTNUM'):
+            columns[column] = (np.arange(start, start + n_rows) + (column == 'CLIENTNUM')
+                               * 700_000_000).astype(dtype)
+            continue
+        values = reference[column].cat.codes.to_numpy() \
+            if isinstance(dtype, pd.CategoricalDtype) else reference[column].to_numpy()
+        drawn = np.empty(n_rows, dtype=values.dtype)
+        for code in range(len(flags.cat.categories)):
+            rows = flag_codes == code
+            pool = values[flags.cat.codes.to_numpy() == code]
+            drawn[rows] = pool[rng.integers(0, len(pool), rows.sum())]
+        if isinstance(dtype, pd.CategoricalDtype):
+            drawn = pd.Categorical.from_codes(drawn, dtype=dtype)
+        columns[column] = drawn
+    return pd.DataFrame(columns)
+
+
+def write_synthetic_csv(output_pth, n_rows, reference, chunksize=1_000_000, random_state=42):
+    """
+    write a synthetic bank_data csv of n_rows rows, generated chunksize rows at a time
+
+    input:
+            output_pth: path of the csv
+            n_rows: number of rows
+            reference: frame returned by import_data on the real data
+            chunksize: number of rows generated at a time
+            random_state: seed of the first chunk
+    output:
+            None
+    """
+    with open(output_pth, 'w', newline='') as output:
+        for start in range(0, n_rows, chunksize):
+            chunk = synthetic_bank_data(min(chunksize, n_rows - start), reference,
+                                        random_state + start // chunksize, start)
+            chunk.to_csv(output, header=start == 0, index=False)
+
+
+def _measure(results, name, rows, func, *args, **kwargs):
+    """
+    call func as an instrumented stage and append its measures to results
+    """
+    with churn_instrument.stage(name, rows) as record:
+        value = func(*args, **kwargs)
+    results.append({key: record[key] for key in
+                    ('stage', 'rows', 'wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb')})
+    return value
+
+
+def benchmark_suite(reference, scales=('10k',), training=False, work_dir=None):
+    """
+    times the public churn_library functions on synthetic data of each scale
+
+    input:
+            reference: frame returned by import_data on the real data
+            scales: keys of SCALES
+            training: also time fit_models, train_models and its report functions
+                      (at the 10k scale only)
+            work_dir: folder of the synthetic csv files, a temporary one by default
+    output:
+            results: list of dicts with the stage, rows, wall and cpu times and peak memory
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for scale in scales:
+            n_rows = SCALES[scale]
+            csv_pth = os.path.join(tmp_dir, 'bank_data_%s.csv' % scale)
+            _measure(results, 'write_synthetic_csv', n_rows, write_synthetic_csv, csv_pth,
+                     n_rows, reference)
+            data = _measure(results, 'import_data', n_rows, cls.import_data, csv_pth)
+            cache_dir = os.path.join(tmp_dir, 'cache')
+            _measure(results, 'import_data_cold_cache', n_rows, cls.import_data, csv_pth,
+                     cache_dir=cache_dir)
+            _measure(results, 'import_data_warm_cache', n_rows, cls.import_data, csv_pth,
+                     cache_dir=cache_dir)
+            approximate = n_rows > EXACT_EDA_MAX_ROWS
+            os.makedirs(os.path.join(tmp_dir, 'eda'), exist_ok=True)
+            _measure(results, 'perform_eda_approximate' if approximate else 'perform_eda',
+                     n_rows, cls.perform_eda, data, os.path.join(tmp_dir, 'eda'),
+                     approximate=approximate)
+            _measure(results, 'encoder_helper', n_rows, cls.encoder_helper, data.copy(),
+                     CATEGORY_LIST)
+            _measure(results, 'encode_out_of_fold', n_rows, cls.encode_out_of_fold, data,
+                     CATEGORY_LIST)
+            split = _measure(results, 'perform_feature_engineering', n_rows,
+                             cls.perform_feature_engineering, data, CATEGORY_LIST,
+                             return_encoder=True)
+            _measure(results, 'stream_feature_engineering', n_rows,
+                     cls.stream_feature_engineering, csv_pth, CATEGORY_LIST,
+                     os.path.join(tmp_dir, 'features'))
+            # the encoded churn rate of a category stands in for a churn score
+            _measure(results, 'score_counts', len(split[3]), churn_metrics.score_counts,
+                     split[3], split[1]['Income_Category_Churn'])
+            if training and n_rows <= SCALES['10k']:
+                _measure(results, 'fit_models', len(split[0]), cls.fit_models,
+                         {'rfc': RandomForestClassifier(n_estimators=200, random_state=42),
+                          'lr': LogisticRegression(solver='lbfgs', max_iter=3000)},
+                         split[0], split[2], n_jobs=-1)
+                _measure_training(results, split, tmp_dir)
+            del data, split
+    return results
+
+
+def _measure_training(results, split, tmp_dir):
+    """
+    time train_models on a single candidate grid, then the report functions it calls on
+    the predictions of the same models
+    """
+    X_train, X_test, y_train, y_test, encoder = split
+    model_dir, image_dir = os.path.join(tmp_dir, 'models'), os.path.join(tmp_dir, 'images')
+    os.makedirs(model_dir, exist_ok=True)
+    os.makedirs(os.path.join(image_dir, 'results'), exist_ok=True)
+    _measure(results, 'train_models', len(X_train), cls.train_models, X_train, X_test,
+             y_train, y_test, encoder=encoder, param_grid=SUITE_PARAM_GRID,
+             model_dir=model_dir, image_dir=image_dir)
+
+    cv_rfc = cls.build_search('grid', param_grid=SUITE_PARAM_GRID).fit(X_train, y_train)
+    lr = LogisticRegression(solver='lbfgs', max_iter=3000).fit(X_train, y_train)
+    _measure(results, 'classification_report_image', len(X_train) + len(X_test),
+             cls.classification_report_image, y_train, y_test, lr.predict(X_train),
+             cv_rfc.predict(X_train), lr.predict(X_test), cv_rfc.predict(X_test),
+             output_dir=os.path.join(image_dir, 'results'))
+    _measure(results, 'feature_importance_plot', len(X_test), cls.feature_importance_plot,
+             cv_rfc, X_test, 'results', image_dir=image_dir)
+
+
+def _git_commit():
+    """
+    returns the current commit and whether the working tree has uncommitted changes
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def save_suite_results(results, scales, output_dir='benchmarks'):
+    """
+    save the suite results with the commit and environment they were measured on, as
+    <output_dir>/<commit>-<scales>.json
+
+    input:
+            results: list returned by benchmark_suite
+            scales: scales of the run
+            output_dir: folder of the result files
+    output:
+            output_pth: path of the json file
+    """
+    commit, dirty = _git_commit()
+    content = {'commit': commit,
+               'dirty': dirty,
+               'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+               'python': platform.python_version(),
+               'platform': platform.platform(),
+               'cpu_count': os.cpu_count(),
+               'versions': {module.__name__: module.__version__ for module in (np, pd)},
+               'results': results}
+    os.makedirs(output_dir, exist_ok=True)
+    output_pth = os.path.join(output_dir, '%s%s-%s.json' % ((commit or 'unknown')[:12],
+                                                            '-dirty' if dirty else '',
+                                                            '-'.join(scales)))
+    with open(output_pth, 'w') as output:
+        json.dump(content, output, indent=1)
+    return output_pth
+
+
+def compare_suite_results(baseline_pth, current_pth):
+    """
+    returns the ratio of the wall time of each stage and scale of two saved runs
+
+    input:
+            baseline_pth: json file of the reference run
+            current_pth: json file of the run to compare
+    output:
+            comparison: pandas dataframe with the wall time of both runs and their ratio
+    """
+    runs = []
+    for pth in (baseline_pth, current_pth):
+        with open(pth) as file:
+            runs.append(pd.DataFrame(json.load(file)['results'])
+                        .set_index(['stage', 'rows'])['wall_s'])
+    comparison = pd.concat(runs, axis=1, keys=['baseline_s', 'current_s']).dropna()
+    comparison['ratio'] = comparison['current_s'] / comparison['baseline_s']
+    return comparison
+
+
+def _print_results(name, results):
+    """
+    print one line per benchmark result
+    """
+    for key, value in results.items():
+        print(f"{name} {key}: {value:.4f}" if isinstance(value, float) else f"{name} {key}: {value}")
+
+
+def main():
+    """
+    run the benchmarks from the command line
+    """
+    parser = argparse.ArgumentParser(description="Benchmark churn_library steps")
+    parser.add_argument("--data", type=str, default="data/bank_data.csv",
+                        help="Path to the bank data csv")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of timed calls per implementation")
+    parser.add_argument("--training", action="store_true",
+                        help="Also benchmark the (slow) model training steps")
+    parser.add_argument("--models", type=str, default=None,
+                        help="Folder of saved models to benchmark scoring with")
+    parser.add_argument("--suite", nargs='+', choices=sorted(SCALES), default=None,
+                        help="Run the benchmark suite on synthetic data of these scales")
+    parser.add_argument("--output-dir", type=str, default="benchmarks",
+                        help="Folder of the suite results")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), default=None,
+                        help="Compare two saved suite results")
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_suite_results(*args.compare).to_string())
+        return
+    data = cls.import_data(args.data)
+    if args.suite:
+        results = benchmark_suite(data, args.suite, training=args.training)
+        for result in results:
+            print(json.dumps(result))
+        print('Saved %s' % save_suite_results(results, args.suite, args.output_dir))
+        return
+    _print_results('encoder', benchmark_encoder(data, repeat=args.repeat))
+    _print_results('import', benchmark_import_cache(args.data, repeat=args.repeat))
+    _print_results('eda', benchmark_eda(data))
+    _print_results('metrics', benchmark_metrics(repeat=args.repeat))
+    if args.training:
+        split = cls.perform_feature_engineering(data, CATEGORY_LIST)
+        _print_results('search', benchmark_search(*split))
+        _print_results('warm_start', benchmark_warm_start(split[0], split[2]))
+        _print_results('online', benchmark_online(*split))
+    if args.models:
+        models = churn_scoring.load_models(args.models)
+        split = cls.perform_feature_engineering(data, CATEGORY_LIST)
+        _print_results('packed_forest', benchmark_packed_forest(models['rfc'], split[1]))
+        _print_results('persistence', benchmark_persistence(
+            {name: models[name] for name in models['manifest']['files']}))
+        _print_results('scoring', benchmark_scoring(data, models))
+
+
+if __name__ == '__main__':
+    main()
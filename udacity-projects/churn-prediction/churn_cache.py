@@ -0,0 +1,253 @@
+"""
+Columnar cache of parsed csv files keyed by the content hash of the source, and
+fingerprints of the inputs of generated figures
+File: churn_cache.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import hashlib
+import inspect
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    from pyarrow import feather
+except ImportError:  # pragma: no cover - pyarrow is optional
+    feather = None
+
+
+logger = logging.getLogger(__name__)
+
+DIGESTS_FILE = 'digests.json'
+MANIFEST_FILE = '.manifest.json'
+
+
+def file_digest(file_path, block_size=1 << 20):
+    """
+    returns the sha256 hex digest of the content of a file, read by blocks
+
+    input:
+            file_path: path to the file
+            block_size: number of bytes read at a time
+    output:
+            digest: hex string
+    """
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def cached_file_digest(file_path, cache_dir):
+    """
+    returns the content digest of a file, only re-hashing it when its size or
+    modification time changed since the last call
+
+    input:
+            file_path: path to the file
+            cache_dir: directory where the known digests are recorded
+    output:
+            digest: hex string
+    """
+    stat = os.stat(file_path)
+    key = os.path.abspath(file_path)
+    digests_path = os.path.join(cache_dir, DIGESTS_FILE)
+    try:
+        with open(digests_path) as file:
+            digests = json.load(file)
+    except (FileNotFoundError, ValueError):
+        digests = {}
+
+    known = digests.get(key)
+    if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+        return known['digest']
+
+    digest = file_digest(file_path)
+    digests[key] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'digest': digest}
+    os.makedirs(cache_dir, exist_ok=True)
+    _atomic_write_json(digests_path, digests)
+    return digest
+
+
+def _atomic_write_json(path, content):
+    """
+    write json to path through a temporary file so readers never see a partial file
+    """
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp_path, 'w') as file:
+        json.dump(content, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def cache_path(file_path, cache_dir, variant=''):
+    """
+    returns the path of the cached columnar file for the current content of file_path,
+    named after the file and a hash of its absolute path so that sources with the same
+    name in other folders do not share the name of their entries
+
+    input:
+            file_path: path to the source file
+            cache_dir: directory of the cached files
+            variant: extra text that changes the key, e.g. the parsing schema
+    output:
+            path: path of the feather file
+    """
+    key = hashlib.sha256(
+        (cached_file_digest(file_path, cache_dir) + variant).encode()).hexdigest()
+    source = hashlib.sha256(os.path.abspath(file_path).encode()).hexdigest()
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(cache_dir, '%s-%s-%s.feather' % (stem, source[:8], key[:16]))
+
+
+def load_cached(file_path, cache_dir, build, variant=''):
+    """
+    returns the dataframe parsed from file_path, from a memory-mapped feather copy when
+    the content of file_path did not change, otherwise calls build and stores its result
+
+    input:
+            file_path: path to the source file
+            cache_dir: directory of the cached files
+            build: callable without arguments returning the parsed dataframe
+            variant: extra text that changes the key, e.g. the parsing schema
+    output:
+            df: pandas dataframe
+    """
+    if feather is None:
+        logger.warning('pyarrow is not installed, reading %s without cache', file_path)
+        return build()
+
+    path = cache_path(file_path, cache_dir, variant)
+    try:
+        table = feather.read_table(path, memory_map=True)
+        logger.info('Reading %s from cache %s', file_path, path)
+        return table.to_pandas()
+    except FileNotFoundError:
+        pass
+
+    data = build()
+    # the older entries of the same source file, another loader may have just
+    # written path itself
+    prefix = os.path.basename(path).rsplit('-', 1)[0] + '-'
+    for name in os.listdir(cache_dir):
+        if name.endswith('.feather') and name.startswith(prefix) and \
+                name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    feather.write_feather(data, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+    logger.info('Cached %s to %s', file_path, path)
+    return data
+
+
+def _code_digest(func):
+    """
+    returns a digest of the source of func, or of its bytecode and constants (strings,
+    numbers, nested functions) when the source is not available
+    """
+    try:
+        return hashlib.sha256(inspect.getsource(func).encode()).hexdigest()
+    except (OSError, TypeError):
+        pass
+
+    def code_parts(code):
+        yield code.co_code
+        for const in code.co_consts:
+            if inspect.iscode(const):
+                yield from code_parts(const)
+            else:
+                yield repr(const).encode()
+
+    sha = hashlib.sha256()
+    for part in code_parts(inspect.unwrap(func).__code__):
+        sha.update(part)
+    return sha.hexdigest()
+
+
+def fingerprint(*parts):
+    """
+    returns a sha256 hex digest of dataframes, series, arrays, functions and plain
+    values, so any change of the inputs of a figure changes its fingerprint
+
+    input:
+            parts: objects to hash
+    output:
+            digest: hex string
+    """
+    sha = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, pd.DataFrame):
+            sha.update(repr((list(part.columns), list(part.dtypes))).encode())
+            sha.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif isinstance(part, pd.Series):
+            sha.update(repr((part.name, part.dtype)).encode())
+            sha.update(pd.util.hash_pandas_object(part, index=False).to_numpy().tobytes())
+        elif isinstance(part, np.ndarray):
+            sha.update(repr((part.dtype, part.shape)).encode())
+            sha.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, dict):
+            sha.update(fingerprint(*(item for key in sorted(part) for item in (key, part[key])))
+                       .encode())
+        elif isinstance(part, (list, tuple)):
+            sha.update(fingerprint(*part).encode())
+        elif callable(part) and hasattr(part, '__code__'):
+            sha.update(part.__qualname__.encode())
+            sha.update(_code_digest(part).encode())
+        else:
+            sha.update(repr(part).encode())
+        sha.update(b'|')
+    return sha.hexdigest()
+
+
+def load_manifest(output_dir):
+    """
+    returns the figure name -> input fingerprint mapping recorded in output_dir
+
+    input:
+            output_dir: folder of the figures
+    output:
+            manifest: dict
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_manifest(output_dir, manifest):
+    """
+    record the figure name -> input fingerprint mapping in output_dir
+
+    input:
+            output_dir: folder of the figures
+            manifest: dict
+    output:
+            None
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    _atomic_write_json(os.path.join(output_dir, MANIFEST_FILE), manifest)
+
+
+def is_up_to_date(manifest, output_pth, digest):
+    """
+    returns True when output_pth exists and was rendered from inputs with this digest
+
+    input:
+            manifest: dict returned by load_manifest
+            output_pth: path of the figure
+            digest: fingerprint of the current inputs of the figure
+    output:
+            up_to_date: bool
+    """
+    return manifest.get(os.path.basename(output_pth)) == digest and os.path.exists(output_pth)
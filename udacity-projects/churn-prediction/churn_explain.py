@@ -0,0 +1,281 @@
+"""
+Per customer SHAP explanations of the random forest, computed in batches across a
+process pool, cached by model and row, and written to a columnar file
+File: churn_explain.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import argparse
+import glob
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shap
+
+import churn_cache
+import churn_forest
+import churn_library as cls
+import churn_scoring
+
+try:
+    from pyarrow import parquet
+    import pyarrow
+except ImportError:  # pragma: no cover - pyarrow is optional
+    parquet = None
+
+
+logger = logging.getLogger(__name__)
+
+# explainer of the worker processes, built once per process by _init_worker
+_EXPLAINER = None
+
+
+def sample_background(X, size=100, random_state=42):
+    """
+    returns a uniform sample of rows used as the background distribution of the
+    interventional explanations
+
+    input:
+            X: 2d array of features
+            size: number of sampled rows
+            random_state: seed of the sample
+    output:
+            background: contiguous float32 array of at most size rows
+    """
+    X = np.asarray(X, dtype=np.float32)
+    rows = np.random.RandomState(random_state).choice(len(X), min(size, len(X)),
+                                                      replace=False)
+    return np.ascontiguousarray(X[np.sort(rows)])
+
+
+def model_key(model, background):
+    """
+    returns the fingerprint of a forest and of its background, the part of the cache
+    key shared by all the rows explained with them
+    """
+    return churn_cache.fingerprint(churn_forest.export_forest(model), background)
+
+
+def row_hashes(X):
+    """
+    returns a uint64 hash of the values of each row
+    """
+    return pd.util.hash_pandas_object(pd.DataFrame(np.asarray(X, dtype=np.float32)),
+                                      index=False).to_numpy()
+
+
+def _make_explainer(model, background):
+    """
+    returns the TreeExplainer of the model, interventional when a background is given
+    """
+    if background is None:
+        return shap.TreeExplainer(model)
+    return shap.TreeExplainer(model, data=background, feature_perturbation='interventional')
+
+
+def _init_worker(model, background):
+    """
+    build the explainer once in each worker process
+    """
+    global _EXPLAINER  # pylint: disable=global-statement
+    _EXPLAINER = _make_explainer(model, background)
+
+
+def _explain_batch(X):
+    """
+    returns the shap values of the churn class and the base value for a batch of
+    rows, with the explainer of the current process
+    """
+    values = _EXPLAINER.shap_values(X, check_additivity=False)
+    # older shap versions return one array per class, newer ones a 3d array
+    values = values[1] if isinstance(values, list) else values[..., 1]
+    return values, float(np.ravel(_EXPLAINER.expected_value)[-1])
+
+
+def _load_cache(cache_dir, key):
+    """
+    returns the cached shap values of a model indexed by row hash
+    """
+    parts = sorted(glob.glob(os.path.join(cache_dir, key[:16], '*.parquet')))
+    if not parts:
+        return None
+    cached = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+    return cached.drop_duplicates('row_hash').set_index('row_hash')
+
+
+def _save_cache_part(cache_dir, key, explained):
+    """
+    add the new shap values of a model to its cache
+    """
+    model_dir = os.path.join(cache_dir, key[:16])
+    os.makedirs(model_dir, exist_ok=True)
+    part_pth = os.path.join(model_dir, '%d-%d.parquet' % (time.time_ns(), os.getpid()))
+    tmp_pth = part_pth + '.tmp'
+    explained.to_parquet(tmp_pth, index=False)
+    os.replace(tmp_pth, part_pth)
+
+
+def _explain_rows(model, X, background, feature_names, batch_size, n_jobs, cached):
+    """
+    returns the shap values of every row, reusing those found in cached, and the new
+    shap values that were computed (None if every row was cached)
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    hashes = row_hashes(X)
+    unique_hashes, first_rows = np.unique(hashes, return_index=True)
+    if cached is not None:
+        missing = ~np.isin(unique_hashes, cached.index.to_numpy())
+    else:
+        missing = np.ones(len(unique_hashes), dtype=bool)
+    todo = first_rows[missing]
+    logger.info('Explaining %d rows, %d from the cache',
+                len(todo), len(unique_hashes) - len(todo))
+
+    new = None
+    if len(todo):
+        batches = [X[todo[start:start + batch_size]]
+                   for start in range(0, len(todo), batch_size)]
+        n_workers = cls.worker_count(n_jobs, len(batches))
+        if n_workers == 1:
+            _init_worker(model, background)
+            results = [_explain_batch(batch) for batch in batches]
+        else:
+            with ProcessPoolExecutor(n_workers, initializer=_init_worker,
+                                     initargs=(model, background)) as executor:
+                results = list(executor.map(_explain_batch, batches))
+        new = pd.DataFrame(np.concatenate([values for values, _ in results]),
+                           columns=feature_names)
+        new.insert(0, 'base_value', results[0][1])
+        new.insert(0, 'row_hash', hashes[todo])
+
+    known = new.set_index('row_hash') if new is not None else None
+    if cached is not None:
+        known = cached if known is None else pd.concat([cached, known])
+    explained = known.reindex(hashes)
+    explained.index.name = 'row_hash'
+    return explained.reset_index(), new
+
+
+def explain(model, X, background=None, feature_names=None, batch_size=1000, n_jobs=1,
+            cache_dir=None):
+    """
+    returns the shap values of the churn class of each row. Duplicate rows and rows
+    already in the cache are not explained again, the others are explained in batches
+    of batch_size rows spread over n_jobs processes
+
+    input:
+            model: fitted RandomForestClassifier
+            X: 2d array or dataframe of features
+            background: sample of rows (see sample_background), None uses the tree
+                        path dependent explanations
+            feature_names: names of the columns of X, defaults to the dataframe columns
+            batch_size: number of rows explained by a task
+            n_jobs: number of processes, -1 uses every cpu
+            cache_dir: if set, keep the shap values in this directory and reuse them
+                       for rows explained before with the same model and background
+    output:
+            explained: pandas dataframe with the 'row_hash', 'base_value' and the shap
+                       value of each feature
+    """
+    if feature_names is None:
+        feature_names = list(getattr(X, 'columns', range(np.shape(X)[1])))
+    key = model_key(model, background) if cache_dir else None
+    cached = _load_cache(cache_dir, key) if cache_dir else None
+    explained, new = _explain_rows(model, X, background, feature_names, batch_size, n_jobs,
+                                   cached)
+    if cache_dir and new is not None:
+        _save_cache_part(cache_dir, key, new)
+    return explained
+
+
+def explain_file(input_path, output_path, models, background, batch_size=100_000,
+                 n_jobs=1, cache_dir=None):
+    """
+    explain every customer of a csv or parquet file, a batch of rows at a time, and
+    append the shap values to a parquet file
+
+    input:
+            input_path: path to a .csv or .parquet file of customers
+            output_path: path of the parquet file of shap values
+            models: dict returned by churn_scoring.load_models
+            background: sample of encoded rows (see sample_background)
+            batch_size: number of rows read at a time
+            n_jobs: number of processes explaining each batch
+            cache_dir: directory of the shap values cache, None disables it
+    output:
+            stats: dict with the number of rows, the seconds spent and the rows per second
+    """
+    if parquet is None:
+        raise ImportError('pyarrow is required to write the explanations')
+    start = time.perf_counter()
+    key = model_key(models['rfc'], background) if cache_dir else None
+    # the cache is read once, the batches add their new rows to it
+    cached = _load_cache(cache_dir, key) if cache_dir else None
+    rows, writer = 0, None
+    try:
+        for batch in churn_scoring.iter_batches(input_path,
+                                                churn_scoring.input_columns(models),
+                                                batch_size):
+            explained, new = _explain_rows(
+                models['rfc'], churn_scoring.encode_features(batch, models), background,
+                models['features'], max(len(batch) // max(n_jobs, 1), 1), n_jobs, cached)
+            if new is not None:
+                if cache_dir:
+                    _save_cache_part(cache_dir, key, new)
+                new = new.set_index('row_hash')
+                cached = new if cached is None else pd.concat([cached, new])
+            if 'CLIENTNUM' in batch:
+                explained.insert(0, 'CLIENTNUM', batch['CLIENTNUM'].to_numpy())
+            table = pyarrow.Table.from_pandas(explained, preserve_index=False)
+            if writer is None:
+                writer = parquet.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            rows += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_s': rows / seconds if seconds else float('inf')}
+
+
+def main():
+    """
+    explain the customers of a file from the command line
+    """
+    parser = argparse.ArgumentParser(description="Explain churn scores with SHAP values")
+    parser.add_argument("input", type=str, help="Csv or parquet file of customers")
+    parser.add_argument("output", type=str, help="Parquet file of shap values")
+    parser.add_argument("--models", type=str, default="models",
+                        help="Folder of the saved models")
+    parser.add_argument("--background", type=str, default="data/bank_data.csv",
+                        help="Customers the background rows are sampled from")
+    parser.add_argument("--background-size", type=int, default=100,
+                        help="Number of background rows")
+    parser.add_argument("--batch-size", type=int, default=100_000,
+                        help="Number of rows read at a time")
+    parser.add_argument("--n-jobs", type=int, default=-1,
+                        help="Number of processes, -1 uses every cpu")
+    parser.add_argument("--cache-dir", type=str, default=os.path.join(cls.CACHE_DIR, 'shap'),
+                        help="Directory of the shap values cache")
+    args = parser.parse_args()
+
+    models = churn_scoring.load_models(args.models)
+    customers = next(churn_scoring.iter_batches(
+        args.background, churn_scoring.input_columns(models), batch_size=1_000_000))
+    background = sample_background(churn_scoring.encode_features(customers, models),
+                                   args.background_size)
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+    stats = explain_file(args.input, args.output, models, background, args.batch_size,
+                         n_jobs, args.cache_dir)
+    print(f"Explained {stats['rows']} rows in {stats['seconds']:.2f}s "
+          f"({stats['rows_per_s']:.1f} rows/s)")
+
+
+if __name__ == '__main__':
+    main()
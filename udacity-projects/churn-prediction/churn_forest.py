@@ -0,0 +1,109 @@
+"""
+Random forest exported to packed numpy node arrays, scored by a vectorized traversal
+of every tree at once without the sklearn input validation and per-tree dispatch
+File: churn_forest.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import numpy as np
+
+
+def export_forest(forest):
+    """
+    flatten the trees of a fitted random forest classifier into packed arrays. Leaves
+    point to themselves, so walking max_depth steps from the roots ends on the leaves
+
+    input:
+            forest: fitted RandomForestClassifier
+    output:
+            packed: dict with the node arrays 'feature', 'threshold', 'left', 'right',
+                    the normalized class probabilities of each node 'value', the 'roots'
+                    of the trees, the 'classes' and the 'max_depth' of the forest
+    """
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    offset, max_depth = 0, 0
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        nodes = np.arange(tree.node_count)
+        leaf = tree.children_left == -1
+        features.append(np.where(leaf, 0, tree.feature))
+        thresholds.append(np.where(leaf, 0.0, tree.threshold))
+        lefts.append(np.where(leaf, nodes, tree.children_left) + offset)
+        rights.append(np.where(leaf, nodes, tree.children_right) + offset)
+        # same normalization as DecisionTreeClassifier.predict_proba
+        value = tree.value[:, 0, :estimator.n_classes_].copy()
+        normalizer = value.sum(axis=1)[:, np.newaxis]
+        normalizer[normalizer == 0.0] = 1.0
+        values.append(value / normalizer)
+        roots.append(offset)
+        offset += tree.node_count
+        max_depth = max(max_depth, tree.max_depth)
+
+    return {'feature': np.concatenate(features).astype(np.intp),
+            'threshold': np.concatenate(thresholds).astype(np.float64),
+            'left': np.concatenate(lefts).astype(np.intp),
+            'right': np.concatenate(rights).astype(np.intp),
+            'value': np.concatenate(values),
+            'roots': np.array(roots, dtype=np.intp),
+            'classes': forest.classes_,
+            'max_depth': max_depth}
+
+
+def apply(packed, X):
+    """
+    returns the leaf reached by each row in each tree
+
+    input:
+            packed: dict returned by export_forest
+            X: 2d array of features
+    output:
+            leaves: array of shape (n_rows, n_trees) of packed node positions
+    """
+    X = np.asarray(X, dtype=np.float32)
+    nodes = np.broadcast_to(packed['roots'], (len(X), len(packed['roots'])))
+    rows = np.arange(len(X))[:, np.newaxis]
+    for _ in range(packed['max_depth']):
+        # float32 features compared to float64 thresholds, as in sklearn
+        go_left = X[rows, packed['feature'][nodes]] <= packed['threshold'][nodes]
+        nodes = np.where(go_left, packed['left'][nodes], packed['right'][nodes])
+    return nodes
+
+
+def predict_proba(packed, X, chunk_size=4096):
+    """
+    returns the class probabilities of the forest, equal bit for bit to
+    RandomForestClassifier.predict_proba: the tree probabilities are added in the
+    order of the trees before dividing by the number of trees
+
+    input:
+            packed: dict returned by export_forest
+            X: 2d array of features
+            chunk_size: number of rows traversed at a time, bounding the memory used
+    output:
+            proba: array of shape (n_rows, n_classes)
+    """
+    X = np.asarray(X, dtype=np.float32)
+    if X.ndim == 1:
+        X = X[np.newaxis, :]
+    n_trees = len(packed['roots'])
+    proba = np.empty((len(X), packed['value'].shape[1]))
+    for start in range(0, len(X), chunk_size):
+        leaves = apply(packed, X[start:start + chunk_size])
+        # cumsum adds the trees sequentially, like the forest accumulating the trees
+        proba[start:start + chunk_size] = np.cumsum(packed['value'][leaves], axis=1)[:, -1]
+    proba /= n_trees
+    return proba
+
+
+def predict(packed, X):
+    """
+    returns the predicted class of each row, as RandomForestClassifier.predict
+
+    input:
+            packed: dict returned by export_forest
+            X: 2d array of features
+    output:
+            predictions: array of classes
+    """
+    return packed['classes'].take(np.argmax(predict_proba(packed, X), axis=1), axis=0)
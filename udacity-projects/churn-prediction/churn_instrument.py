@@ -0,0 +1,177 @@
+"""
+Wall time, cpu time, peak memory and row counts of the pipeline stages, logged as
+json lines, with an optional cProfile dump per stage
+File: churn_instrument.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import contextlib
+import cProfile
+import functools
+import inspect
+import json
+import logging
+import os
+import resource
+import time
+
+
+logger = logging.getLogger(__name__)
+
+# when this environment variable names a folder, every outermost stage dumps its
+# cProfile statistics there as <stage>-<pid>.prof
+PROFILE_DIR_ENV = 'CHURN_PROFILE_DIR'
+
+# peak memory of the stages running in this process, innermost last
+_ACTIVE = []
+
+
+def _read_status_mb(field):
+    """
+    returns a memory field of /proc/self/status in MB, or None when it is not available
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except (FileNotFoundError, PermissionError):
+        pass
+    return None
+
+
+def _peak_rss_mb():
+    """
+    returns the peak resident memory of this process in MB, since the last reset
+    when the kernel supports resetting it
+    """
+    peak = _read_status_mb('VmHWM')
+    if peak is None:
+        # ru_maxrss is in KB on linux, in bytes on macos
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return peak
+
+
+def _reset_peak_rss():
+    """
+    reset the peak resident memory of this process (linux >= 4.0), so the peak of a
+    stage is not hidden by an earlier, larger one
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except OSError:
+        pass
+
+
+def _children_cpu_s():
+    """
+    returns the cpu time of the terminated child processes, e.g. process pool workers
+    """
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _count_rows(value):
+    """
+    returns the number of rows of a dataframe, series or array, None for other values
+    """
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """
+    measure the block as a pipeline stage and log one json line when it ends, with the
+    wall time, the cpu time of this process and of the child processes that ended
+    during the stage, the peak resident memory and the number of rows
+
+    input:
+            name: name of the stage
+            rows: number of rows processed, can also be set later on the yielded record
+    output:
+            record: dict logged when the block ends
+    """
+    record = {'stage': name, 'rows': rows, 'pid': os.getpid()}
+    for parent in _ACTIVE:
+        parent['peak'] = max(parent['peak'], _peak_rss_mb())
+    _reset_peak_rss()
+    _ACTIVE.append({'peak': _peak_rss_mb()})
+
+    profile_dir = os.environ.get(PROFILE_DIR_ENV)
+    profiler = cProfile.Profile() if profile_dir and len(_ACTIVE) == 1 else None
+    wall, cpu, children_cpu = time.perf_counter(), time.process_time(), _children_cpu_s()
+    if profiler:
+        profiler.enable()
+    status = 'ok'
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        active = _ACTIVE.pop()
+        peak = max(active['peak'], _peak_rss_mb())
+        if _ACTIVE:
+            _ACTIVE[-1]['peak'] = max(_ACTIVE[-1]['peak'], peak)
+        record.update({'status': status,
+                       'wall_s': round(time.perf_counter() - wall, 6),
+                       'cpu_s': round(time.process_time() - cpu, 6),
+                       'children_cpu_s': round(_children_cpu_s() - children_cpu, 6),
+                       'peak_rss_mb': round(peak, 1)})
+        if profiler:
+            os.makedirs(profile_dir, exist_ok=True)
+            profile_pth = os.path.join(profile_dir, '%s-%d.prof' % (name, os.getpid()))
+            profiler.dump_stats(profile_pth)
+            record['profile'] = profile_pth
+        logger.info(json.dumps(record))
+
+
+def instrument(name=None, rows=None):
+    """
+    decorator measuring every call of a function as a stage (see stage)
+
+    input:
+            name: name of the stage, defaults to the name of the function
+            rows: name of the argument whose length is the number of rows, None counts
+                  the rows of the returned value when it is a dataframe or an array
+    output:
+            decorator
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name or func.__name__) as record:
+                if rows is not None:
+                    bound = signature.bind_partial(*args, **kwargs)
+                    record['rows'] = _count_rows(bound.arguments.get(rows))
+                result = func(*args, **kwargs)
+                if rows is None:
+                    record['rows'] = _count_rows(result)
+                return result
+        return wrapper
+    return decorator
+
+
+def read_records(log_pth):
+    """
+    returns the stage records found in a log file, ignoring the other lines
+
+    input:
+            log_pth: path of the log file
+    output:
+            records: list of dicts
+    """
+    records = []
+    with open(log_pth) as log:
+        for line in log:
+            start = line.find('{"stage"')
+            if start >= 0:
+                records.append(json.loads(line[start:]))
+    return records
@@ -6,73 +6,464 @@ Date: May 31 2022
 """
 
 # import libraries
+import json
+import logging
 import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from sklearn.model_selection import train_test_split
 
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import GridSearchCV
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.model_selection import HalvingGridSearchCV
 
-from sklearn.metrics import roc_curve, classification_report
 
-import shap
 import joblib
 import pandas as pd
+import sklearn
 import numpy as np
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
 
+import churn_cache
+import churn_forest
+import churn_instrument
+import churn_metrics
+import churn_search
+import churn_stats
+
 sns.set()
 
 
 os.environ['QT_QPA_PLATFORM'] = 'offscreen'
 
+BANK_DATA_SCHEMA = {
+    'Unnamed: 0': 'int32',
+    'CLIENTNUM': 'int64',
+    'Attrition_Flag': 'category',
+    'Customer_Age': 'int8',
+    'Gender': 'category',
+    'Dependent_count': 'int8',
+    'Education_Level': 'category',
+    'Marital_Status': 'category',
+    'Income_Category': 'category',
+    'Card_Category': 'category',
+    'Months_on_book': 'int8',
+    'Total_Relationship_Count': 'int8',
+    'Months_Inactive_12_mon': 'int8',
+    'Contacts_Count_12_mon': 'int8',
+    'Credit_Limit': 'float32',
+    'Total_Revolving_Bal': 'int16',
+    'Avg_Open_To_Buy': 'float32',
+    'Total_Amt_Chng_Q4_Q1': 'float32',
+    'Total_Trans_Amt': 'int32',
+    'Total_Trans_Ct': 'int16',
+    'Total_Ct_Chng_Q4_Q1': 'float32',
+    'Avg_Utilization_Ratio': 'float32'
+}
+
+CACHE_DIR = 'data/.cache'
+
+RF_PARAM_GRID = {
+    'n_estimators': [200, 500],
+    'max_features': ['auto', 'sqrt'],
+    'max_depth': [4, 5, 100],
+    'criterion': ['gini', 'entropy']
+}
+
+# joblib compression of each model persistence layout: 'mmap' stores the numpy arrays
+# uncompressed so joblib.load(mmap_mode='r') shares them between processes,
+# 'compressed' trades load time for smaller archives
+MODEL_PERSISTENCE = {'mmap': 0, 'compressed': ('zlib', 3)}
+
+MODEL_MANIFEST = 'manifest.json'
+
+# size in inches of the eda figures
+FIGSIZE = (20, 10)
+
+KEEP_COLS = ['Customer_Age', 'Dependent_count', 'Months_on_book',
+             'Total_Relationship_Count', 'Months_Inactive_12_mon',
+             'Contacts_Count_12_mon', 'Credit_Limit', 'Total_Revolving_Bal',
+             'Avg_Open_To_Buy', 'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt',
+             'Total_Trans_Ct', 'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio',
+             'Gender_Churn', 'Education_Level_Churn', 'Marital_Status_Churn',
+             'Income_Category_Churn', 'Card_Category_Churn'
+             ]
+
+
+def _add_churn(data):
+    """
+    derive the churn response from Attrition_Flag
+    """
+    data['Churn'] = (data['Attrition_Flag'] != "Existing Customer").astype('int8')
+    return data
+
+
+def _iter_chunks(file_path, schema, chunksize):
+    """
+    yield typed chunks of the csv with the churn response
+    """
+    with pd.read_csv(file_path, dtype=schema, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield _add_churn(chunk)
+
+
+def _concat_chunks(chunks):
+    """
+    concatenate chunks keeping categorical columns categorical, even when the chunks
+    did not see the same levels
+    """
+    chunks = list(chunks)
+    if len(chunks) == 1:
+        return chunks[0]
+    data = pd.concat(chunks, ignore_index=True)
+    for column, dtype in chunks[0].dtypes.items():
+        if isinstance(dtype, pd.CategoricalDtype):
+            data[column] = pd.api.types.union_categoricals(
+                [chunk[column] for chunk in chunks])
+    return data
+
 
-def import_data(file_path):
+@churn_instrument.instrument()
+def import_data(file_path, schema=None, chunksize=None, iterator=False, cache_dir=None):
     """
     returns dataframe for the csv found at pth
 
     input:
             pth: a path to the csv
+            schema: dict column -> dtype, defaults to BANK_DATA_SCHEMA
+            chunksize: number of rows parsed at a time, None reads the file at once
+            iterator: if True return an iterator of chunks of chunksize rows
+            cache_dir: if set, keep a typed columnar copy of the csv in this directory and
+                       read it instead of the csv while the csv content is unchanged
     output:
-            df: pandas dataframe
+            df: pandas dataframe, or iterator of dataframes when iterator is True
     """
-    data = pd.read_csv(file_path)
+    schema = BANK_DATA_SCHEMA if schema is None else schema
+    if iterator:
+        return _iter_chunks(file_path, schema, chunksize or 100_000)
+    if cache_dir:
+        return churn_cache.load_cached(
+            file_path, cache_dir,
+            lambda: import_data(file_path, schema, chunksize),
+            variant=repr(sorted(schema.items())))
+    if chunksize:
+        return _concat_chunks(_iter_chunks(file_path, schema, chunksize))
+
+    data = pd.read_csv(file_path, dtype=schema)
     # Create churn variable
-    data['Churn'] = data['Attrition_Flag'].apply(lambda val: 0 if val == "Existing Customer" else 1)
+    return _add_churn(data)
 
-    return data
+
+def _plot_histogram(ax, serie):
+    """
+    histogram of a column, drawn like pandas Series.hist
+    """
+    ax.hist(serie.dropna(), bins=10)
+    ax.grid(True)
+
+
+def _plot_proportions(ax, serie):
+    """
+    bar plot of the normalized counts of each level
+    """
+    serie.value_counts('normalize').plot(kind='bar', ax=ax)
+
+
+def _plot_density(ax, serie):
+    """
+    density histogram with a kde curve
+    """
+    sns.histplot(serie, stat='density', kde=True, ax=ax)
+
+
+def _plot_correlation(ax, dataframe):
+    """
+    heatmap of the correlation between the numeric columns
+    """
+    sns.heatmap(dataframe.corr(), annot=False, cmap="Dark2_r", linewidths=2, ax=ax)
+
+
+# figure name -> (column plotted or None for all numeric columns, plotting function)
+EDA_PLOTS = {
+    'Churn': ('Churn', _plot_histogram),
+    'Customer_Age': ('Customer_Age', _plot_histogram),
+    'Marital_Status': ('Marital_Status', _plot_proportions),
+    'Total_Trans_Ct': ('Total_Trans_Ct', _plot_density),
+    'correlation': (None, _plot_correlation)
+}
+
+
+@churn_instrument.instrument(rows='data')
+def render_figure(plot_func, data, output_pth, figsize=FIGSIZE):
+    """
+    draw a figure with the object oriented matplotlib api, so no pyplot state is shared
+    and figures can be rendered from several processes at the same time
+    input:
+              plot_func: function drawing on a matplotlib axes, e.g. a value of EDA_PLOTS
+              data: dataframe or series passed to plot_func
+              output_pth: path of the saved image
+              figsize: size of the figure in inches
+    output:
+              output_pth: path of the saved image
+    """
+    fig = Figure(figsize=figsize)
+    plot_func(fig.subplots(), data)
+    fig.savefig(output_pth)
+    return output_pth
+
+
+def worker_count(n_jobs, n_tasks):
+    """
+    returns the number of worker processes for n_tasks
+    input:
+              n_jobs: requested number of processes, -1 uses every cpu, None or 1 none
+              n_tasks: number of tasks to share between the processes
+    output:
+              n_workers: number of processes, 1 to run the tasks in the current process
+    """
+    if n_jobs is None or n_jobs == 1 or n_tasks < 2:
+        return 1
+    if n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    return min(n_jobs, n_tasks)
+
+
+def _update_histogram(state, serie, rng, sample_size):
+    """
+    accumulate the exact counts of an integer column
+    """
+    return churn_stats.update_bincount(state, serie.to_numpy())
+
+
+def _update_proportions(state, serie, rng, sample_size):
+    """
+    accumulate the counts of each level
+    """
+    return churn_stats.update_value_counts(state, serie)
+
+
+def _update_density(state, serie, rng, sample_size):
+    """
+    accumulate the exact counts of an integer column and a reservoir sample for its kde
+    """
+    state = state or {'counts': None, 'reservoir': None}
+    return {'counts': churn_stats.update_bincount(state['counts'], serie.to_numpy()),
+            'reservoir': churn_stats.update_reservoir(state['reservoir'], serie.to_numpy(),
+                                                      sample_size, rng)}
+
+
+def _update_correlation(state, dataframe, rng, sample_size):
+    """
+    accumulate the sufficient statistics of the correlation matrix
+    """
+    return churn_stats.update_moments(state, dataframe)
+
+
+def _plot_binned_histogram(ax, state):
+    """
+    histogram of a column from its exact counts
+    """
+    hist, edges = churn_stats.histogram_from_bincount(state, bins=10)
+    ax.hist(edges[:-1], bins=edges, weights=hist)
+    ax.grid(True)
+    ax.set_title('exact counts of %d rows' % state['counts'].sum())
+
+
+def _plot_counted_proportions(ax, counts):
+    """
+    bar plot of the normalized counts of each level
+    """
+    (counts / counts.sum()).sort_values(ascending=False).plot(kind='bar', ax=ax)
+    ax.set_title('exact counts of %d rows' % counts.sum())
+
+
+def _plot_sampled_density(ax, state):
+    """
+    density histogram from the exact counts with a kde fitted on the reservoir sample
+    """
+    counts = state['counts']
+    hist, edges = churn_stats.histogram_from_bincount(
+        counts, bins=min(len(counts['counts']), 50), density=True)
+    ax.hist(edges[:-1], bins=edges, weights=hist, alpha=0.5)
+    sample = state['reservoir']['sample']
+    sns.kdeplot(sample, ax=ax)
+    ax.set_title('histogram: exact counts of %d rows, kde: sample of %d rows, '
+                 'cdf error <= %.4f with 95%% confidence (DKW)'
+                 % (state['reservoir']['seen'], len(sample),
+                    churn_stats.dkw_bound(len(sample))))
+
+
+def _plot_streamed_correlation(ax, state):
+    """
+    heatmap of the correlation matrix computed from streamed sufficient statistics
+    """
+    sns.heatmap(churn_stats.correlation_from_moments(state), annot=False, cmap="Dark2_r",
+                linewidths=2, ax=ax)
+    ax.set_title('exact correlation streamed over %d rows' % state['n'])
+
+
+# figure name -> (column summarized or None for all numeric columns,
+#                 function accumulating a chunk into the summary, plotting function)
+APPROX_EDA_PLOTS = {
+    'Churn': ('Churn', _update_histogram, _plot_binned_histogram),
+    'Customer_Age': ('Customer_Age', _update_histogram, _plot_binned_histogram),
+    'Marital_Status': ('Marital_Status', _update_proportions, _plot_counted_proportions),
+    'Total_Trans_Ct': ('Total_Trans_Ct', _update_density, _plot_sampled_density),
+    'correlation': (None, _update_correlation, _plot_streamed_correlation)
+}
+
+
+def summarize_eda(chunks, sample_size=100_000, random_state=42):
+    """
+    accumulate, chunk by chunk, the statistics needed by the approximate eda figures
+
+    input:
+            chunks: iterable of pandas dataframes
+            sample_size: size of the reservoir samples used for kde
+            random_state: seed of the reservoir sampling
+
+    output:
+            summary: dict figure name -> accumulated statistics
+    """
+    rng = np.random.default_rng(random_state)
+    summary = {}
+    for chunk in chunks:
+        for name, (column, update_func, _) in APPROX_EDA_PLOTS.items():
+            data = chunk.select_dtypes('number') if column is None else chunk[column]
+            summary[name] = update_func(summary.get(name), data, rng, sample_size)
+    return summary
 
 
-def perform_eda(dataframe):
+def _iter_frame(dataframe, chunksize):
+    """
+    yield consecutive row slices of a dataframe
+    """
+    for start in range(0, len(dataframe), chunksize):
+        yield dataframe.iloc[start:start + chunksize]
+
+
+@churn_instrument.instrument(rows='dataframe')
+def perform_eda(dataframe, output_dir='images/eda', n_jobs=1, incremental=False,
+                approximate=False, sample_size=100_000, chunksize=1_000_000):
     """
     perform eda on df and save figures to images folder
     input:
-            df: pandas dataframe
+            df: pandas dataframe, or an iterable of dataframe chunks when approximate
+            output_dir: folder of the figures
+            n_jobs: number of processes rendering figures, -1 uses every cpu
+            incremental: if True skip the figures whose data did not change since they
+                         were last rendered
+            approximate: if True plot from statistics accumulated chunk by chunk: exact
+                         binned counts, streamed correlation and kde on a reservoir sample
+            sample_size: size of the kde sample in approximate mode
+            chunksize: rows per chunk when df is a dataframe in approximate mode
 
     output:
             None
     """
-    columns = ['Churn', 'Customer_Age', 'Marital_Status', 'Total_Trans_Ct', 'correlation']
-    for col in columns:
-        # making plot
-        plt.figure(figsize=(20, 10))
+    if approximate:
+        chunks = _iter_frame(dataframe, chunksize) \
+            if isinstance(dataframe, pd.DataFrame) else dataframe
+        summary = summarize_eda(chunks, sample_size=sample_size)
+        plots = {name: (summary[name], plot_func)
+                 for name, (_, _, plot_func) in APPROX_EDA_PLOTS.items()}
+    else:
+        plots = {name: (dataframe.select_dtypes('number') if column is None
+                        else dataframe[column], plot_func)
+                 for name, (column, plot_func) in EDA_PLOTS.items()}
 
-        if col == 'Churn':
-            dataframe[col].hist()
-        elif col == "Customer_Age":
-            dataframe[col].hist()
-        elif col == 'Marital_Status':
-            dataframe[col].value_counts('normalize').plot(kind='bar')
-        elif col == 'Total_Trans_Ct':
-            sns.histplot(dataframe['Total_Trans_Ct'], stat='density', kde=True)
-        elif col == 'correlation':
-            sns.heatmap(dataframe.corr(), annot=False, cmap="Dark2_r", linewidths=2)
-        # saving figures
-        plt.savefig('images/eda/%s.jpg' % col)
-        plt.close()
+    manifest = churn_cache.load_manifest(output_dir) if incremental else {}
+    tasks, digests = [], {}
+    for name, (data, plot_func) in plots.items():
+        output_pth = os.path.join(output_dir, '%s.jpg' % name)
+        if incremental:
+            # the render function and its figure size are part of the figure
+            digest = churn_cache.fingerprint(plot_func, data, render_figure, FIGSIZE)
+            if churn_cache.is_up_to_date(manifest, output_pth, digest):
+                continue
+            digests[os.path.basename(output_pth)] = digest
+        tasks.append((plot_func, data, output_pth))
+
+    n_workers = worker_count(n_jobs, len(tasks))
+    if n_workers == 1:
+        for task in tasks:
+            render_figure(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            # the slowest figure (correlation) is submitted first
+            futures = [executor.submit(render_figure, *task) for task in reversed(tasks)]
+            for future in futures:
+                future.result()
+
+    if digests:
+        manifest.update(digests)
+        churn_cache.save_manifest(output_dir, manifest)
+
+
+def fit_encoder(df, category_lst, response='Churn', smoothing=0.0):
+    """
+    learn the churn statistics of each categorical column in a single vectorized
+    groupby per column, so they can be applied later to unseen data
+
+    input:
+            df: pandas dataframe
+            category_lst: list of columns that contain categorical features
+            response: name of the response column
+            smoothing: weight of the global churn rate in the encoded means (0 = plain means)
+
+    output:
+            encoder: dict with the response name, the global response mean (prior), the
+                     smoothing and, for each category, a dataframe indexed by level with
+                     the response 'sum' and row 'count'
+    """
+    target = df[response]
+    tables = {}
+    for category in category_lst:
+        tables[category] = target.groupby(df[category], observed=True).agg(['sum', 'count'])
+    return {'response': response,
+            'prior': float(target.mean()),
+            'smoothing': float(smoothing),
+            'tables': tables}
+
+
+def _lookup_levels(serie, values, default):
+    """
+    map every value of serie to values (indexed by level) with a vectorized take,
+    levels that were never seen get the default value
+    """
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        table = values.reindex(serie.cat.categories).to_numpy(dtype=np.float64)
+        codes = serie.cat.codes.to_numpy()
+        mapped = np.where(codes >= 0, table[codes], np.nan)
+    else:
+        mapped = serie.map(values).to_numpy(dtype=np.float64)
+    return np.where(np.isnan(mapped), default, mapped)
 
 
+def transform_encoder(df, encoder):
+    """
+    add a <category>_<response> column with the learned response mean of each level
+
+    input:
+            df: pandas dataframe
+            encoder: dict returned by fit_encoder
+
+    output:
+            df: pandas dataframe with new columns for each encoded category
+    """
+    response = encoder['response']
+    prior, smoothing = encoder['prior'], encoder.get('smoothing', 0.0)
+    for category, table in encoder['tables'].items():
+        means = (table['sum'] + smoothing * prior) / (table['count'] + smoothing)
+        df[f'{category}_{response}'] = _lookup_levels(df[category], means, encoder['prior'])
+    return df
+
+
+@churn_instrument.instrument(rows='df')
 def encoder_helper(df, category_lst):
     """
     helper function to turn each categorical column into a new column with
@@ -85,58 +476,275 @@ def encoder_helper(df, category_lst):
     output:
             df: pandas dataframe with new columns for
     """
+    return transform_encoder(df, fit_encoder(df, category_lst))
+
+
+def encode_out_of_fold(df, category_lst, response='Churn', n_folds=5, smoothing=0.0,
+                       random_state=42):
+    """
+    add a <category>_<response> column where each row is encoded with the statistics of
+    the other folds only, so the encoding of a row never uses its own response.
+    The sums and counts of every (level, fold) pair are computed in one bincount per
+    category, memory is O(levels x folds) and the frame is never copied per fold
+
+    input:
+            df: pandas dataframe
+            category_lst: list of columns that contain categorical features
+            response: name of the response column
+            n_folds: number of folds
+            smoothing: weight of the global churn rate in the encoded means (0 = plain means)
+            random_state: seed of the fold assignment
+
+    output:
+            df: pandas dataframe with new columns for each encoded category
+    """
+    target = df[response].to_numpy(dtype=np.float64)
+    prior = target.mean()
+    folds = np.random.RandomState(random_state).permutation(len(df)) % n_folds
+
     for category in category_lst:
-        category_serie = []
-        category_groups = df.groupby(category).mean()['Churn']
-        # fill values
-        for row in df[category]:
-            category_serie.append(category_groups.loc[row])
-        df[f'{category}_Churn'] = category_serie
+        codes, levels = pd.factorize(df[category])
+        n_cells = len(levels) * n_folds
+        known = codes >= 0
+        cells = codes[known] * n_folds + folds[known]
+        sums = np.bincount(cells, weights=target[known], minlength=n_cells).reshape(-1, n_folds)
+        counts = np.bincount(cells, minlength=n_cells).reshape(-1, n_folds)
+
+        level, fold = codes[known], folds[known]
+        oof_sums = sums.sum(axis=1)[level] - sums[level, fold]
+        oof_counts = counts.sum(axis=1)[level] - counts[level, fold] + smoothing
+        values = np.full(len(level), prior)
+        np.divide(oof_sums + smoothing * prior, oof_counts, out=values, where=oof_counts > 0)
+        encoded = np.full(len(df), prior)
+        encoded[known] = values
+        df[f'{category}_{response}'] = encoded
     return df
 
 
-def perform_feature_engineering(df, category_lst):
+@churn_instrument.instrument(rows='df')
+def perform_feature_engineering(df, category_lst, encoding='oof', n_folds=5, smoothing=0.0,
+                                return_encoder=False):
     """
+    split the data and target encode the categorical columns with statistics learned on
+    the training rows only
+
     input:
               df: pandas dataframe
               category_lst: list of columns that contain categorical features
+              encoding: 'oof' to encode training rows out of fold, 'train' to encode them
+                        with the statistics of the whole training set
+              n_folds: number of folds of the out of fold encoding
+              smoothing: weight of the global churn rate in the encoded means
+              return_encoder: if True also return the encoder fitted on the training rows,
+                              the one to apply to new data at inference time
 
     output:
               X_train: X training data
               X_test: X testing data
               y_train: y training data
               y_test: y testing data
+              encoder: dict returned by fit_encoder, only if return_encoder is True
     """
-    # apply encoder_helper
-    df_encoded = encoder_helper(df, category_lst)
+    if encoding not in ('oof', 'train'):
+        raise ValueError("encoding must be 'oof' or 'train', got %r" % encoding)
 
-    keep_cols = ['Customer_Age', 'Dependent_count', 'Months_on_book',
-                 'Total_Relationship_Count', 'Months_Inactive_12_mon',
-                 'Contacts_Count_12_mon', 'Credit_Limit', 'Total_Revolving_Bal',
-                 'Avg_Open_To_Buy', 'Total_Amt_Chng_Q4_Q1', 'Total_Trans_Amt',
-                 'Total_Trans_Ct', 'Total_Ct_Chng_Q4_Q1', 'Avg_Utilization_Ratio',
-                 'Gender_Churn', 'Education_Level_Churn', 'Marital_Status_Churn',
-                 'Income_Category_Churn', 'Card_Category_Churn'
-                 ]
+    # making split
+    train_pos, test_pos = train_test_split(np.arange(len(df)), test_size=0.3, random_state=42)
+    df_train = df.iloc[train_pos].copy()
+    df_test = df.iloc[test_pos].copy()
 
-    y_df = df_encoded['Churn']
-    x_df = df_encoded[keep_cols]
+    encoder = fit_encoder(df_train, category_lst, smoothing=smoothing)
+    if encoding == 'oof':
+        encode_out_of_fold(df_train, category_lst, n_folds=n_folds, smoothing=smoothing)
+    else:
+        transform_encoder(df_train, encoder)
+    transform_encoder(df_test, encoder)
 
-    # making split
-    X_train, X_test, y_train, y_test = train_test_split(x_df, y_df, test_size=0.3, random_state=42)
+    X_train, X_test = df_train[KEEP_COLS], df_test[KEEP_COLS]
+    y_train, y_test = df_train['Churn'], df_test['Churn']
+
+    if return_encoder:
+        return X_train, X_test, y_train, y_test, encoder
+    return X_train, X_test, y_train, y_test
+
+
+def hash_split(keys, test_size=0.3, n_folds=5):
+    """
+    assign rows to the test set and to a fold from a hash of their key, so a row always
+    lands in the same set whatever the order, the chunking or the size of the file
+
+    input:
+            keys: array of row keys, e.g. CLIENTNUM
+            test_size: expected proportion of test rows
+            n_folds: number of out of fold encoding folds
+    output:
+            is_test: boolean array, True for the test rows
+            folds: array of folds in [0, n_folds)
+    """
+    hashes = pd.util.hash_array(np.asarray(keys))
+    # the top 53 bits give a uniform number in [0, 1), the low bits pick the fold
+    is_test = (hashes >> np.uint64(11)).astype(np.float64) / 2.0 ** 53 < test_size
+    folds = (hashes % np.uint64(n_folds)).astype(np.int64)
+    return is_test, folds
+
+
+def _iter_columns(file_path, columns, chunksize, schema=None):
+    """
+    yield typed chunks of some columns of the csv with the churn response
+    """
+    schema = BANK_DATA_SCHEMA if schema is None else schema
+    usecols = list(dict.fromkeys(columns + ['Attrition_Flag']))
+    dtype = {column: schema[column] for column in usecols if column in schema}
+    with pd.read_csv(file_path, usecols=usecols, dtype=dtype, chunksize=chunksize) as reader:
+        for chunk in reader:
+            yield _add_churn(chunk)
+
+
+def _chunk_keys(chunk, key, start):
+    """
+    returns the split keys of a chunk: the key column, or the row numbers in the file
+    """
+    return chunk[key].to_numpy() if key else np.arange(start, start + len(chunk))
+
+
+def _merge_tables(table, other):
+    """
+    add the response sums and counts of two encoder tables, level by level
+    """
+    return other if table is None else table.add(other, fill_value=0)
+
+
+def _fold_out_encoder(encoder, fold_tables, fold):
+    """
+    returns the encoder learned on the training rows of every fold but one
+    """
+    tables = {}
+    for category, table in encoder['tables'].items():
+        held_out = fold_tables[category][fold]
+        tables[category] = table.sub(held_out, fill_value=0) if held_out is not None else table
+    return {**encoder, 'tables': tables}
+
+
+def stream_feature_engineering(file_path, category_lst, output_dir, encoding='oof',
+                               n_folds=5, smoothing=0.0, test_size=0.3, key='CLIENTNUM',
+                               chunksize=100_000, return_encoder=False):
+    """
+    out of core perform_feature_engineering: the csv is read twice, chunk by chunk. The
+    first pass counts the rows of each set and accumulates the encoder statistics of the
+    training rows (per fold for the out of fold encoding), the second pass encodes each
+    chunk and writes its KEEP_COLS features straight into preallocated float32 .npy files.
+    Rows are split with hash_split instead of an in-memory shuffle, so memory stays
+    bounded by chunksize whatever the size of the file
+
+    input:
+              file_path: path to the csv
+              category_lst: list of columns that contain categorical features
+              output_dir: folder of the X_train, X_test, y_train and y_test .npy files
+              encoding: 'oof' or 'train', see perform_feature_engineering
+              n_folds: number of folds of the out of fold encoding
+              smoothing: weight of the global churn rate in the encoded means
+              test_size: expected proportion of test rows
+              key: column hashed to split the rows, None hashes the row numbers
+              chunksize: number of rows read at a time
+              return_encoder: if True also return the encoder fitted on the training rows
+
+    output:
+              X_train: read-only memory-mapped float32 array, columns in KEEP_COLS order
+              X_test: idem for the test rows
+              y_train: read-only memory-mapped int8 array
+              y_test: idem for the test rows
+              encoder: dict returned by fit_encoder, only if return_encoder is True
+    """
+    if encoding not in ('oof', 'train'):
+        raise ValueError("encoding must be 'oof' or 'train', got %r" % encoding)
+    encoded_cols = [f'{category}_Churn' for category in category_lst]
+    numeric_cols = [column for column in KEEP_COLS if column not in encoded_cols]
+    key_cols = [key] if key else []
+
+    with churn_instrument.stage('stream_feature_engineering') as record:
+        # first pass: set sizes and encoder statistics of the training rows
+        n_rows, n_train, churn_sum = 0, 0, 0.0
+        tables = {category: None for category in category_lst}
+        fold_tables = {category: [None] * n_folds for category in category_lst}
+        for chunk in _iter_columns(file_path, key_cols + category_lst, chunksize):
+            is_test, folds = hash_split(_chunk_keys(chunk, key, n_rows), test_size, n_folds)
+            train = chunk[~is_test]
+            n_rows += len(chunk)
+            n_train += len(train)
+            churn_sum += float(train['Churn'].sum())
+            for category in category_lst:
+                # int64 sums, the int8 response would overflow once the chunks are added
+                stats = train['Churn'].astype(np.int64).groupby(
+                    [train[category], folds[~is_test]], observed=True).agg(['sum', 'count'])
+                for fold, fold_stats in stats.groupby(level=1):
+                    fold_stats = fold_stats.droplevel(1)
+                    fold_tables[category][fold] = _merge_tables(
+                        fold_tables[category][fold], fold_stats)
+                    tables[category] = _merge_tables(tables[category], fold_stats)
+        encoder = {'response': 'Churn',
+                   'prior': churn_sum / n_train if n_train else 0.0,
+                   'smoothing': float(smoothing),
+                   'tables': tables}
+        fold_encoders = [_fold_out_encoder(encoder, fold_tables, fold)
+                         for fold in range(n_folds)] if encoding == 'oof' else None
 
+        # second pass: encode each chunk into its rows of the preallocated matrices
+        os.makedirs(output_dir, exist_ok=True)
+        sizes = {'train': n_train, 'test': n_rows - n_train}
+        arrays = {}
+        for name, size in sizes.items():
+            arrays['X_' + name] = np.lib.format.open_memmap(
+                os.path.join(output_dir, 'X_%s.npy' % name), mode='w+', dtype=np.float32,
+                shape=(size, len(KEEP_COLS)))
+            arrays['y_' + name] = np.lib.format.open_memmap(
+                os.path.join(output_dir, 'y_%s.npy' % name), mode='w+', dtype=np.int8,
+                shape=(size,))
+        offsets = {'train': 0, 'test': 0}
+        start = 0
+        for chunk in _iter_columns(file_path, key_cols + numeric_cols + category_lst,
+                                   chunksize):
+            is_test, folds = hash_split(_chunk_keys(chunk, key, start), test_size, n_folds)
+            start += len(chunk)
+            for name, rows in (('train', ~is_test), ('test', is_test)):
+                part = chunk[rows]
+                if name == 'train' and fold_encoders:
+                    part = pd.concat([transform_encoder(part[folds[rows] == fold].copy(),
+                                                        fold_encoders[fold])
+                                      for fold in range(n_folds)]).loc[part.index]
+                else:
+                    part = transform_encoder(part.copy(), encoder)
+                end = offsets[name] + len(part)
+                arrays['X_' + name][offsets[name]:end] = part[KEEP_COLS].to_numpy(np.float32)
+                arrays['y_' + name][offsets[name]:end] = part['Churn'].to_numpy()
+                offsets[name] = end
+        for array in arrays.values():
+            array.flush()
+        record['rows'] = n_rows
+
+    del arrays
+    X_train, X_test, y_train, y_test = [
+        np.load(os.path.join(output_dir, '%s.npy' % name), mmap_mode='r')
+        for name in ('X_train', 'X_test', 'y_train', 'y_test')]
+    if return_encoder:
+        return X_train, X_test, y_train, y_test, encoder
     return X_train, X_test, y_train, y_test
 
 
+@churn_instrument.instrument(rows='y_train')
 def classification_report_image(y_train,
                                 y_test,
                                 y_train_preds_lr,
                                 y_train_preds_rf,
                                 y_test_preds_lr,
-                                y_test_preds_rf):
+                                y_test_preds_rf,
+                                incremental=False,
+                                y_test_proba_lr=None,
+                                y_test_proba_rf=None,
+                                output_dir="images/results"):
     """
     produces classification report for training and testing results and stores report as image
-    in images folder
+    in images folder. Each report and roc curve is computed from one pass of
+    churn_metrics over the responses and predictions
     input:
             y_train: training response values
             y_test:  test response values
@@ -144,48 +752,89 @@ def classification_report_image(y_train,
             y_train_preds_rf: training predictions from random forest
             y_test_preds_lr: test predictions from logistic regression
             y_test_preds_rf: test predictions from random forest
+            incremental: if True skip the reports whose responses and predictions did not
+                         change since they were last rendered
+            y_test_proba_lr: test churn probabilities from logistic regression, used for
+                             the roc curve instead of the predictions when given
+            y_test_proba_rf: test churn probabilities from random forest, idem
+            output_dir: folder of the report and roc curve images
 
     output:
              None
     """
+    manifest = churn_cache.load_manifest(output_dir) if incremental else {}
     report_data = {
         'Logistic_Regression': ('Train Data LR', y_train, y_train_preds_lr,
-                                'Test Data LR', y_test, y_test_preds_lr),
+                                'Test Data LR', y_test, y_test_preds_lr,
+                                y_test_preds_lr if y_test_proba_lr is None else y_test_proba_lr),
         'Random_Forest': ('Train Data RF', y_train, y_train_preds_rf,
-                          'Test Data RF', y_test, y_test_preds_rf)
+                          'Test Data RF', y_test, y_test_preds_rf,
+                          y_test_preds_rf if y_test_proba_rf is None else y_test_proba_rf)
     }
     for key, classification_data in report_data.items():
+        report_pth = "%s/%s.jpg" % (output_dir, key)
+        roc_pth = "%s/roc_curve_%s.jpg" % (output_dir, key)
+        if incremental:
+            digest = churn_cache.fingerprint(classification_report_image, *classification_data)
+            if (churn_cache.is_up_to_date(manifest, report_pth, digest)
+                    and churn_cache.is_up_to_date(manifest, roc_pth, digest)):
+                continue
+
+        train_report = churn_metrics.format_report(churn_metrics.classification_metrics(
+            churn_metrics.score_counts(classification_data[1], classification_data[2])))
+        test_report = churn_metrics.format_report(churn_metrics.classification_metrics(
+            churn_metrics.score_counts(classification_data[4], classification_data[5])))
         plt.rc('figure', figsize=(20, 10))
         plt.text(0.01, 1.25, str(classification_data[0]))
-        plt.text(0.01, 0.05, str(classification_report(classification_data[1], classification_data[2])))
+        plt.text(0.01, 0.05, train_report)
         plt.text(0.01, 0.6, str(classification_data[3]))
-        plt.text(0.01, 0.7, str(classification_report(classification_data[4], classification_data[5])))
+        plt.text(0.01, 0.7, test_report)
         plt.axis("off")
-        plt.savefig("images/results/%s.jpg" % key)
+        plt.savefig(report_pth)
         plt.close()
 
         # Plot the ROC curve
-        fpr, tpr, _ = roc_curve(classification_data[4], classification_data[5])
+        roc = churn_metrics.curves(churn_metrics.score_counts(classification_data[4],
+                                                              classification_data[6]))
         plt.figure(figsize=(20, 10))
-        plt.plot(fpr, tpr)
+        plt.plot(roc['fpr'], roc['tpr'], label='AUC = %.3f' % roc['roc_auc'])
         plt.ylabel('True Positive Rate')
         plt.xlabel('False Positive Rate')
-        plt.savefig("images/results/roc_curve_%s.jpg" % key)
+        plt.legend(loc='lower right')
+        plt.savefig(roc_pth)
         plt.close()
 
+        if incremental:
+            manifest[os.path.basename(report_pth)] = digest
+            manifest[os.path.basename(roc_pth)] = digest
+            churn_cache.save_manifest(output_dir, manifest)
 
-def feature_importance_plot(model, X_data, output_pth):
+
+@churn_instrument.instrument(rows='X_data')
+def feature_importance_plot(model, X_data, output_pth, incremental=False, image_dir='images'):
     """
     creates and stores the feature importances in pth
     input:
             model: model object containing feature_importances_
             X_data: pandas dataframe of X values
             output_pth: path to store the figure
+            incremental: if True skip the figure when the importances and feature names
+                         did not change since it was last rendered
+            image_dir: root folder of the images, output_pth is a folder inside it
 
     output:
              None
     """
     feature_importance = model.best_estimator_.feature_importances_
+    output_dir = os.path.join(image_dir, output_pth)
+    figure_pth = "%s/Feature_Importance.jpg" % output_dir
+    if incremental:
+        manifest = churn_cache.load_manifest(output_dir)
+        digest = churn_cache.fingerprint(feature_importance_plot, feature_importance,
+                                         list(X_data.columns))
+        if churn_cache.is_up_to_date(manifest, figure_pth, digest):
+            return
+
     indices = np.argsort(feature_importance)[::-1]
     names = [X_data.columns[i] for i in indices]
 
@@ -194,11 +843,181 @@ def feature_importance_plot(model, X_data, output_pth):
     plt.ylabel("Importance")
     plt.bar(range(X_data.shape[1]), feature_importance[indices])
     plt.xticks(range(X_data.shape[1]), names, rotation=90)
-    plt.savefig("images/%s/Feature_Importance.jpg" % output_pth)
+    plt.savefig(figure_pth)
     plt.close()
 
+    if incremental:
+        manifest[os.path.basename(figure_pth)] = digest
+        churn_cache.save_manifest(output_dir, manifest)
+
+
+def build_search(search='grid', n_jobs=None, param_grid=None, cv=5, cache_forests=False):
+    """
+    returns the hyperparameter search of the random forest
+    input:
+              search: 'grid' to cross validate every candidate on all the data, 'halving'
+                      for successive halving: every candidate is scored on a small sample
+                      and only the best third moves on to three times more samples,
+                      'warm_start' for the grid search results computed by growing one
+                      forest per fold through the n_estimators values
+              n_jobs: number of processes fitting candidates, -1 uses every cpu
+              param_grid: dict of parameters to search, defaults to RF_PARAM_GRID
+              cv: number of cross validation folds
+              cache_forests: 'warm_start' only, keep the fitted forests so fitting the
+                             same search object again (e.g. with a larger n_estimators
+                             value) grows them instead of starting over
+    output:
+              cv_rfc: unfitted search estimator
+    """
+    rf = RandomForestClassifier(random_state=42)
+    param_grid = RF_PARAM_GRID if param_grid is None else param_grid
+    if search == 'grid':
+        return GridSearchCV(estimator=rf, param_grid=param_grid, cv=cv, n_jobs=n_jobs)
+    if search == 'halving':
+        return HalvingGridSearchCV(estimator=rf, param_grid=param_grid, cv=cv, factor=3,
+                                   min_resources='exhaust', random_state=42, n_jobs=n_jobs)
+    if search == 'warm_start':
+        return churn_search.WarmStartForestSearch(rf, param_grid, cv=cv, n_jobs=n_jobs,
+                                                  cache_forests=cache_forests)
+    raise ValueError("search must be 'grid', 'halving' or 'warm_start', got %r" % search)
+
+
+def search_results_table(cv_rfc):
+    """
+    returns one row per evaluated candidate with its parameters, scores and fit time
+    input:
+              cv_rfc: fitted search estimator
+    output:
+              results: pandas dataframe sorted by rank
+    """
+    results = pd.DataFrame(cv_rfc.cv_results_)
+    columns = [column for column in results if column.startswith('param_')]
+    columns += [column for column in ('iter', 'n_resources') if column in results]
+    columns += ['mean_test_score', 'std_test_score', 'rank_test_score',
+                'mean_fit_time', 'std_fit_time', 'mean_score_time']
+    return results[columns].sort_values('rank_test_score')
+
+
+def save_model(model, output_pth, persistence='mmap'):
+    """
+    save a model with joblib in one of the MODEL_PERSISTENCE layouts
+    input:
+              model: object to save
+              output_pth: path of the file
+              persistence: 'mmap' or 'compressed'
+    output:
+              None
+    """
+    joblib.dump(model, output_pth, compress=MODEL_PERSISTENCE[persistence])
+
+
+def encoder_to_json(encoder):
+    """
+    returns the encoder as plain json types
+    input:
+              encoder: dict returned by fit_encoder
+    output:
+              content: dict with the levels, sums and counts of each category
+    """
+    return {'response': encoder['response'],
+            'prior': encoder['prior'],
+            'smoothing': encoder['smoothing'],
+            'tables': {category: {'levels': table.index.tolist(),
+                                  'sum': table['sum'].tolist(),
+                                  'count': table['count'].tolist()}
+                       for category, table in encoder['tables'].items()}}
+
+
+def encoder_from_json(content):
+    """
+    returns the encoder saved by encoder_to_json
+    input:
+              content: dict returned by encoder_to_json
+    output:
+              encoder: dict as returned by fit_encoder
+    """
+    tables = {category: pd.DataFrame({'sum': table['sum'], 'count': table['count']},
+                                     index=pd.Index(table['levels']))
+              for category, table in content['tables'].items()}
+    return dict(content, tables=tables)
+
+
+def save_model_manifest(output_pth, model_files, features, params, encoder=None,
+                        persistence='mmap'):
+    """
+    save what is needed to load and use the models without the training frame: the
+    model files and their layout, the feature order, the parameters of the models and
+    the encoder tables
+    input:
+              output_pth: path of the json manifest
+              model_files: dict name -> file name of the saved models
+              features: names of the features, in the order the models expect them
+              params: dict name -> parameters of each model
+              encoder: dict returned by fit_encoder, or None
+              persistence: layout of the saved models
+    output:
+              None
+    """
+    manifest = {'sklearn_version': sklearn.__version__,
+                'persistence': persistence,
+                'files': model_files,
+                'features': list(features),
+                'params': params,
+                'encoder': None if encoder is None else encoder_to_json(encoder)}
+    with open(output_pth, 'w') as file:
+        json.dump(manifest, file, indent=1, default=str)
+
+
+def _fit_model(model, X, y):
+    """
+    fit a model and return it, run in the worker processes of fit_models
+    """
+    return model.fit(X, y)
 
-def train_models(X_train, X_test, y_train, y_test):
+
+def fit_models(models, X, y, n_jobs=None, in_process=()):
+    """
+    fit several model families concurrently on the same features. The features are
+    converted once to a contiguous float32 array, memory-mapped and shared read-only by
+    every worker process instead of being copied into each model
+    input:
+              models: dict name -> unfitted estimator
+              X: features
+              y: response
+              n_jobs: number of model families fitted at the same time, -1 uses every cpu
+              in_process: names of the models fitted in the current process while the
+                          other families are fitted in the background. For the models
+                          with their own n_jobs, e.g. a search: inside a worker process
+                          joblib would run their jobs as threads
+    output:
+              fitted: dict name -> fitted estimator
+    """
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    y = np.ascontiguousarray(y)
+    n_workers = worker_count(n_jobs, len(models))
+    if n_workers == 1:
+        return {name: _fit_model(model, X, y) for name, model in models.items()}
+    if in_process:
+        others = {name: model for name, model in models.items() if name not in in_process}
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(fit_models, others, X, y, n_jobs)
+            fitted = {name: _fit_model(models[name], X, y) for name in in_process}
+            fitted.update(future.result())
+        return {name: fitted[name] for name in models}
+
+    with tempfile.TemporaryDirectory() as mmap_dir:
+        mmap_pth = os.path.join(mmap_dir, 'X.mmap')
+        joblib.dump(X, mmap_pth)
+        X_shared = joblib.load(mmap_pth, mmap_mode='r')
+        fitted = joblib.Parallel(n_jobs=n_workers)(
+            joblib.delayed(_fit_model)(model, X_shared, y) for model in models.values())
+    return dict(zip(models, fitted))
+
+
+@churn_instrument.instrument(rows='X_train')
+def train_models(X_train, X_test, y_train, y_test, incremental=False, search='grid',
+                 n_jobs=None, encoder=None, persistence='mmap', param_grid=None,
+                 model_dir='models', image_dir='images'):
     """
     train, store model results: images + scores, and store models
     input:
@@ -206,32 +1025,41 @@ def train_models(X_train, X_test, y_train, y_test):
               X_test: X testing data
               y_train: y training data
               y_test: y testing data
+              incremental: if True only re-render the result figures whose inputs changed
+              search: random forest search strategy, 'grid', 'halving' or 'warm_start'
+                      (see build_search)
+              n_jobs: number of processes of the random forest search, -1 uses every cpu.
+                      When not 1 the logistic regression is fitted in the background
+                      while the search runs its processes from this one
+              encoder: encoder fitted on the training rows, saved in the model manifest
+                       so new data can be scored. Without it the saved models can only
+                       score encoded features
+              persistence: 'mmap' to save the models uncompressed for memory-mapped
+                           loading, 'compressed' for smaller files (see MODEL_PERSISTENCE)
+              param_grid: random forest parameters to search, defaults to RF_PARAM_GRID
+              model_dir: folder of the saved models
+              image_dir: root folder of the images, the reports go to its results folder
     output:
               None
     """
-    rf = RandomForestClassifier(random_state=42)
-    lr = LogisticRegression(solver='lbfgs', max_iter=3000)
-
-    param_grid = {
-        'n_estimators': [200, 500],
-        'max_features': ['auto', 'sqrt'],
-        'max_depth': [4, 5, 100],
-        'criterion': ['gini', 'entropy']
-    }
-
-    # train random forest classifier
-    cv_rfc = GridSearchCV(estimator=rf, param_grid=param_grid, cv=5)
-    cv_rfc.fit(X_train, y_train)
-
-    # train logistic regression
-    lr.fit(X_train, y_train)
+    # train random forest classifier and logistic regression on a shared float32 matrix
+    models = fit_models({'rfc': build_search(search, n_jobs=n_jobs, param_grid=param_grid),
+                         'lr': LogisticRegression(solver='lbfgs', max_iter=3000)},
+                        X_train, y_train, n_jobs=n_jobs, in_process=['rfc'])
+    cv_rfc, lr = models['rfc'], models['lr']
+    search_results_table(cv_rfc).to_csv(os.path.join(model_dir, "search_results.csv"),
+                                        index=False)
 
     # make predictions
-    y_train_preds_rf = cv_rfc.best_estimator_.predict(X_train)
-    y_test_preds_rf = cv_rfc.best_estimator_.predict(X_test)
+    X_train_values = np.ascontiguousarray(X_train, dtype=np.float32)
+    X_test_values = np.ascontiguousarray(X_test, dtype=np.float32)
+    y_train_preds_rf = cv_rfc.best_estimator_.predict(X_train_values)
+    y_test_preds_rf = cv_rfc.best_estimator_.predict(X_test_values)
 
-    y_train_preds_lr = lr.predict(X_train)
-    y_test_preds_lr = lr.predict(X_test)
+    y_train_preds_lr = lr.predict(X_train_values)
+    y_test_preds_lr = lr.predict(X_test_values)
+    y_test_proba_rf = cv_rfc.best_estimator_.predict_proba(X_test_values)[:, 1]
+    y_test_proba_lr = lr.predict_proba(X_test_values)[:, 1]
 
     # make classification reports
     classification_report_image(y_train,
@@ -239,25 +1067,48 @@ def train_models(X_train, X_test, y_train, y_test):
                                  y_train_preds_lr,
                                  y_train_preds_rf,
                                  y_test_preds_lr,
-                                 y_test_preds_rf)
+                                 y_test_preds_rf,
+                                 incremental=incremental,
+                                 y_test_proba_lr=y_test_proba_lr,
+                                 y_test_proba_rf=y_test_proba_rf,
+                                 output_dir=os.path.join(image_dir, "results"))
     # make feature importance plots
-    feature_importance_plot(cv_rfc, X_test, "results")
+    feature_importance_plot(cv_rfc, X_test, "results", incremental=incremental,
+                            image_dir=image_dir)
 
-    # save the models
-    joblib.dump(cv_rfc.best_estimator_, "models/rfc_model.pkl")
-    joblib.dump(lr, "models/logistic_model.pkl")
+    # save the models, with the packed node arrays of the forest for the single row
+    # scoring fast path
+    model_files = {'rfc': 'rfc_model.pkl',
+                   'lr': 'logistic_model.pkl',
+                   'rfc_packed': 'rfc_packed.pkl'}
+    save_model(cv_rfc.best_estimator_, os.path.join(model_dir, model_files['rfc']), persistence)
+    save_model(lr, os.path.join(model_dir, model_files['lr']), persistence)
+    save_model(churn_forest.export_forest(cv_rfc.best_estimator_),
+               os.path.join(model_dir, model_files['rfc_packed']), persistence)
+    save_model_manifest(os.path.join(model_dir, MODEL_MANIFEST), model_files,
+                        getattr(X_train, 'columns', KEEP_COLS),
+                        {'rfc': cv_rfc.best_estimator_.get_params(),
+                         'rfc_search': cv_rfc.best_params_,
+                         'lr': lr.get_params()},
+                        encoder, persistence)
 
 
 if __name__ == '__main__':
-    data = import_data('data/bank_data.csv')
+    logging.basicConfig(
+        filename='./logs/churn_library.log',
+        level=logging.INFO,
+        format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
+    data = import_data('data/bank_data.csv', cache_dir=CACHE_DIR)
     print('Performing EDA')
-    perform_eda(data)
+    perform_eda(data, n_jobs=-1, incremental=True)
     category_list = ["Gender",
                      "Education_Level",
                      "Marital_Status",
                      "Income_Category",
                      "Card_Category"]
-    X_train_, X_test_, y_train_, y_test_ = perform_feature_engineering(data, category_list)
+    X_train_, X_test_, y_train_, y_test_, encoder_ = perform_feature_engineering(
+        data, category_list, return_encoder=True)
 
     print('Training models')
-    train_models(X_train_, X_test_, y_train_, y_test_)
+    train_models(X_train_, X_test_, y_train_, y_test_, incremental=True, search='halving',
+                 n_jobs=-1, encoder=encoder_)
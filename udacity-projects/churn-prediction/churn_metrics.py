@@ -0,0 +1,174 @@
+"""
+Binary classification metrics computed from the counts of positives and negatives at
+each distinct score, which can be accumulated chunk by chunk and merged
+File: churn_metrics.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import numpy as np
+
+
+def merge_score_counts(*states):
+    """
+    returns the counts of several states added together
+
+    input:
+            states: dicts returned by update_score_counts, None are skipped
+    output:
+            state: dict with the sorted distinct 'scores' and the number of 'positives'
+                   and 'negatives' having each score
+    """
+    states = [state for state in states if state is not None]
+    if len(states) == 1:
+        return states[0]
+    scores, inverse = np.unique(np.concatenate([state['scores'] for state in states]),
+                                return_inverse=True)
+    counts = {}
+    for name in ('positives', 'negatives'):
+        counts[name] = np.bincount(
+            inverse, weights=np.concatenate([state[name] for state in states]),
+            minlength=len(scores)).astype(np.int64)
+    return {'scores': scores, **counts}
+
+
+def update_score_counts(state, y_true, scores, n_bins=None):
+    """
+    add the positives and negatives of a chunk at each distinct score to state, in
+    one bincount over the sorted distinct scores
+
+    input:
+            state: dict returned by a previous call, or None
+            y_true: array of 0/1 responses
+            scores: array of probabilities of the positive class, or 0/1 predictions
+            n_bins: if set, round the scores down to a grid of n_bins steps over [0, 1]
+                    so the size of the state is bounded whatever the number of rows
+    output:
+            state: dict with the sorted distinct 'scores' and the number of 'positives'
+                   and 'negatives' having each score
+    """
+    y_true = np.asarray(y_true) == 1
+    scores = np.asarray(scores, dtype=np.float64)
+    if n_bins:
+        scores = np.floor(np.clip(scores, 0.0, 1.0) * n_bins) / n_bins
+    levels, inverse = np.unique(scores, return_inverse=True)
+    totals = np.bincount(inverse, minlength=len(levels))
+    positives = np.bincount(inverse, weights=y_true, minlength=len(levels)).astype(np.int64)
+    chunk = {'scores': levels, 'positives': positives, 'negatives': totals - positives}
+    return merge_score_counts(state, chunk)
+
+
+def score_counts(y_true, scores, chunksize=None, n_bins=None):
+    """
+    returns the score counts of the rows, accumulated by chunks of chunksize rows
+
+    input:
+            y_true: array of 0/1 responses
+            scores: array of probabilities or 0/1 predictions
+            chunksize: number of rows counted at a time, None counts them at once
+            n_bins: see update_score_counts
+    output:
+            state: dict returned by update_score_counts
+    """
+    y_true, scores = np.asarray(y_true), np.asarray(scores)
+    chunksize = chunksize or max(len(y_true), 1)
+    state = None
+    for start in range(0, len(y_true), chunksize):
+        state = update_score_counts(state, y_true[start:start + chunksize],
+                                    scores[start:start + chunksize], n_bins)
+    return state
+
+
+def classification_metrics(state, threshold=0.5):
+    """
+    returns the confusion matrix and the per class and averaged precision, recall
+    and f1-score when the rows scoring strictly above threshold are predicted positive
+    (the rule of predict for probabilities, and 0/1 predictions are kept as they are)
+
+    input:
+            state: dict returned by update_score_counts
+            threshold: decision threshold
+    output:
+            metrics: dict with the 'confusion_matrix' ([[tn, fp], [fn, tp]]), 'accuracy'
+                     and, for the classes 0 and 1 and the 'macro avg' and 'weighted avg',
+                     dicts of precision, recall, f1-score and support
+    """
+    predicted = state['scores'] > threshold
+    n_positives, n_negatives = int(state['positives'].sum()), int(state['negatives'].sum())
+    tp = int(state['positives'][predicted].sum())
+    fp = int(state['negatives'][predicted].sum())
+    fn, tn = n_positives - tp, n_negatives - fp
+
+    def scores(true, false_positives, false_negatives, support):
+        precision = true / (true + false_positives) if true + false_positives else 0.0
+        recall = true / (true + false_negatives) if true + false_negatives else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        return {'precision': precision, 'recall': recall, 'f1-score': f1, 'support': support}
+
+    metrics = {'confusion_matrix': np.array([[tn, fp], [fn, tp]]),
+               0: scores(tn, fn, fp, n_negatives),
+               1: scores(tp, fp, fn, n_positives)}
+    total = n_positives + n_negatives
+    metrics['accuracy'] = (tp + tn) / total if total else 0.0
+    for average, weights in [('macro avg', (0.5, 0.5)),
+                             ('weighted avg', (n_negatives / total, n_positives / total))]:
+        metrics[average] = {key: sum(weight * metrics[label][key]
+                                     for label, weight in zip((0, 1), weights))
+                            for key in ('precision', 'recall', 'f1-score')}
+        metrics[average]['support'] = total
+    return metrics
+
+
+def curves(state):
+    """
+    returns the roc and precision-recall curves over every distinct score, from one
+    cumulative sum of the counts sorted by decreasing score
+
+    input:
+            state: dict returned by update_score_counts
+    output:
+            curves: dict with the 'thresholds' (decreasing, the first one is inf), 'fpr',
+                    'tpr', 'precision' and 'recall' at each threshold (rows scoring at
+                    least the threshold are positive), 'roc_auc' and 'average_precision'
+    """
+    tp = np.r_[0, np.cumsum(state['positives'][::-1])]
+    fp = np.r_[0, np.cumsum(state['negatives'][::-1])]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tpr = tp / tp[-1]
+        fpr = fp / fp[-1]
+        precision = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+    return {'thresholds': np.r_[np.inf, state['scores'][::-1]],
+            'fpr': fpr,
+            'tpr': tpr,
+            'precision': precision,
+            'recall': tpr,
+            'roc_auc': float(np.trapz(tpr, fpr)),
+            'average_precision': float(np.sum(np.diff(tpr) * precision[1:]))}
+
+
+def format_report(metrics, digits=2):
+    """
+    returns the metrics as text, laid out like sklearn classification_report
+
+    input:
+            metrics: dict returned by classification_metrics
+            digits: number of digits of the scores
+    output:
+            report: string
+    """
+    headers = ["precision", "recall", "f1-score", "support"]
+    width = max(len("weighted avg"), digits)
+    report = ("{:>{width}s} " + " {:>9}" * len(headers)).format("", *headers, width=width)
+    report += "\n\n"
+    row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    for label in (0, 1):
+        report += row_fmt.format(str(label), *metrics[label].values(), width=width,
+                                 digits=digits)
+    report += "\n"
+    accuracy_fmt = "{:>{width}s} " + " {:>9.{digits}}" * 2 + " {:>9.{digits}f}" + " {:>9}\n"
+    report += accuracy_fmt.format("accuracy", "", "", metrics['accuracy'],
+                                  metrics['macro avg']['support'], width=width, digits=digits)
+    for average in ('macro avg', 'weighted avg'):
+        report += row_fmt.format(average, *metrics[average].values(), width=width,
+                                 digits=digits)
+    return report
@@ -0,0 +1,231 @@
+"""
+Incremental training of the linear churn model: each new batch of customers updates
+the saved model state instead of refitting the logistic regression on all the history
+File: churn_online.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import argparse
+import logging
+import os
+
+import joblib
+import numpy as np
+import sklearn
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import log_loss
+from sklearn.preprocessing import StandardScaler
+
+import churn_instrument
+import churn_library as cls
+import churn_scoring
+
+
+logger = logging.getLogger(__name__)
+
+# the logistic loss of SGDClassifier was renamed in scikit-learn 1.1
+SGD_LOSS = 'log_loss' if tuple(
+    int(part) for part in sklearn.__version__.split('.')[:2]) >= (1, 1) else 'log'
+
+ONLINE_METHODS = ('sgd', 'warm_start')
+
+
+def make_online_state(method='sgd', features=None, alpha=1e-4, max_iter=3000,
+                      random_state=42, memory_size=100_000):
+    """
+    returns the state of an untrained incremental model
+
+    input:
+            method: 'sgd' for averaged stochastic gradient descent updated with
+                    partial_fit, 'warm_start' for lbfgs started from the previous
+                    coefficients on each new batch plus a weighted sample of the
+                    previous ones
+            features: names of the feature columns, checked on each update
+            alpha: l2 penalty of the sgd model
+            max_iter: maximum number of lbfgs iterations per batch
+            random_state: seed of the sgd shuffling and of the sample of past rows
+            memory_size: number of past rows kept by 'warm_start', a uniform reservoir
+                         sample of all the rows seen
+    output:
+            state: dict with the 'method', the 'scaler' of the features fitted on the
+                   first batch, the 'model', the 'features', the number of rows seen,
+                   the 'history' of the updates and the 'memory' of past rows
+    """
+    if method == 'sgd':
+        model = SGDClassifier(loss=SGD_LOSS, alpha=alpha, average=True,
+                              random_state=random_state)
+    elif method == 'warm_start':
+        model = LogisticRegression(solver='lbfgs', max_iter=max_iter, warm_start=True)
+    else:
+        raise ValueError("method must be one of %s, got %r" % (ONLINE_METHODS, method))
+    return {'method': method,
+            'scaler': StandardScaler(),
+            'model': model,
+            'features': list(features) if features is not None else None,
+            'n_rows': 0,
+            'history': [],
+            'memory': {'X': None, 'y': None, 'size': memory_size,
+                       'rng': np.random.RandomState(random_state)}}
+
+
+def _coefficients(model):
+    """
+    returns the flattened coefficients and intercept of a fitted model, None before
+    the first update
+    """
+    if not hasattr(model, 'coef_'):
+        return None
+    return np.r_[np.ravel(model.coef_), np.ravel(model.intercept_)]
+
+
+def _remember(memory, X, y, n_seen):
+    """
+    add the rows of a batch to the reservoir sample of the n_seen rows before it, so
+    every row seen has the same chance to be in memory
+    """
+    if memory['X'] is None:
+        memory['X'], memory['y'] = X[:0].copy(), y[:0].copy()
+    n_free = max(memory['size'] - len(memory['X']), 0)
+    memory['X'] = np.concatenate([memory['X'], X[:n_free]])
+    memory['y'] = np.concatenate([memory['y'], y[:n_free]])
+    # row i of the rest replaces a random slot with probability size / (its rank + 1)
+    ranks = n_seen + n_free + np.arange(len(X) - n_free)
+    slots = np.floor(memory['rng'].random_sample(len(ranks)) * (ranks + 1)).astype(np.int64)
+    kept = slots < memory['size']
+    memory['X'][slots[kept]] = X[n_free:][kept]
+    memory['y'][slots[kept]] = y[n_free:][kept]
+
+
+def predict_proba(state, X):
+    """
+    returns the churn probability of each row
+
+    input:
+            state: dict returned by make_online_state, updated at least once
+            X: 2d array or dataframe of features
+    output:
+            proba: array of churn probabilities
+    """
+    X = state['scaler'].transform(np.asarray(X, dtype=np.float64))
+    return state['model'].predict_proba(X)[:, 1]
+
+
+def update_online_state(state, X, y, n_epochs=5, tol=1e-3):
+    """
+    update the model with a new batch of rows, and record the time and convergence of
+    the update in the history of the state
+
+    input:
+            state: dict returned by make_online_state
+            X: 2d array or dataframe of features
+            y: 0/1 churn responses
+            n_epochs: passes of sgd over the batch (ignored by 'warm_start')
+            tol: relative change of the sgd coefficients under which the update is
+                 reported as converged
+    output:
+            update: dict with the 'batch' number, 'rows', 'seconds', 'n_iter', the log
+                    loss of the batch before (None for the first batch) and after the
+                    update, the relative 'coef_change' and whether it 'converged'
+    """
+    columns = getattr(X, 'columns', None)
+    if state['features'] is not None and columns is not None and \
+            list(columns) != state['features']:
+        raise ValueError("features of the batch differ from the features of the model")
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y)
+    model, previous = state['model'], _coefficients(state['model'])
+    loss_before = log_loss(y, predict_proba(state, X), labels=[0, 1]) \
+        if previous is not None else None
+
+    with churn_instrument.stage('update_online_model', len(X)) as record:
+        if state['n_rows'] == 0:
+            # the scaling is fixed by the first batch: rescaling the next batches would
+            # move the features under the coefficients already learned
+            state['scaler'].fit(X)
+        X_scaled = state['scaler'].transform(X)
+        if state['method'] == 'sgd':
+            for _ in range(n_epochs):
+                model.partial_fit(X_scaled, y, classes=[0, 1])
+            n_iter = n_epochs
+        else:
+            # the past rows in memory stand for all the rows seen, so lbfgs minimizes
+            # the loss of the whole history instead of the loss of the last batch
+            memory = state['memory']
+            if memory['X'] is None or not len(memory['X']):
+                model.fit(X_scaled, y)
+            else:
+                weight = np.r_[np.full(len(memory['X']), state['n_rows'] / len(memory['X'])),
+                               np.ones(len(X_scaled))]
+                model.fit(np.concatenate([memory['X'], X_scaled]),
+                          np.concatenate([memory['y'], y]), sample_weight=weight)
+            _remember(memory, X_scaled, y, state['n_rows'])
+            n_iter = int(np.max(model.n_iter_))
+
+    current = _coefficients(model)
+    coef_change = float(np.linalg.norm(current - previous) /
+                        max(np.linalg.norm(previous), 1e-12)) if previous is not None else None
+    if state['method'] == 'sgd':
+        converged = coef_change is not None and coef_change < tol
+    else:
+        converged = n_iter < model.max_iter
+    state['n_rows'] += len(X)
+    update = {'batch': len(state['history']),
+              'rows': len(X),
+              'seconds': record['wall_s'],
+              'n_iter': n_iter,
+              'loss_before': loss_before,
+              'loss_after': log_loss(y, predict_proba(state, X), labels=[0, 1]),
+              'coef_change': coef_change,
+              'converged': bool(converged)}
+    state['history'].append(update)
+    logger.info("Online update %(batch)d: %(rows)d rows in %(seconds).3fs, "
+                "%(n_iter)d iterations", update)
+    return update
+
+
+def save_online_state(state, output_pth, persistence='mmap'):
+    """
+    save the state of the incremental model (see churn_library.save_model)
+    """
+    cls.save_model(state, output_pth, persistence)
+
+
+def load_online_state(state_pth):
+    """
+    returns the state of the incremental model saved at state_pth
+    """
+    return joblib.load(state_pth)
+
+
+def main():
+    """
+    update the incremental model with a batch of customers from the command line
+    """
+    parser = argparse.ArgumentParser(description="Update the incremental churn model")
+    parser.add_argument("input", type=str, help="Csv of customers with Attrition_Flag")
+    parser.add_argument("--models", type=str, default="models",
+                        help="Folder of the saved models, whose encoder is applied")
+    parser.add_argument("--state", type=str, default=os.path.join("models", "online_lr.pkl"),
+                        help="State of the incremental model, created if missing")
+    parser.add_argument("--method", type=str, choices=ONLINE_METHODS, default="sgd",
+                        help="Update method of a new state")
+    parser.add_argument("--batch-size", type=int, default=100_000,
+                        help="Number of rows of each update")
+    args = parser.parse_args()
+
+    models = churn_scoring.load_models(args.models)
+    if os.path.exists(args.state):
+        state = load_online_state(args.state)
+    else:
+        state = make_online_state(args.method, models['features'])
+    for chunk in cls.import_data(args.input, chunksize=args.batch_size, iterator=True):
+        update = update_online_state(state, churn_scoring.encode_features(chunk, models),
+                                     chunk['Churn'])
+        print(f"Batch {update['batch']}: {update['rows']} rows in {update['seconds']:.3f}s, "
+              f"log loss {update['loss_after']:.4f}, converged {update['converged']}")
+    save_online_state(state, args.state)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+"""
+Batch and online scoring of customers with the models saved by churn_library
+File: churn_scoring.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import argparse
+import json
+import logging
+import numbers
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import churn_forest
+import churn_library as cls
+
+try:
+    from pyarrow import parquet
+except ImportError:  # pragma: no cover - pyarrow is optional
+    parquet = None
+
+
+logger = logging.getLogger(__name__)
+
+# batches up to this size are scored with the packed forest, larger ones with sklearn
+PACKED_MAX_ROWS = 256
+
+
+def load_models(model_dir='models', mmap_mode='r'):
+    """
+    load the models listed in the manifest saved by train_models, once, with their
+    numpy arrays memory-mapped read-only. The arrays of the packed forest stay shared
+    between processes; sklearn copies the nodes of its trees while unpickling them
+
+    input:
+            model_dir: folder of the saved models
+            mmap_mode: joblib memory map mode, None loads the arrays in memory. Ignored
+                       for models saved in the compressed layout
+    output:
+            models: dict with the 'rfc', 'lr' and 'rfc_packed' models, the 'encoder'
+                    rebuilt from the manifest (None when the models were saved without
+                    one, they can then only score encoded features), the 'features'
+                    order and the 'manifest'
+    """
+    with open(os.path.join(model_dir, cls.MODEL_MANIFEST)) as file:
+        manifest = json.load(file)
+    if manifest['persistence'] != 'mmap':
+        mmap_mode = None
+    models = {name: joblib.load(os.path.join(model_dir, file_name), mmap_mode=mmap_mode)
+              for name, file_name in manifest['files'].items()}
+    if manifest['encoder'] is None:
+        logger.warning("The models in %s were saved without an encoder", model_dir)
+        models['encoder'] = None
+    else:
+        models['encoder'] = cls.encoder_from_json(manifest['encoder'])
+    models['features'] = manifest['features']
+    models['manifest'] = manifest
+    return models
+
+
+def _encoder(models):
+    """
+    returns the encoder of the models, raising a ValueError when none was saved
+    """
+    if models['encoder'] is None:
+        raise ValueError('the models were saved without an encoder, pass the encoder to '
+                         'train_models to score raw customers')
+    return models['encoder']
+
+
+def input_columns(models):
+    """
+    returns the raw columns needed to score a customer
+    """
+    encoder = _encoder(models)
+    encoded = {f"{category}_{encoder['response']}" for category in encoder['tables']}
+    return [column for column in models['features'] if column not in encoded] + \
+        list(encoder['tables'])
+
+
+def check_record(record, models):
+    """
+    raise an error when a customer cannot be scored, so a malformed request fails
+    alone instead of failing the batch it would be scored with
+
+    input:
+            record: dict of the raw columns of one customer
+            models: dict returned by load_models
+    output:
+            None, raises TypeError when record is not a dict, KeyError when a column is
+            missing and ValueError when a numeric column is not a finite number
+    """
+    if not isinstance(record, dict):
+        raise TypeError('a customer must be a json object')
+    columns = input_columns(models)
+    missing = [column for column in columns if record.get(column) is None]
+    if missing:
+        raise KeyError('missing columns %s' % missing)
+    for column in columns:
+        if column in models['encoder']['tables']:
+            continue
+        value = record[column]
+        if isinstance(value, bool) or not isinstance(value, numbers.Real) or \
+                not np.isfinite(value):
+            raise ValueError('%s must be a number, got %r' % (column, value))
+
+
+def encode_features(df, models):
+    """
+    returns the float32 feature matrix of raw customer rows, in the feature order of
+    the models
+
+    input:
+            df: pandas dataframe with the columns returned by input_columns
+            models: dict returned by load_models
+    output:
+            X: contiguous float32 array
+    """
+    df = cls.transform_encoder(df.copy(), _encoder(models))
+    return np.ascontiguousarray(df[models['features']], dtype=np.float32)
+
+
+def score_frame(df, models):
+    """
+    returns the churn probability of each customer for both models. Small batches
+    use the packed forest when it was loaded, which skips the sklearn overhead that
+    dominates the time of a few rows
+
+    input:
+            df: pandas dataframe of raw customer rows
+            models: dict returned by load_models
+    output:
+            scores: pandas dataframe with the 'rfc_proba' and 'lr_proba' columns, and
+                    CLIENTNUM when df has it
+    """
+    X = encode_features(df, models)
+    if 'rfc_packed' in models and len(X) <= PACKED_MAX_ROWS:
+        rfc_proba = churn_forest.predict_proba(models['rfc_packed'], X)
+    else:
+        rfc_proba = models['rfc'].predict_proba(X)
+    scores = pd.DataFrame({'rfc_proba': rfc_proba[:, 1],
+                           'lr_proba': models['lr'].predict_proba(X)[:, 1]},
+                          index=df.index)
+    if 'CLIENTNUM' in df:
+        scores.insert(0, 'CLIENTNUM', df['CLIENTNUM'])
+    return scores
+
+
+def iter_batches(input_path, columns, batch_size=100_000):
+    """
+    yield the rows of a csv or parquet file by batches of batch_size rows, reading
+    only the given columns (plus CLIENTNUM when present)
+
+    input:
+            input_path: path to a .csv or .parquet file
+            columns: columns needed for scoring
+            batch_size: number of rows per batch
+    output:
+            batches: iterator of pandas dataframes
+    """
+    if input_path.endswith('.parquet'):
+        if parquet is None:
+            raise ImportError('pyarrow is required to score parquet files')
+        parquet_file = parquet.ParquetFile(input_path)
+        names = parquet_file.schema_arrow.names
+        for batch in parquet_file.iter_batches(
+                batch_size=batch_size,
+                columns=[column for column in ['CLIENTNUM'] + columns if column in names]):
+            yield batch.to_pandas()
+        return
+
+    names = pd.read_csv(input_path, nrows=0).columns
+    usecols = [column for column in ['CLIENTNUM'] + columns if column in names]
+    dtype = {column: cls.BANK_DATA_SCHEMA[column] for column in usecols
+             if column in cls.BANK_DATA_SCHEMA}
+    with pd.read_csv(input_path, usecols=usecols, dtype=dtype, chunksize=batch_size) as reader:
+        yield from reader
+
+
+def score_file(input_path, output_path, models, batch_size=100_000):
+    """
+    score every customer of a csv or parquet file batch by batch, so memory stays
+    bounded by batch_size whatever the size of the file, and append the scores to a csv
+
+    input:
+            input_path: path to a .csv or .parquet file of customers
+            output_path: path of the csv of scores
+            models: dict returned by load_models
+            batch_size: number of rows scored at a time
+    output:
+            stats: dict with the number of rows, the seconds spent and the rows per second
+    """
+    start = time.perf_counter()
+    rows = 0
+    columns = input_columns(models)
+    with open(output_path, 'w', newline='') as output:
+        for batch in iter_batches(input_path, columns, batch_size):
+            score_frame(batch, models).to_csv(output, header=rows == 0, index=False)
+            rows += len(batch)
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_s': rows / seconds if seconds else float('inf')}
+
+
+class MicroBatcher:
+    """
+    coalesce single requests made concurrently into one call of predict_fn: a
+    background thread waits for the first request, then up to max_wait_ms for more,
+    and answers the whole batch (at most max_batch_size requests) at once
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=2.0):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.batch_sizes_ = []
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, record):
+        """
+        queue one record and return a Future of its prediction
+        """
+        future = Future()
+        self._requests.put((record, future))
+        return future
+
+    def predict(self, record, timeout=None):
+        """
+        prediction of one record, blocking until its batch was scored
+        """
+        return self.submit(record).result(timeout)
+
+    def close(self):
+        """
+        stop the background thread once the queued requests were answered
+        """
+        self._requests.put(None)
+        self._thread.join()
+
+    def _run(self):
+        """
+        loop of the background thread
+        """
+        while True:
+            item = self._requests.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._requests.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._requests.put(None)
+                    break
+                batch.append(item)
+            self._answer(batch)
+
+    def _answer(self, batch):
+        """
+        call predict_fn on the records of the batch and resolve their futures. When the
+        batch fails its records are scored one by one, so a bad record only fails its
+        own request
+        """
+        self.batch_sizes_.append(len(batch))
+        try:
+            predictions = self.predict_fn([record for record, _ in batch])
+        except Exception as err:  # pylint: disable=broad-except
+            if len(batch) == 1:
+                batch[0][1].set_exception(err)
+                return
+            for item in batch:
+                self._answer([item])
+            return
+        for (_, future), prediction in zip(batch, predictions):
+            future.set_result(prediction)
+
+
+def make_predict_fn(models):
+    """
+    returns a function scoring a list of customer dicts in one predict_proba call
+    per model
+    """
+    def predict_records(records):
+        scores = score_frame(pd.DataFrame.from_records(records), models)
+        return scores.to_dict('records')
+    return predict_records
+
+
+def make_server(models, host='127.0.0.1', port=8000, max_batch_size=64, max_wait_ms=2.0):
+    """
+    returns an http server answering POST /predict with the scores of the customer (a
+    json object) or customers (a json list) of the body. Requests handled concurrently
+    are scored together by a MicroBatcher, available as server.batcher
+
+    input:
+            models: dict returned by load_models
+            host: interface to listen on
+            port: port to listen on, 0 picks a free port
+            max_batch_size: maximum number of customers scored together
+            max_wait_ms: longest time a request waits for others to join its batch
+    output:
+            server: ThreadingHTTPServer, call serve_forever() to start it
+    """
+    # the server scores raw customers, fail now when the models have no encoder
+    input_columns(models)
+    batcher = MicroBatcher(make_predict_fn(models), max_batch_size, max_wait_ms)
+
+    class PredictHandler(BaseHTTPRequestHandler):
+        """
+        handler of the /predict endpoint
+        """
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            """
+            score the customers of the request body
+            """
+            if self.path != '/predict':
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            except (TypeError, ValueError):
+                self.send_error(400, 'body must be json')
+                return
+            records = body if isinstance(body, list) else [body]
+            # invalid customers are rejected before they join the batch of other requests
+            try:
+                for record in records:
+                    check_record(record, models)
+            except (KeyError, TypeError, ValueError) as err:
+                self.send_error(400, str(err))
+                return
+            futures = [batcher.submit(record) for record in records]
+            try:
+                scores = [future.result() for future in futures]
+            except Exception as err:  # pylint: disable=broad-except
+                logger.exception("Scoring failed")
+                self.send_error(500, str(err))
+                return
+            content = json.dumps(scores if isinstance(body, list) else scores[0]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), PredictHandler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+def main():
+    """
+    score a file or serve the models from the command line
+    """
+    parser = argparse.ArgumentParser(description="Score customers with the churn models")
+    parser.add_argument("--models", type=str, default="models",
+                        help="Folder of the saved models")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    batch_parser = subparsers.add_parser("batch", help="Score a csv or parquet file")
+    batch_parser.add_argument("input", type=str, help="Csv or parquet file of customers")
+    batch_parser.add_argument("output", type=str, help="Csv file of scores")
+    batch_parser.add_argument("--batch-size", type=int, default=100_000,
+                              help="Number of rows scored at a time")
+    serve_parser = subparsers.add_parser("serve", help="Serve POST /predict")
+    serve_parser.add_argument("--host", type=str, default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8000)
+    serve_parser.add_argument("--max-batch-size", type=int, default=64,
+                              help="Maximum number of requests scored together")
+    serve_parser.add_argument("--max-wait-ms", type=float, default=2.0,
+                              help="Longest wait for other requests to join a batch")
+    args = parser.parse_args()
+
+    models = load_models(args.models)
+    if args.command == "batch":
+        stats = score_file(args.input, args.output, models, args.batch_size)
+        print(f"Scored {stats['rows']} rows in {stats['seconds']:.2f}s "
+              f"({stats['rows_per_s']:.0f} rows/s)")
+    else:
+        server = make_server(models, args.host, args.port, args.max_batch_size,
+                             args.max_wait_ms)
+        print(f"Serving on http://{args.host}:{server.server_address[1]}/predict")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            server.batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,47 @@
 """
-Module for test the correct performance of churn_library.py
+Module for test the correct performance of churn_library.py, the data and the
+encoded splits are session fixtures defined in conftest.py
 Author: Marcelo
 Date: May 31 2022
 """
 
 
+import glob
 import logging
-import joblib
+import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import classification_report, roc_auc_score, roc_curve
+from sklearn.model_selection import GridSearchCV
+
+import churn_benchmarks
+import churn_cache
+import churn_explain
+import churn_forest
+import churn_instrument
 import churn_library as cls
+import churn_metrics
+import churn_online
+import churn_scoring
+import churn_stats
 
 
-def test_import():
+def test_import(tmp_path):
     """
     test data import - this example is completed for you to assist with the other test functions
     """
     try:
-        dataframe_raw = cls.import_data('data/bank_data.csv')
+        dataframe_raw = cls.import_data('data/bank_data.csv', cache_dir=str(tmp_path))
         logging.info('Raw dataframe fixture creation: SUCCESS')
     except FileNotFoundError as err:
         logging.info('The raw dataframe was not found')
@@ -30,17 +55,104 @@ def test_import():
         raise err
 
 
-def test_eda():
+def test_import_chunks(bank_data):
+    """
+    test that the chunked import returns the same typed dataframe as a single read
+    """
+    dataframe_chunked = cls.import_data('data/bank_data.csv', chunksize=1000)
+    chunk_rows = [len(chunk) for chunk in cls.import_data('data/bank_data.csv', chunksize=1000,
+                                                          iterator=True)]
+    try:
+        assert bank_data.equals(dataframe_chunked)
+        assert sum(chunk_rows) == bank_data.shape[0]
+        assert max(chunk_rows) == 1000
+        assert bank_data['Gender'].dtype == 'category'
+        assert bank_data['Churn'].dtype == 'int8'
+    except AssertionError as err:
+        logging.error("Testing import_data: chunked import differs from a single read")
+        raise err
+    logging.info("Testing import_data by chunks: SUCCESS")
+
+
+def test_import_cache():
+    """
+    test that the columnar cache returns the csv content and follows its changes
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_path = os.path.join(tmp_dir, 'bank_data.csv')
+        cache_dir = os.path.join(tmp_dir, 'cache')
+        shutil.copy('data/bank_data.csv', csv_path)
+        dataframe_csv = cls.import_data(csv_path)
+        dataframe_cold = cls.import_data(csv_path, cache_dir=cache_dir)
+        dataframe_warm = cls.import_data(csv_path, cache_dir=cache_dir)
+        try:
+            assert dataframe_csv.equals(dataframe_cold)
+            assert dataframe_csv.equals(dataframe_warm)
+            assert len(glob.glob(os.path.join(cache_dir, '*.feather'))) == 1
+        except AssertionError as err:
+            logging.error("Testing import_data: cached dataframe differs from the csv")
+            raise err
+
+        dataframe_csv.iloc[:100].to_csv(csv_path, index=False,
+                                        columns=list(cls.BANK_DATA_SCHEMA))
+        dataframe_changed = cls.import_data(csv_path, cache_dir=cache_dir)
+        try:
+            assert dataframe_changed.shape[0] == 100
+            assert len(glob.glob(os.path.join(cache_dir, '*.feather'))) == 1
+        except AssertionError as err:
+            logging.error("Testing import_data: cache was not invalidated by a new csv")
+            raise err
+
+        # a csv of the same name in another folder keeps its own entry
+        other_path = os.path.join(tmp_dir, 'other', 'bank_data.csv')
+        os.makedirs(os.path.dirname(other_path))
+        shutil.copy('data/bank_data.csv', other_path)
+        dataframe_other = cls.import_data(other_path, cache_dir=cache_dir)
+        dataframe_again = cls.import_data(csv_path, cache_dir=cache_dir)
+        try:
+            assert dataframe_other.shape[0] == dataframe_csv.shape[0]
+            assert dataframe_again.shape[0] == 100
+            assert len(glob.glob(os.path.join(cache_dir, '*.feather'))) == 2
+        except AssertionError as err:
+            logging.error("Testing import_data: csv files of the same name share a cache entry")
+            raise err
+    logging.info("Testing import_data with cache: SUCCESS")
+
+
+def test_synthetic_data(bank_data):
+    """
+    test that the synthetic data has the columns, dtypes, levels and churn ratio of
+    bank_data
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        csv_pth = os.path.join(tmp_dir, 'synthetic.csv')
+        churn_benchmarks.write_synthetic_csv(csv_pth, 50_000, bank_data, chunksize=20_000)
+        synthetic = cls.import_data(csv_pth)
+    try:
+        assert len(synthetic) == 50_000
+        assert list(synthetic.columns) == list(bank_data.columns)
+        assert synthetic['CLIENTNUM'].is_unique
+        for column, dtype in bank_data.dtypes.items():
+            assert synthetic[column].dtype == dtype
+            if isinstance(dtype, pd.CategoricalDtype):
+                assert set(synthetic[column].unique()) == set(bank_data[column].unique())
+        assert abs(synthetic['Churn'].mean() - bank_data['Churn'].mean()) < 0.01
+    except AssertionError as err:
+        logging.error("Testing synthetic data: the data does not look like bank_data")
+        raise err
+    logging.info("Testing synthetic data: SUCCESS")
+
+
+def test_eda(bank_data, output_dirs):
     """
     test perform eda function
     """
     try:
-        dataframe_raw = cls.import_data('data/bank_data.csv')
-        cls.perform_eda(dataframe_raw)
+        cls.perform_eda(bank_data, output_dir=output_dirs['eda'], n_jobs=2)
         logging.info('Testing perform_eda: SUCCESS')
 
         for image in ['Churn', 'correlation', 'Customer_Age', 'Marital_Status', 'Total_Trans_Ct']:
-            path_img = 'images/eda/%s.jpg' % image
+            path_img = os.path.join(output_dirs['eda'], '%s.jpg' % image)
             with open(path_img, 'r'):
                 img = Path(path_img)
                 assert img.exists()
@@ -50,17 +162,86 @@ def test_eda():
         raise err
 
 
-def test_encoder_helper():
+def test_eda_incremental(data):
+    """
+    test that incremental eda only re-renders the figures whose data changed
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        cls.perform_eda(data, output_dir=output_dir, incremental=True)
+        first = {name: os.stat(os.path.join(output_dir, '%s.jpg' % name)).st_mtime_ns
+                 for name in cls.EDA_PLOTS}
+        cls.perform_eda(data, output_dir=output_dir, incremental=True)
+        data['Customer_Age'] = data['Customer_Age'] + 1
+        cls.perform_eda(data, output_dir=output_dir, incremental=True)
+        last = {name: os.stat(os.path.join(output_dir, '%s.jpg' % name)).st_mtime_ns
+                for name in cls.EDA_PLOTS}
+    try:
+        assert last['Churn'] == first['Churn']
+        assert last['Marital_Status'] == first['Marital_Status']
+        assert last['Customer_Age'] != first['Customer_Age']
+        assert last['correlation'] != first['correlation']
+    except AssertionError as err:
+        logging.error("Testing perform_eda: incremental mode re-rendered the wrong figures")
+        raise err
+    logging.info("Testing perform_eda in incremental mode: SUCCESS")
+
+
+def test_fingerprint_code():
+    """
+    test that figure fingerprints change with the constants of the plot functions, also
+    when their source is not available
+    """
+    namespaces = [{}, {}]
+    for namespace, color in zip(namespaces, ['red', 'blue']):
+        source = "def plot(axes, data):\n    axes.hist(data, color=%r)\n" % color
+        exec(source, namespace)  # pylint: disable=exec-used
+    try:
+        assert churn_cache.fingerprint(namespaces[0]['plot']) != \
+            churn_cache.fingerprint(namespaces[1]['plot'])
+        # functions defined in a file are hashed by their source
+        assert churn_cache.fingerprint(cls.perform_eda) == churn_cache.fingerprint(cls.perform_eda)
+        assert churn_cache.fingerprint(cls.perform_eda) != \
+            churn_cache.fingerprint(cls.classification_report_image)
+    except AssertionError as err:
+        logging.error("Testing fingerprint: a change of the plot code kept the fingerprint")
+        raise err
+    logging.info("Testing fingerprint of plot functions: SUCCESS")
+
+
+def test_eda_approximate(bank_data):
+    """
+    test that the statistics streamed by chunks match the full dataframe ones
+    """
+    summary = cls.summarize_eda(cls.import_data('data/bank_data.csv', chunksize=1000,
+                                                iterator=True), sample_size=500)
+    try:
+        correlation = churn_stats.correlation_from_moments(summary['correlation'])
+        assert np.allclose(correlation, bank_data.select_dtypes('number').corr())
+        hist, _ = churn_stats.histogram_from_bincount(summary['Customer_Age'])
+        assert (hist == np.histogram(bank_data['Customer_Age'], bins=10)[0]).all()
+        assert len(summary['Total_Trans_Ct']['reservoir']['sample']) == 500
+        assert summary['Total_Trans_Ct']['reservoir']['seen'] == bank_data.shape[0]
+    except AssertionError as err:
+        logging.error("Testing summarize_eda: streamed statistics differ from exact ones")
+        raise err
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        cls.perform_eda(bank_data, output_dir=output_dir, approximate=True,
+                        sample_size=500, chunksize=3000)
+        try:
+            for image in cls.APPROX_EDA_PLOTS:
+                assert os.path.exists(os.path.join(output_dir, '%s.jpg' % image))
+        except AssertionError as err:
+            logging.error('Testing approximate EDA generated missing images')
+            raise err
+    logging.info("Testing perform_eda in approximate mode: SUCCESS")
+
+
+def test_encoder_helper(data, category_list):
     """
     test encoder helper
     """
-    dataframe_raw = cls.import_data('data/bank_data.csv')
-    category_list = ["Gender",
-                     "Education_Level",
-                     "Marital_Status",
-                     "Income_Category",
-                     "Card_Category"]
-    dataframe_encoded = cls.encoder_helper(dataframe_raw, category_list)
+    dataframe_encoded = cls.encoder_helper(data, category_list)
     try:
         assert dataframe_encoded.shape[0] > 0
         assert dataframe_encoded.shape[1] > 0
@@ -82,16 +263,50 @@ def test_encoder_helper():
     logging.info("Testing encoder_helper: SUCCESS")
 
 
-def test_perform_feature_engineering():
+def test_encoder_fit_transform(bank_data, category_list):
+    """
+    test that encoding tables learned on train rows are applied to unseen rows
+    """
+    train = bank_data.iloc[:7000].copy()
+    test = bank_data.iloc[7000:].copy()
+    encoder = cls.fit_encoder(train, category_list)
+    test_encoded = cls.transform_encoder(test, encoder)
+    try:
+        for column in category_list:
+            expected = test[column].map(train.groupby(column)['Churn'].mean()).astype(float)
+            assert test_encoded[f'{column}_Churn'].notna().all()
+            assert (test_encoded[f'{column}_Churn'] - expected).abs().max() < 1e-12
+    except AssertionError as err:
+        logging.error("Testing fit_encoder: test rows were not encoded with the train means")
+        raise err
+    logging.info("Testing fit_encoder and transform_encoder: SUCCESS")
+
+
+def test_encode_out_of_fold(data):
+    """
+    test that the out of fold encoding matches a per fold recomputation
+    """
+    dataframe_encoded = cls.encode_out_of_fold(data, ["Education_Level"],
+                                               n_folds=5, smoothing=10.0)
+    folds = np.random.RandomState(42).permutation(len(data)) % 5
+    prior = data['Churn'].mean()
+    try:
+        for fold in range(5):
+            rest = data[folds != fold].groupby('Education_Level')['Churn']
+            smoothed = (rest.sum() + 10.0 * prior) / (rest.count() + 10.0)
+            expected = data.loc[folds == fold, 'Education_Level'].map(smoothed)
+            encoded = dataframe_encoded.loc[folds == fold, 'Education_Level_Churn']
+            assert np.allclose(encoded, expected)
+    except AssertionError as err:
+        logging.error("Testing encode_out_of_fold: encoding differs from the per fold means")
+        raise err
+    logging.info("Testing encode_out_of_fold: SUCCESS")
+
+
+def test_perform_feature_engineering(data, category_list):
     """
     test perform_feature_engineering
     """
-    data = cls.import_data('data/bank_data.csv')
-    category_list = ["Gender",
-                     "Education_Level",
-                     "Marital_Status",
-                     "Income_Category",
-                     "Card_Category"]
     X_train, X_test, y_train, y_test = cls.perform_feature_engineering(data, category_list)
     try:
         assert len(X_train) == len(y_train)
@@ -103,23 +318,207 @@ def test_perform_feature_engineering():
         raise err
 
 
-def test_train_models():
+def test_stream_feature_engineering(bank_data, category_list, tmp_path):
     """
-    test train_models
+    test that the out of core feature engineering gives the in-memory encoding of the
+    hashed split, whatever the chunk size
     """
-    data = cls.import_data('data/bank_data.csv')
-    category_list = ["Gender",
-                     "Education_Level",
-                     "Marital_Status",
-                     "Income_Category",
-                     "Card_Category"]
-    X_train, X_test, y_train, y_test = cls.perform_feature_engineering(data, category_list)
-    cls.train_models(X_train, X_test, y_train, y_test)
+    X_train, X_test, y_train, y_test, encoder = cls.stream_feature_engineering(
+        'data/bank_data.csv', category_list, str(tmp_path / 'train'), encoding='train',
+        chunksize=1000, return_encoder=True)
+    is_test, _ = cls.hash_split(bank_data['CLIENTNUM'])
+    expected = cls.fit_encoder(bank_data[~is_test], category_list)
+    oof_small = cls.stream_feature_engineering('data/bank_data.csv', category_list,
+                                               str(tmp_path / 'small'), chunksize=700)
+    oof_large = cls.stream_feature_engineering('data/bank_data.csv', category_list,
+                                               str(tmp_path / 'large'), chunksize=20_000)
+    try:
+        assert isinstance(X_train, np.memmap) and X_train.dtype == np.float32
+        assert len(X_train) + len(X_test) == len(bank_data)
+        assert abs(is_test.mean() - 0.3) < 0.02
+        assert encoder['prior'] == expected['prior']
+        for rows, X, y in ((~is_test, X_train, y_train), (is_test, X_test, y_test)):
+            encoded = cls.transform_encoder(bank_data[rows].copy(), expected)
+            assert np.array_equal(X, encoded[cls.KEEP_COLS].to_numpy(np.float32))
+            assert np.array_equal(y, bank_data.loc[rows, 'Churn'])
+        for small, large in zip(oof_small, oof_large):
+            assert np.array_equal(small, large)
+    except AssertionError as err:
+        logging.error("Testing stream_feature_engineering: features differ from in-memory")
+        raise err
+    logging.info("Testing stream_feature_engineering: SUCCESS")
+
+
+def test_metrics():
+    """
+    test that the metrics engine matches sklearn, whether the rows are counted at once
+    or by chunks
+    """
+    rng = np.random.RandomState(42)
+    y_true = rng.randint(0, 2, 5000)
+    proba = np.round(rng.rand(5000) * 0.6 + y_true * 0.3, 3)
+    y_pred = (proba > 0.5).astype(int)
+    report = churn_metrics.format_report(churn_metrics.classification_metrics(
+        churn_metrics.score_counts(y_true, y_pred)))
+    whole = churn_metrics.score_counts(y_true, proba)
+    chunks = churn_metrics.merge_score_counts(
+        churn_metrics.score_counts(y_true[:1234], proba[:1234], chunksize=100),
+        churn_metrics.score_counts(y_true[1234:], proba[1234:]))
+    curves = churn_metrics.curves(chunks)
+    fpr, tpr, _ = roc_curve(y_true, proba, drop_intermediate=False)
+    try:
+        assert report == classification_report(y_true, y_pred)
+        for name in ('scores', 'positives', 'negatives'):
+            assert np.array_equal(whole[name], chunks[name])
+        assert np.array_equal(churn_metrics.classification_metrics(chunks)['confusion_matrix'],
+                              [[np.sum((y_true == 0) & (y_pred == 0)),
+                                np.sum((y_true == 0) & (y_pred == 1))],
+                               [np.sum((y_true == 1) & (y_pred == 0)),
+                                np.sum((y_true == 1) & (y_pred == 1))]])
+        assert np.allclose(curves['fpr'], fpr) and np.allclose(curves['tpr'], tpr)
+        assert np.isclose(curves['roc_auc'], roc_auc_score(y_true, proba))
+    except AssertionError as err:
+        logging.error("Testing metrics: the metrics differ from sklearn")
+        raise err
+    logging.info("Testing metrics: SUCCESS")
+
+
+def test_instrument(bank_data, category_list):
+    """
+    test that instrumented stages log their measures as json lines, and dump a profile
+    when asked to
+    """
+    stage_logger = logging.getLogger('churn_instrument')
+    level = stage_logger.level
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        handler = logging.FileHandler(os.path.join(tmp_dir, 'stages.log'))
+        stage_logger.addHandler(handler)
+        stage_logger.setLevel(logging.INFO)
+        os.environ[churn_instrument.PROFILE_DIR_ENV] = tmp_dir
+        try:
+            cls.encoder_helper(bank_data.copy(), category_list)
+        finally:
+            del os.environ[churn_instrument.PROFILE_DIR_ENV]
+            stage_logger.removeHandler(handler)
+            stage_logger.setLevel(level)
+            handler.close()
+        records = churn_instrument.read_records(os.path.join(tmp_dir, 'stages.log'))
+        profiles = glob.glob(os.path.join(tmp_dir, 'encoder_helper-*.prof'))
+    try:
+        assert [record['stage'] for record in records] == ['encoder_helper']
+        assert records[0]['rows'] == len(bank_data)
+        assert records[0]['status'] == 'ok'
+        for key in ('wall_s', 'cpu_s', 'children_cpu_s', 'peak_rss_mb'):
+            assert records[0][key] >= 0
+        assert len(profiles) == 1
+    except AssertionError as err:
+        logging.error("Testing instrument: the stage was not recorded")
+        raise err
+    logging.info("Testing instrument: SUCCESS")
+
+
+def test_build_search(training_split):
+    """
+    test the successive halving search and its results table on a small grid
+    """
+    X_train, _, y_train, _, _ = training_split
+    param_grid = {'n_estimators': [10, 20], 'max_depth': [2, 4, 8]}
+    cv_rfc = cls.build_search('halving', n_jobs=2, param_grid=param_grid, cv=3)
+    cv_rfc.fit(X_train, y_train)
+    results = cls.search_results_table(cv_rfc)
+    try:
+        assert set(cv_rfc.best_params_) == set(param_grid)
+        assert (results['n_resources'] < len(X_train)).any()
+        assert results['n_resources'].max() <= len(X_train)
+        assert results['mean_fit_time'].notna().all()
+        assert results['rank_test_score'].is_monotonic_increasing
+    except AssertionError as err:
+        logging.error("Testing build_search: unexpected halving search results")
+        raise err
+    logging.info("Testing build_search: SUCCESS")
+
+
+def test_warm_start_search(training_split):
+    """
+    test that growing forests along n_estimators gives the grid search results
+    """
+    X_train, X_test, y_train, _, _ = training_split
+    param_grid = {'n_estimators': [10, 30], 'max_depth': [4, 8]}
+    cv_grid = cls.build_search('grid', param_grid=param_grid, cv=3).fit(X_train, y_train)
+    cv_warm = cls.build_search('warm_start', param_grid=param_grid, cv=3).fit(X_train, y_train)
+    try:
+        assert np.array_equal(cv_grid.cv_results_['mean_test_score'],
+                              cv_warm.cv_results_['mean_test_score'])
+        assert cv_grid.best_params_ == cv_warm.best_params_
+        assert np.array_equal(cv_grid.best_estimator_.predict_proba(X_test.to_numpy()),
+                              cv_warm.best_estimator_.predict_proba(X_test.to_numpy()))
+        assert cv_warm.trees_fit_ < cv_warm.trees_grid_ + cv_warm.best_params_['n_estimators']
+        assert len(cv_warm.best_estimator_.estimators_) == cv_warm.best_params_['n_estimators']
+    except AssertionError as err:
+        logging.error("Testing warm start search: results differ from the grid search")
+        raise err
+
+    # fitting the cached search again with fewer trees reuses the larger cached forests
+    cv_cached = cls.build_search('warm_start', param_grid={'n_estimators': [40], 'max_depth': [4]},
+                                 cv=3, cache_forests=True).fit(X_train, y_train)
+    cv_cached.param_grid = {'n_estimators': [5], 'max_depth': [4]}
+    cv_cached.fit(X_train, y_train)
+    cv_small = cls.build_search('grid', param_grid=cv_cached.param_grid, cv=3).fit(X_train,
+                                                                                  y_train)
+    try:
+        assert cv_cached.trees_fit_ == 0
+        assert len(cv_cached.best_estimator_.estimators_) == \
+            cv_cached.best_params_['n_estimators'] == 5
+        assert np.array_equal(cv_small.best_estimator_.predict_proba(X_test.to_numpy()),
+                              cv_cached.best_estimator_.predict_proba(X_test.to_numpy()))
+    except AssertionError as err:
+        logging.error("Testing warm start search: cached refit kept the wrong number of trees")
+        raise err
+    logging.info("Testing warm start search: SUCCESS")
+
+
+def test_fit_models(training_split):
+    """
+    test that model families fitted concurrently match sequential fits
+    """
+    X_train, X_test, y_train, _, _ = training_split
+    models = {'rfc': RandomForestClassifier(n_estimators=20, random_state=42),
+              'lr': LogisticRegression(solver='lbfgs', max_iter=3000)}
+    sequential = cls.fit_models({name: clone(model) for name, model in models.items()},
+                                X_train, y_train, n_jobs=1)
+    concurrent = cls.fit_models(models, X_train, y_train, n_jobs=2)
+    # a search fitted in this process keeps its own worker processes
+    search = GridSearchCV(RandomForestClassifier(n_estimators=20, random_state=42),
+                          {'max_depth': [3, 5]}, cv=2, n_jobs=2)
+    in_process = cls.fit_models({'rfc': search, 'lr': clone(models['lr'])},
+                                X_train, y_train, n_jobs=2, in_process=['rfc'])
+    X_test_values = np.ascontiguousarray(X_test, dtype=np.float32)
     try:
-        joblib.load('models/rfc_model.pkl')
-        joblib.load('models/logistic_model.pkl')
-        rfc_model = Path('models/rfc_model.pkl')
-        lr_model = Path('models/logistic_model.pkl')
+        for name in models:
+            assert np.array_equal(sequential[name].predict_proba(X_test_values),
+                                  concurrent[name].predict_proba(X_test_values))
+        assert in_process['rfc'] is search and hasattr(search, 'best_estimator_')
+        assert np.array_equal(in_process['lr'].predict_proba(X_test_values),
+                              sequential['lr'].predict_proba(X_test_values))
+    except AssertionError as err:
+        logging.error("Testing fit_models: concurrent fits differ from sequential fits")
+        raise err
+    logging.info("Testing fit_models: SUCCESS")
+
+
+def test_train_models(training_split, param_grid, output_dirs):
+    """
+    test train_models, on a stratified sample with a reduced grid in fast mode
+    """
+    X_train, X_test, y_train, y_test, encoder = training_split
+    cls.train_models(X_train, X_test, y_train, y_test, encoder=encoder, param_grid=param_grid,
+                     model_dir=output_dirs['models'], image_dir=output_dirs['images'])
+    try:
+        joblib.load(os.path.join(output_dirs['models'], 'rfc_model.pkl'))
+        joblib.load(os.path.join(output_dirs['models'], 'logistic_model.pkl'))
+        churn_scoring.load_models(output_dirs['models'])
+        rfc_model = Path(output_dirs['models'], 'rfc_model.pkl')
+        lr_model = Path(output_dirs['models'], 'logistic_model.pkl')
         assert rfc_model.exists()
         assert lr_model.exists()
         logging.info("Testing testing_models. Models were created: SUCCESS")
@@ -128,13 +527,232 @@ def test_train_models():
         raise err
     for image in ["Logistic_Regression", "Random_Forest", "Feature_Importance"]:
         try:
-            with open("images/results/%s.jpg" % image, 'r'):
+            with open(os.path.join(output_dirs['results'], "%s.jpg" % image), 'r'):
                 logging.info("Testing testing_models (report generation): SUCCESS")
         except FileNotFoundError as err:
             logging.error("Testing testing_models (report generation): The images were not found")
             raise err
 
 
+def test_online_model(feature_split, tmp_path):
+    """
+    test that monthly updates of the incremental model rank customers as well as a full
+    refit, and that a saved state resumes exactly where it stopped
+    """
+    X_train, X_test, y_train, y_test, _ = feature_split
+    full = LogisticRegression(solver='lbfgs', max_iter=3000).fit(X_train, y_train)
+    batches = np.array_split(np.arange(len(X_train)), 6)
+    try:
+        for method in churn_online.ONLINE_METHODS:
+            state = churn_online.make_online_state(method, X_train.columns)
+            resumed = None
+            for number, rows in enumerate(batches):
+                update = churn_online.update_online_state(state, X_train.iloc[rows],
+                                                          y_train.iloc[rows])
+                if resumed is not None:
+                    churn_online.update_online_state(resumed, X_train.iloc[rows],
+                                                     y_train.iloc[rows])
+                if number == 2:
+                    churn_online.save_online_state(state, str(tmp_path / 'state.pkl'))
+                    resumed = churn_online.load_online_state(str(tmp_path / 'state.pkl'))
+            assert len(state['history']) == len(batches) and state['n_rows'] == len(X_train)
+            assert update['loss_after'] <= update['loss_before']
+            assert np.array_equal(churn_online.predict_proba(state, X_test),
+                                  churn_online.predict_proba(resumed, X_test))
+            assert roc_auc_score(y_test, churn_online.predict_proba(state, X_test)) >= \
+                roc_auc_score(y_test, full.predict_proba(X_test)[:, 1]) - 0.01
+    except AssertionError as err:
+        logging.error("Testing online model: incremental updates are not consistent")
+        raise err
+    logging.info("Testing online model: SUCCESS")
+
+
+def test_online_model_history(feature_split):
+    """
+    test that the warm start updates fit the whole history and not the last batch, and
+    that the scaling stays the one of the first batch
+    """
+    X_train, _, y_train, _, _ = feature_split
+    batches = np.array_split(np.arange(len(X_train)), 4)
+    state = churn_online.make_online_state('warm_start', X_train.columns)
+    for rows in batches:
+        churn_online.update_online_state(state, X_train.iloc[rows], y_train.iloc[rows])
+
+    scaler = state['scaler']
+    X_scaled = scaler.transform(X_train.to_numpy(dtype=np.float64))
+    full = LogisticRegression(solver='lbfgs', max_iter=3000).fit(X_scaled, y_train)
+    last = LogisticRegression(solver='lbfgs', max_iter=3000).fit(X_scaled[batches[-1]],
+                                                                 y_train.iloc[batches[-1]])
+    coef = state['model'].coef_
+    try:
+        assert np.allclose(scaler.mean_, X_train.iloc[batches[0]].mean(), atol=1e-5)
+        assert np.abs(coef - full.coef_).max() < 1e-2
+        assert np.abs(coef - last.coef_).max() > 10 * np.abs(coef - full.coef_).max()
+    except AssertionError as err:
+        logging.error("Testing online model: warm start updates forget the past batches")
+        raise err
+    logging.info("Testing online model history: SUCCESS")
+
+
+def test_export_forest(feature_split):
+    """
+    test that the packed forest predicts bit for bit like the sklearn forest
+    """
+    X_train, X_test, y_train, _, _ = feature_split
+    X_test_values = np.ascontiguousarray(X_test, dtype=np.float32)
+    try:
+        for max_depth in [4, None]:
+            forest = RandomForestClassifier(n_estimators=30, max_depth=max_depth,
+                                            random_state=42)
+            forest.fit(np.ascontiguousarray(X_train, dtype=np.float32), y_train)
+            packed = churn_forest.export_forest(forest)
+            assert np.array_equal(
+                churn_forest.predict_proba(packed, X_test_values, chunk_size=500),
+                forest.predict_proba(X_test_values))
+            assert np.array_equal(churn_forest.predict(packed, X_test_values),
+                                  forest.predict(X_test_values))
+            assert np.array_equal(churn_forest.predict_proba(packed, X_test_values[0]),
+                                  forest.predict_proba(X_test_values[:1]))
+    except AssertionError as err:
+        logging.error("Testing export_forest: packed predictions differ from the forest")
+        raise err
+    logging.info("Testing export_forest: SUCCESS")
+
+
+def test_save_model():
+    """
+    test that both persistence layouts load the same model, and that the mmap layout
+    memory-maps the packed forest arrays
+    """
+    X = np.random.RandomState(42).rand(500, 4).astype(np.float32)
+    y = (X[:, 0] > 0.5).astype(int)
+    forest = RandomForestClassifier(n_estimators=10, random_state=42).fit(X, y)
+    packed = churn_forest.export_forest(forest)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for persistence in cls.MODEL_PERSISTENCE:
+            output_pth = os.path.join(tmp_dir, '%s.pkl' % persistence)
+            cls.save_model(packed, output_pth, persistence)
+            loaded = joblib.load(output_pth, mmap_mode='r')
+            try:
+                assert np.array_equal(churn_forest.predict_proba(loaded, X),
+                                      forest.predict_proba(X))
+                assert isinstance(loaded['threshold'], np.memmap) == (persistence == 'mmap')
+            except AssertionError as err:
+                logging.error("Testing save_model: %s layout not loaded as expected",
+                              persistence)
+                raise err
+    logging.info("Testing save_model: SUCCESS")
+
+
+def test_scoring(bank_data, feature_split):
+    """
+    test that batch scoring of a file and micro-batched single requests give the
+    probabilities of the saved models
+    """
+    X_train, X_test, y_train, _, encoder = feature_split
+    models = cls.fit_models({'rfc': RandomForestClassifier(n_estimators=20, random_state=42),
+                             'lr': LogisticRegression(solver='lbfgs', max_iter=3000)},
+                            X_train, y_train)
+    customers = bank_data.loc[X_test.index].drop(columns=['Attrition_Flag', 'Churn'])
+    X_test_values = np.ascontiguousarray(X_test, dtype=np.float32)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        models['rfc_packed'] = churn_forest.export_forest(models['rfc'])
+        for name, model in models.items():
+            cls.save_model(model, os.path.join(tmp_dir, '%s.pkl' % name))
+        cls.save_model_manifest(os.path.join(tmp_dir, cls.MODEL_MANIFEST),
+                                {name: '%s.pkl' % name for name in models},
+                                X_train.columns,
+                                {'rfc': models['rfc'].get_params(),
+                                 'lr': models['lr'].get_params()},
+                                encoder)
+        loaded = churn_scoring.load_models(tmp_dir)
+        customers.to_csv(os.path.join(tmp_dir, 'customers.csv'), index=False)
+        stats = churn_scoring.score_file(os.path.join(tmp_dir, 'customers.csv'),
+                                         os.path.join(tmp_dir, 'scores.csv'),
+                                         loaded, batch_size=1000)
+        scores = pd.read_csv(os.path.join(tmp_dir, 'scores.csv'))
+        batcher = churn_scoring.MicroBatcher(churn_scoring.make_predict_fn(loaded),
+                                             max_batch_size=8, max_wait_ms=50)
+        records = customers.head(20).to_dict('records')
+        futures = [batcher.submit(record) for record in records]
+        online = pd.DataFrame([future.result() for future in futures])
+        batcher.close()
+        # a record missing a column fails alone, not the batch it joined
+        bad_record = {key: value for key, value in records[0].items()
+                      if key != 'Credit_Limit'}
+        batcher = churn_scoring.MicroBatcher(churn_scoring.make_predict_fn(loaded),
+                                             max_batch_size=8, max_wait_ms=50)
+        futures = [batcher.submit(record) for record in records[:4] + [bad_record]]
+        bad_error = futures[-1].exception()
+        isolated = pd.DataFrame([future.result() for future in futures[:4]])
+        batcher.close()
+        check_error = None
+        try:
+            churn_scoring.check_record(bad_record, loaded)
+        except KeyError as err:
+            check_error = err
+        # models saved without an encoder load, but cannot encode raw customers
+        cls.save_model_manifest(os.path.join(tmp_dir, cls.MODEL_MANIFEST),
+                                {name: '%s.pkl' % name for name in models},
+                                X_train.columns, {})
+        unencoded = churn_scoring.load_models(tmp_dir)
+        encoder_error = None
+        try:
+            churn_scoring.score_frame(customers.head(), unencoded)
+        except ValueError as err:
+            encoder_error = err
+    try:
+        assert stats['rows'] == len(customers)
+        assert np.array_equal(scores['CLIENTNUM'], customers['CLIENTNUM'])
+        assert np.allclose(scores['rfc_proba'],
+                           models['rfc'].predict_proba(X_test_values)[:, 1])
+        assert np.allclose(scores['lr_proba'],
+                           models['lr'].predict_proba(X_test_values)[:, 1])
+        assert np.allclose(online[['rfc_proba', 'lr_proba']],
+                           scores.head(20)[['rfc_proba', 'lr_proba']])
+        assert max(batcher.batch_sizes_) > 1
+        assert np.allclose(isolated[['rfc_proba', 'lr_proba']],
+                           online.head(4)[['rfc_proba', 'lr_proba']])
+        assert isinstance(bad_error, (KeyError, ValueError))
+        assert 'Credit_Limit' in str(check_error)
+        churn_scoring.check_record(records[0], loaded)
+        assert unencoded['encoder'] is None and 'without an encoder' in str(encoder_error)
+    except AssertionError as err:
+        logging.error("Testing scoring: scores differ from the model predictions")
+        raise err
+    logging.info("Testing scoring: SUCCESS")
+
+
+def test_explain(feature_split):
+    """
+    test that the shap values add up to the forest probabilities, and that cached and
+    duplicate rows are not explained again
+    """
+    X_train, X_test, y_train, _, _ = feature_split
+    forest = RandomForestClassifier(n_estimators=10, max_depth=4, random_state=42)
+    forest.fit(np.ascontiguousarray(X_train, dtype=np.float32), y_train)
+    background = churn_explain.sample_background(X_train, size=20)
+    rows = pd.concat([X_test.head(30), X_test.head(10)])
+    with tempfile.TemporaryDirectory() as cache_dir:
+        explained = churn_explain.explain(forest, rows, background, batch_size=8, n_jobs=2,
+                                          cache_dir=cache_dir)
+        again = churn_explain.explain(forest, rows.tail(20), background, cache_dir=cache_dir)
+        n_parts = len(glob.glob(os.path.join(cache_dir, '*', '*.parquet')))
+    proba = forest.predict_proba(np.ascontiguousarray(rows, dtype=np.float32))[:, 1]
+    try:
+        assert list(explained.columns) == ['row_hash', 'base_value'] + list(X_test.columns)
+        assert np.allclose(explained['base_value'] + explained[X_test.columns].sum(axis=1),
+                           proba, atol=1e-5)
+        assert explained.tail(10).reset_index(drop=True).equals(
+            explained.head(10).reset_index(drop=True))
+        assert again.equals(explained.tail(20).reset_index(drop=True))
+        assert n_parts == 1
+    except AssertionError as err:
+        logging.error("Testing explain: shap values or cache are not consistent")
+        raise err
+    logging.info("Testing explain: SUCCESS")
+
+
 if __name__ == "__main__":
 
     logging.basicConfig(
@@ -142,9 +760,8 @@ if __name__ == "__main__":
             level=logging.INFO,
             format='%(asctime)s %(message)s', datefmt='%m/%d/%Y %I:%M:%S %p')
     logging.info('Started')
-    test_import()
-    test_eda()
-    test_encoder_helper()
-    test_perform_feature_engineering()
-    test_train_models()
-    logging.info('Finished')
\ No newline at end of file
+    # the tests take their data from the fixtures of conftest.py, extra arguments such
+    # as --fast or -n auto are passed to pytest
+    EXIT_CODE = pytest.main([__file__] + sys.argv[1:])
+    logging.info('Finished')
+    sys.exit(EXIT_CODE)
@@ -0,0 +1,196 @@
+"""
+Random forest search that grows forests along the n_estimators axis instead of
+fitting every n_estimators candidate from scratch
+File: churn_search.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import copy
+import time
+
+import numpy as np
+from scipy.stats import rankdata
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, check_cv
+
+import churn_cache
+
+
+def _grow_and_score(forest, X, y, train, test, checkpoints, keep_forest=True):
+    """
+    grow a warm started forest through the checkpoints, scoring it at each one
+
+    input:
+            forest: forest estimator with warm_start=True, possibly already fitted
+            X, y: full data
+            train, test: row positions of the fold, test is None for a refit
+            checkpoints: increasing numbers of trees
+            keep_forest: if False return None instead of the forest, so worker processes
+                         do not send it back
+    output:
+            forest: forest grown to the last checkpoint
+            scores: test score at each checkpoint (empty for a refit)
+            fit_times: cumulative fit time at each checkpoint
+            trees_fit: number of trees fitted by this call
+    """
+    X_train, y_train = X[train], y[train]
+    forest.set_params(warm_start=True)
+    scores, fit_times, trees_fit, elapsed = [], [], 0, 0.0
+    for n_estimators in checkpoints:
+        grown = len(getattr(forest, 'estimators_', []))
+        if n_estimators > grown:
+            forest.set_params(n_estimators=n_estimators)
+            start = time.perf_counter()
+            forest.fit(X_train, y_train)
+            elapsed += time.perf_counter() - start
+            trees_fit += n_estimators - grown
+        fit_times.append(elapsed)
+        if test is not None:
+            scores.append(_score_first_trees(forest, n_estimators, X[test], y[test]))
+    return forest if keep_forest else None, scores, fit_times, trees_fit
+
+
+def _score_first_trees(forest, n_estimators, X_test, y_test):
+    """
+    accuracy of the forest made of its first n_estimators trees, which is the forest
+    a cold fit with n_estimators trees and the same random_state would produce
+    """
+    if len(forest.estimators_) == n_estimators:
+        return forest.score(X_test, y_test)
+    proba = np.zeros((len(X_test), len(forest.classes_)))
+    for tree in forest.estimators_[:n_estimators]:
+        proba += tree.predict_proba(X_test)
+    proba /= n_estimators
+    return float(np.mean(forest.classes_[np.argmax(proba, axis=1)] == y_test))
+
+
+class WarmStartForestSearch:
+    """
+    cross validated search over a random forest parameter grid where, for each
+    combination of the other parameters and each fold, a single warm started forest is
+    grown through the n_estimators values and scored at each of them. Exposes the
+    GridSearchCV attributes used by the pipeline (best_estimator_, best_params_,
+    best_score_, cv_results_).
+
+    With cache_forests=True the fitted fold and refit forests are kept and keyed by the
+    data and parameters, so fitting the search again (for instance with a larger
+    n_estimators value) keeps growing them instead of starting over.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, n_jobs=None, cache_forests=False):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.cache_forests = cache_forests
+        self.forest_cache_ = {}
+
+    def _forest(self, key, params):
+        """
+        cached forest for key, or a new warm started forest with params
+        """
+        if key in self.forest_cache_:
+            return self.forest_cache_[key]
+        return clone(self.estimator).set_params(warm_start=True, **params)
+
+    def fit(self, X, y):
+        """
+        run the search and refit the best candidate on all the rows
+
+        input:
+                X: training features
+                y: training response
+        output:
+                self
+        """
+        X, y = np.asarray(X), np.asarray(y)
+        data_key = churn_cache.fingerprint(X, y)
+        checkpoints = sorted(self.param_grid['n_estimators'])
+        groups = list(ParameterGrid({key: values for key, values in self.param_grid.items()
+                                     if key != 'n_estimators'}))
+        folds = list(check_cv(self.cv, y, classifier=True).split(X, y))
+
+        tasks = [(group, fold) for group in range(len(groups)) for fold in range(len(folds))]
+        outputs = Parallel(n_jobs=self.n_jobs)(
+            delayed(_grow_and_score)(
+                self._forest((data_key, repr(sorted(groups[group].items())), fold), groups[group]),
+                X, y, folds[fold][0], folds[fold][1], checkpoints, self.cache_forests)
+            for group, fold in tasks)
+
+        self._build_results(groups, checkpoints, len(folds), tasks, outputs)
+        if self.cache_forests:
+            for (group, fold), (forest, _, _, _) in zip(tasks, outputs):
+                self.forest_cache_[(data_key, repr(sorted(groups[group].items())), fold)] = forest
+
+        best_group = {key: value for key, value in self.best_params_.items()
+                      if key != 'n_estimators'}
+        refit_key = (data_key, repr(sorted(best_group.items())), 'refit')
+        n_estimators = self.best_params_['n_estimators']
+        forest, _, _, trees_fit = _grow_and_score(
+            self._forest(refit_key, best_group), X, y, np.arange(len(y)), None,
+            [n_estimators])
+        if self.cache_forests:
+            self.forest_cache_[refit_key] = forest
+        # a cached refit forest may have grown past the best n_estimators: its first
+        # n_estimators trees are the forest a cold fit would give, the cache keeps them all
+        best = copy.copy(forest)
+        best.estimators_ = forest.estimators_[:n_estimators]
+        self.best_estimator_ = best.set_params(n_estimators=n_estimators, warm_start=False)
+        self.trees_fit_ += trees_fit
+        return self
+
+    def _build_results(self, groups, checkpoints, n_folds, tasks, outputs):
+        """
+        fill cv_results_ and the best_* attributes, with the candidates in the same order
+        and ranked the same way as GridSearchCV
+        """
+        params = list(ParameterGrid(self.param_grid))
+        position = {repr(sorted(param.items())): index for index, param in enumerate(params)}
+        scores = np.zeros((len(params), n_folds))
+        fit_times = np.zeros((len(params), n_folds))
+        self.trees_fit_ = 0
+        for (group, fold), (_, fold_scores, fold_times, trees_fit) in zip(tasks, outputs):
+            for n_estimators, score, fit_time in zip(checkpoints, fold_scores, fold_times):
+                row = position[repr(sorted(dict(groups[group], n_estimators=n_estimators).items()))]
+                scores[row, fold] = score
+                fit_times[row, fold] = fit_time
+            self.trees_fit_ += trees_fit
+
+        mean_scores = scores.mean(axis=1)
+        self.cv_results_ = {'params': params,
+                            'mean_test_score': mean_scores,
+                            'std_test_score': scores.std(axis=1),
+                            'rank_test_score': rankdata(-mean_scores, method='min').astype(int),
+                            'mean_fit_time': fit_times.mean(axis=1),
+                            'std_fit_time': fit_times.std(axis=1),
+                            'mean_score_time': np.full(len(params), np.nan)}
+        for fold in range(n_folds):
+            self.cv_results_['split%d_test_score' % fold] = scores[:, fold]
+        for key in self.param_grid:
+            self.cv_results_['param_%s' % key] = np.array([param[key] for param in params],
+                                                          dtype=object)
+        self.best_index_ = int(self.cv_results_['rank_test_score'].argmin())
+        self.best_params_ = params[self.best_index_]
+        self.best_score_ = float(mean_scores[self.best_index_])
+        # trees a grid search would fit for the same candidates and folds
+        self.trees_grid_ = len(groups) * n_folds * sum(checkpoints)
+
+    def predict(self, X):
+        """
+        predict with the refitted best forest
+        """
+        return self.best_estimator_.predict(X)
+
+    def predict_proba(self, X):
+        """
+        predict probabilities with the refitted best forest
+        """
+        return self.best_estimator_.predict_proba(X)
+
+    def score(self, X, y):
+        """
+        accuracy of the refitted best forest
+        """
+        return self.best_estimator_.score(X, y)
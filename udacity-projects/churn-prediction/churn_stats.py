@@ -0,0 +1,162 @@
+"""
+Streaming statistics accumulated chunk by chunk, for the approximate eda of frames
+that are too large to plot directly
+File: churn_stats.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import math
+
+import numpy as np
+import pandas as pd
+
+
+def update_bincount(state, values):
+    """
+    add the counts of the integer values of a chunk to state
+
+    input:
+            state: dict with 'offset' (smallest value seen) and 'counts', or None
+            values: array of integers
+    output:
+            state: updated dict, counts[i] is the number of values equal to offset + i
+    """
+    values = np.asarray(values, dtype=np.int64)
+    if values.size == 0:
+        return state
+    low = int(values.min())
+    counts = np.bincount(values - low)
+    if state is None:
+        return {'offset': low, 'counts': counts}
+
+    offset = min(state['offset'], low)
+    size = max(state['offset'] + len(state['counts']), low + len(counts)) - offset
+    merged = np.zeros(size, dtype=np.int64)
+    start = state['offset'] - offset
+    merged[start:start + len(state['counts'])] += state['counts']
+    merged[low - offset:low - offset + len(counts)] += counts
+    return {'offset': offset, 'counts': merged}
+
+
+def histogram_from_bincount(state, bins=10, density=False):
+    """
+    returns the histogram of the counted values with equal width bins over their range,
+    the same bins numpy (and pandas Series.hist) would use on the raw values
+
+    input:
+            state: dict returned by update_bincount
+            bins: number of bins
+            density: normalize the histogram to a density
+    output:
+            hist: counts (or densities) of each bin
+            edges: bin edges
+    """
+    values = state['offset'] + np.arange(len(state['counts']))
+    present = state['counts'] > 0
+    return np.histogram(values[present], bins=bins, weights=state['counts'][present],
+                        density=density)
+
+
+def update_value_counts(state, serie):
+    """
+    add the level counts of a chunk to state
+
+    input:
+            state: pandas series of counts indexed by level, or None
+            serie: pandas series of a categorical column
+    output:
+            state: updated pandas series of counts
+    """
+    counts = serie.value_counts()
+    return counts if state is None else state.add(counts, fill_value=0)
+
+
+def update_reservoir(state, values, sample_size, rng):
+    """
+    keep a uniform random sample of sample_size values of the stream (algorithm R,
+    vectorized over the chunk)
+
+    input:
+            state: dict with the 'sample' array and the number of values 'seen', or None
+            values: array of the chunk
+            sample_size: size of the reservoir
+            rng: numpy random Generator
+    output:
+            state: updated dict
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if state is None:
+        state = {'sample': np.empty(0), 'seen': 0}
+    sample, seen = state['sample'], state['seen']
+
+    free = max(sample_size - len(sample), 0)
+    sample = np.concatenate([sample, values[:free]])
+    rest = values[free:]
+    if rest.size:
+        positions = seen + free + np.arange(rest.size)
+        slots = rng.integers(0, positions + 1)
+        keep = slots < sample_size
+        # later values overwrite earlier ones landing on the same slot, as in the
+        # sequential algorithm
+        sample[slots[keep]] = rest[keep]
+    return {'sample': sample, 'seen': seen + values.size}
+
+
+def dkw_bound(sample_size, alpha=0.05):
+    """
+    returns the Dvoretzky-Kiefer-Wolfowitz bound: with probability 1 - alpha the
+    empirical cdf of a uniform sample of sample_size values is within this distance
+    of the cdf of the full data
+
+    input:
+            sample_size: number of sampled values
+            alpha: probability that the bound does not hold
+    output:
+            epsilon: sup norm bound on the cdf error
+    """
+    return math.sqrt(math.log(2 / alpha) / (2 * sample_size))
+
+
+def update_moments(state, frame):
+    """
+    add the sufficient statistics of the correlation matrix of a chunk to state: row
+    count, sums and cross products. Values are shifted by the means of the first chunk
+    to keep the sums of squares accurate
+
+    input:
+            state: dict returned by a previous call, or None
+            frame: pandas dataframe of numeric columns
+    output:
+            state: dict with 'columns', 'shift', 'n', 'sums' and 'cross'
+    """
+    values = frame.to_numpy(dtype=np.float64)
+    if state is None:
+        state = {'columns': list(frame.columns),
+                 'shift': values.mean(axis=0),
+                 'n': 0,
+                 'sums': np.zeros(values.shape[1]),
+                 'cross': np.zeros((values.shape[1], values.shape[1]))}
+    centered = values - state['shift']
+    return {'columns': state['columns'],
+            'shift': state['shift'],
+            'n': state['n'] + len(values),
+            'sums': state['sums'] + centered.sum(axis=0),
+            'cross': state['cross'] + centered.T @ centered}
+
+
+def correlation_from_moments(state):
+    """
+    returns the pearson correlation matrix of the streamed rows
+
+    input:
+            state: dict returned by update_moments
+    output:
+            corr: pandas dataframe
+    """
+    mean = state['sums'] / state['n']
+    cov = state['cross'] / state['n'] - np.outer(mean, mean)
+    std = np.sqrt(np.diag(cov))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.outer(std, std)
+    return pd.DataFrame(corr, index=state['columns'], columns=state['columns'])
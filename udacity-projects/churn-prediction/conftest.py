@@ -0,0 +1,116 @@
+"""
+Session fixtures of churn_script_logging_and_tests.py: the data is loaded and encoded
+once per test session (once per worker under pytest-xdist) and every worker writes
+its data cache, images and models to its own temporary folders
+File: conftest.py
+Author: Marcelo
+Date: Oct 18 2026
+"""
+
+import os
+
+import pytest
+from sklearn.model_selection import train_test_split
+
+import churn_library as cls
+
+
+CATEGORY_LIST = ["Gender",
+                 "Education_Level",
+                 "Marital_Status",
+                 "Income_Category",
+                 "Card_Category"]
+
+# fast mode trains on a stratified sample of the data with a reduced grid
+FAST_SAMPLE_SIZE = 2000
+FAST_PARAM_GRID = {
+    'n_estimators': [20, 50],
+    'max_features': ['sqrt'],
+    'max_depth': [4, None],
+    'criterion': ['gini']
+}
+
+
+def pytest_addoption(parser):
+    parser.addoption("--fast", action="store_true",
+                     help="train on a small stratified sample with a reduced grid "
+                          "(also enabled by CHURN_FAST_TESTS=1)")
+
+
+@pytest.fixture(scope='session')
+def fast(request):
+    """
+    True when the tests run in fast mode
+    """
+    return request.config.getoption("fast") or os.environ.get('CHURN_FAST_TESTS') == '1'
+
+
+@pytest.fixture(scope='session')
+def category_list():
+    """
+    categorical columns of bank_data
+    """
+    return list(CATEGORY_LIST)
+
+
+@pytest.fixture(scope='session')
+def bank_data(tmp_path_factory):
+    """
+    bank_data loaded once per session, tests must not modify it. Each xdist worker has
+    its own feather cache, load_cached removes the stale entries of a shared one while
+    other workers read them
+    """
+    return cls.import_data('data/bank_data.csv',
+                           cache_dir=str(tmp_path_factory.mktemp('cache')))
+
+
+@pytest.fixture
+def data(bank_data):
+    """
+    copy of bank_data that a test can modify
+    """
+    return bank_data.copy()
+
+
+@pytest.fixture(scope='session')
+def feature_split(bank_data, category_list):
+    """
+    X_train, X_test, y_train, y_test and encoder of the whole data
+    """
+    return cls.perform_feature_engineering(bank_data, category_list, return_encoder=True)
+
+
+@pytest.fixture(scope='session')
+def training_split(fast, bank_data, category_list, feature_split):
+    """
+    split used to train the models: the whole data, or a stratified sample of
+    FAST_SAMPLE_SIZE rows in fast mode
+    """
+    if not fast:
+        return feature_split
+    sample, _ = train_test_split(bank_data, train_size=FAST_SAMPLE_SIZE,
+                                 stratify=bank_data['Churn'], random_state=42)
+    return cls.perform_feature_engineering(sample, category_list, return_encoder=True)
+
+
+@pytest.fixture(scope='session')
+def param_grid(fast):
+    """
+    random forest grid of train_models
+    """
+    return FAST_PARAM_GRID if fast else cls.RF_PARAM_GRID
+
+
+@pytest.fixture(scope='session')
+def output_dirs(tmp_path_factory):
+    """
+    image and model folders of the session, unique to each xdist worker
+    """
+    root = tmp_path_factory.mktemp('outputs')
+    dirs = {'images': root / 'images',
+            'eda': root / 'images' / 'eda',
+            'results': root / 'images' / 'results',
+            'models': root / 'models'}
+    for path in dirs.values():
+        path.mkdir(parents=True, exist_ok=True)
+    return {name: str(path) for name, path in dirs.items()}